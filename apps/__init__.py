@@ -58,6 +58,10 @@ def internal_server_error(e):
 def create_app(config="config.DevelopmentConfig"):
     app = Flask(__name__)
 
+    # Streams uploaded files to disk.
+    from .imager.ingest import IngestRequest
+    app.request_class = IngestRequest
+
     app.register_error_handler(401, unauthorized)
     app.register_error_handler(403, forbidden)
     app.register_error_handler(404, page_not_found)
@@ -90,6 +94,20 @@ def create_app(config="config.DevelopmentConfig"):
 
     login_manager.login_view = 'auth.login'
 
+    # Caches users loaded by Flask-Login for each request.
+    from .cache import TTLCache
+    app.extensions["user_cache"] = TTLCache(
+        ttl=float(app.config.get("USER_CACHE_TTL") or 0),
+        maxsize=int(app.config.get("USER_CACHE_SIZE") or 1024))
+
+    # Caches gallery pages of anonymous users.
+    from .cache import create_page_cache
+    app.extensions["page_cache"] = create_page_cache(
+        app.config.get("PAGE_CACHE_BACKEND"),
+        ttl=float(app.config.get("PAGE_CACHE_TTL") or 0),
+        maxsize=int(app.config.get("PAGE_CACHE_SIZE") or 256),
+        path=app.config.get("PAGE_CACHE_PATH"))
+
     from .oauth2_config import config_oauth
     config_oauth(app)
 
@@ -5,7 +5,9 @@ from flask import (
     flash,
     redirect,
     url_for,
-    request)
+    request,
+    jsonify,
+    current_app)
 
 from flask_login import (
     login_required,
@@ -335,3 +337,13 @@ def delete_role(role_id):
         active_permissions=active_permissions,
         role_id=role_id,
         form=delete_role_form)
+
+
+@admin_panel_bp.route("/cache/stats")
+@can_view_admin_dashboard
+def cache_stats():
+    user_cache = current_app.extensions["user_cache"]
+    page_cache = current_app.extensions["page_cache"]
+    return jsonify(
+        user_cache=user_cache.stats(),
+        page_cache=page_cache.stats())
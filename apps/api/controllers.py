@@ -244,6 +244,31 @@ def image_content_pagination(obj, page=1):
     return image_pagination.items
 
 
+def image_content_keyset_pagination(obj, category, sort_order, cursor=None):
+    """
+    Takes Models objects and loads the page after the cursor.
+
+    Args:
+      obj: Model object to be paginated.
+      category: Category obj is sorted by i.e upload_time, score.
+      sort_order: Sort order of obj i.e asc, desc.
+      cursor: Cursor of the page to be loaded, None or '' for first page.
+
+    Returns:
+      Tuple of list of ImageContent and cursor of the next page
+      (None if last page) or (None, None) if parameters are invalid.
+    """
+    per_page = min(
+        int(current_app.config["API_PER_PAGE"]),
+        int(current_app.config["API_MAX_PER_PAGE"]))
+    return imager.controllers.image_content_keyset_pagination(
+        obj,
+        category,
+        sort_order,
+        cursor=cursor,
+        per_page=per_page)
+
+
 def get_image_contents_by_id(image_id):
     """
     Loads specific ImageContent model filtered by id.
@@ -272,10 +297,12 @@ def get_image_contents_by_time(sort_order="asc"):
     """
     if sort_order == "asc":
         image_content = imager_models.ImageContent.query.order_by(
-            imager_models.ImageContent.upload_time.asc())
+            imager_models.ImageContent.upload_time.asc(),
+            imager_models.ImageContent.id.asc())
     elif sort_order == "desc":
         image_content = imager_models.ImageContent.query.order_by(
-            imager_models.ImageContent.upload_time.desc())
+            imager_models.ImageContent.upload_time.desc(),
+            imager_models.ImageContent.id.desc())
     else:
         image_content = None
     return image_content
@@ -293,23 +320,43 @@ def get_image_contents_by_score(sort_order="asc"):
       ImageContent object.
     """
     if sort_order == "asc":
-        image_content = imager_models.ImageContent.query.select_from(
-            imager_models.ImageContent).outerjoin(
-            imager_models.VoteCounter).group_by(
-            imager_models.ImageContent).order_by(
-            nulls_first(asc(func.sum(imager_models.VoteCounter.vote))))
+        image_content = imager_models.ImageContent.query.order_by(
+            imager_models.ImageContent.score.asc(),
+            imager_models.ImageContent.id.asc())
     elif sort_order == "desc":
-        image_content = imager_models.ImageContent.query.select_from(
-            imager_models.ImageContent).outerjoin(
-            imager_models.VoteCounter).group_by(
-            imager_models.ImageContent).order_by(
-            nulls_last(desc(func.sum(imager_models.VoteCounter.vote))))
+        image_content = imager_models.ImageContent.query.order_by(
+            imager_models.ImageContent.score.desc(),
+            imager_models.ImageContent.id.desc())
     else:
         image_content = None
 
     return image_content
 
 
+def image_metrics(image_ids):
+    """
+    Loads aggregated ImageContent voting metric for multiple images
+    using a single query.
+
+    Args:
+      image_ids: List of Image IDs.
+
+    Returns:
+      Dict of ImageContent aggregated voting metric keyed by Image ID,
+      Image IDs that don't exist are left out.
+    """
+    metrics = {}
+    for image_id, (score, upvotes, downvotes) in \
+            imager.controllers.image_scores(image_ids).items():
+        metric_dict = {}
+        no_votes = upvotes == 0 and downvotes == 0
+        metric_dict['total'] = None if no_votes else score
+        metric_dict['upvotes'] = upvotes or None
+        metric_dict['downvotes'] = downvotes or None
+        metrics[image_id] = metric_dict
+    return metrics
+
+
 def image_metric(image_id):
     """
     Loads aggregated ImageContent voting metric filtered by image_id.
@@ -320,29 +367,4 @@ def image_metric(image_id):
     Returns:
       ImageContent aggregated voting metric.
     """
-    image_content = imager_models.ImageContent().query.filter_by(
-        file_id=image_id).first()
-    metric_dict = {}
-    if image_content:
-        vote_enum = imager_models.VoteEnum
-        sum_aggr = imager_models.VoteCounter.query.with_entities(
-            func.sum(imager_models.VoteCounter.vote).filter(
-                imager_models.VoteCounter.image_file_id == image_id
-            ).label(
-                'total'),
-            func.sum(imager_models.VoteCounter.vote).filter(
-                imager_models.VoteCounter.image_file_id == image_id,
-                imager_models.VoteCounter.vote == vote_enum.UPVOTE.value
-            ).label(
-                'upvotes'),
-            func.sum(imager_models.VoteCounter.vote).filter(
-                imager_models.VoteCounter.image_file_id == image_id,
-                imager_models.VoteCounter.vote == vote_enum.DOWNVOTE.value
-            ).label(
-                'downvotes')).first()
-        metric_dict['total'] = sum_aggr.total
-        metric_dict['upvotes'] = sum_aggr.upvotes
-        metric_dict['downvotes'] = sum_aggr.downvotes
-        return metric_dict
-    else:
-        return None
+    return image_metrics([image_id]).get(image_id)
@@ -14,6 +14,10 @@ from .utils import *
 
 from .. import csrf
 from .. import limiter
+from ..search import (
+    count_results,
+    decode_search_cursor,
+    encode_search_cursor)
 
 from flask_login import (
     login_required,
@@ -137,21 +141,61 @@ def search(search_value):
         "results": {}
     }
 
-    # Search by username
+    # Request Arguments
+    limit = request.args.get(
+        "limit",
+        default=current_app.config["SEARCH_RESULT_LIMIT"],
+        type=int)
+    cursor = request.args.get("cursor", default=None, type=str)
+    total = request.args.get("total", default="false", type=str) == "true"
+
+    max_results = current_app.config["SEARCH_MAX_RESULTS"]
+    offset = decode_search_cursor(cursor or "")
+    if offset is None:
+        api_data["message"] = "Invalid cursor."
+        api_data["status"] = 400
+        return jsonify(api_data), 400
+    if limit < 1 or limit > current_app.config["API_MAX_PER_PAGE"]:
+        api_data["message"] = "Invalid limit."
+        api_data["status"] = 400
+        return jsonify(api_data), 400
+
+    # Results past max_results aren't paginated.
+    limit = max(min(limit, max_results - offset), 0)
+
+    # Loads an extra result of each to check if there's a next page.
     from .. import auth
-    search_user_results = auth.controllers.search_by_username(search_value)
+    from .. import imager as img_
+    search_results = {
+        "users": auth.controllers.search_by_username(
+            search_value,
+            limit + 1,
+            offset),
+        "image": img_.controllers.search_by_title(
+            search_value,
+            limit=limit + 1,
+            offset=offset),
+        "tags": img_.controllers.search_by_tags(
+            search_value,
+            limit + 1,
+            offset),
+    }
+    has_next = any(
+        len(results) > limit for results in search_results.values())
+    search_results = {
+        name: results[:limit] for name, results in search_results.items()}
+
+    # Search by username
     api_data["results"]['users'] = []
-    for user in search_user_results:
+    for user in search_results["users"]:
         data_dict = {}
         data_dict["username"] = user.username
 
         api_data["results"]['users'].append(data_dict)
 
-    from .. import imager as img_
     # Search by image title
-    search_title_results = img_.controllers.search_by_title(search_value)
     api_data["results"]['image'] = []
-    for image in search_title_results:
+    for image in search_results["image"]:
         data_dict = {}
         data_dict["title"] = image.title
         data_dict["image_id"] = image.file_id
@@ -159,15 +203,79 @@ def search(search_value):
         api_data["results"]['image'].append(data_dict)
 
     # Search by tag
-    search_tag_results = img_.controllers.search_by_tags(search_value)
     api_data["results"]['tags'] = []
-    for tag in search_tag_results:
+    for tag in search_results["tags"]:
         data_dict = {}
         data_dict["id"] = tag.id
         data_dict["tag_name"] = tag.tag_name
 
         api_data["results"]['tags'].append(data_dict)
 
+    if total:
+        # Counted up to max_results.
+        from ..search import search as search_query
+        api_data["totals"] = {
+            "users": count_results(
+                search_query(auth.models.User, search_value),
+                max_results)[0],
+            "image": count_results(
+                search_query(img_.models.ImageContent, search_value),
+                max_results)[0],
+            "tags": count_results(
+                search_query(img_.models.Tags, search_value),
+                max_results)[0],
+        }
+
+    if cursor is not None:
+        api_data["next_cursor"] = encode_search_cursor(offset + limit) \
+            if has_next and offset + limit < max_results else None
+
+    api_data['status'] = 200
+    return jsonify(api_data), 200
+
+
+@api_bp.route('/suggest/<string:search_value>')
+@csrf.exempt
+@internal_api_limit
+def suggest(search_value):
+    api_data = {
+        "results": {}
+    }
+    limit = current_app.config["SEARCH_RESULT_LIMIT"]
+
+    # Served from memory, same results format as search.
+    from ..suggest import get_suggestion_index
+    suggestion_index = get_suggestion_index()
+
+    api_data["results"]['users'] = []
+    for _, username in suggestion_index.suggest("user", search_value, limit):
+        data_dict = {}
+        data_dict["username"] = username
+
+        api_data["results"]['users'].append(data_dict)
+
+    api_data["results"]['image'] = []
+    for file_id, title in suggestion_index.suggest(
+            "image",
+            search_value,
+            limit):
+        data_dict = {}
+        data_dict["title"] = title
+        data_dict["image_id"] = file_id
+
+        api_data["results"]['image'].append(data_dict)
+
+    api_data["results"]['tags'] = []
+    for tag_id, tag_name in suggestion_index.suggest(
+            "tag",
+            search_value,
+            limit):
+        data_dict = {}
+        data_dict["id"] = int(tag_id)
+        data_dict["tag_name"] = tag_name
+
+        api_data["results"]['tags'].append(data_dict)
+
     api_data['status'] = 200
     return jsonify(api_data), 200
 
@@ -189,13 +297,16 @@ def load_image(image_id):
     api_data = []
     if image_contents:
         try:
+            image_contents = image_contents.all()
+            metrics = image_metrics(
+                [image_content.file_id for image_content in image_contents])
             for image_content in image_contents:
                 data_dict = {}
                 data_dict["title"] = image_content.title
                 data_dict["image_id"] = image_content.file_id
                 data_dict["upload_time"] = image_content.upload_time
                 data_dict["description"] = image_content.description
-                data_dict["metric"] = image_metric(image_content.file_id)
+                data_dict["metric"] = metrics.get(image_content.file_id)
                 data_dict["url"] = url_for(
                     'imager.load_image_by_id', image_id=image_content.file_id)
                 api_data.append(data_dict)
@@ -213,6 +324,57 @@ def load_image(image_id):
     return jsonify(api_dict), api_status
 
 
+@api_bp.route('/gallery/image/<string:image_id>/similar')
+@external_api_limit
+def load_similar_images(image_id):
+    # Assumes no issue will occur otherwise will be changed.
+    message = "Successful."
+    api_status = 200
+
+    from .. import imager
+    max_distance = request.args.get(
+        "distance",
+        default=imager.similarity.MAX_HASH_DISTANCE,
+        type=int)
+
+    similar_images = None
+    image_content = imager.controllers.get_image_content_by_id(image_id)
+    if image_content is None:
+        message = "Image not found."
+        api_status = 404
+    elif not 0 <= max_distance <= imager.similarity.MAX_HASH_DISTANCE:
+        message = "Distance must be between 0 and {}.".format(
+            imager.similarity.MAX_HASH_DISTANCE)
+        api_status = 400
+    else:
+        similar_images = imager.similarity.find_similar_images(
+            image_content,
+            max_distance)
+        if similar_images is None:
+            message = "Image hasn't been hashed yet."
+            api_status = 409
+
+    api_data = []
+    if similar_images:
+        for distance, similar_image_content in similar_images:
+            data_dict = {}
+            data_dict["title"] = similar_image_content.title
+            data_dict["image_id"] = similar_image_content.file_id
+            data_dict["upload_time"] = similar_image_content.upload_time
+            data_dict["distance"] = distance
+            data_dict["url"] = url_for(
+                'imager.load_image_by_id',
+                image_id=similar_image_content.file_id)
+            api_data.append(data_dict)
+
+    api_dict = {
+        "data": api_data,
+        "message": message,
+        "status": api_status
+    }
+    return jsonify(api_dict), api_status
+
+
 @api_bp.route('/gallery/user/<string:username>')
 @api_bp.route('/gallery/user/<string:username>/<string:category>')
 @api_bp.route(
@@ -225,6 +387,8 @@ def load_images_by_user(username, category="upload_time", sort="desc"):
 
     # Request Arguments
     page = request.args.get("p", default=1, type=int)
+    cursor = request.args.get("cursor", default=None, type=str)
+    next_cursor = None
 
     if username is None:
         message = "Requires username."
@@ -242,17 +406,31 @@ def load_images_by_user(username, category="upload_time", sort="desc"):
             category,
             sort)
 
+    if image_contents and cursor is not None:
+        # Keyset pagination if cursor is passed, '' for first page.
+        image_contents, next_cursor = image_content_keyset_pagination(
+            image_contents,
+            category,
+            sort,
+            cursor)
+        if image_contents is None:
+            message = "Invalid cursor."
+            api_status = 400
+    elif image_contents:
+        image_contents = image_content_pagination(image_contents, page)
+
     api_data = []
     if image_contents:
         try:
-            image_contents = image_content_pagination(image_contents, page)
+            metrics = image_metrics(
+                [image_content.file_id for image_content in image_contents])
             for image_content in image_contents:
                 data_dict = {}
                 data_dict["title"] = image_content.title
                 data_dict["image_id"] = image_content.file_id
                 data_dict["upload_time"] = image_content.upload_time
                 data_dict["description"] = image_content.description
-                data_dict["metric"] = image_metric(image_content.file_id)
+                data_dict["metric"] = metrics.get(image_content.file_id)
                 data_dict["url"] = url_for(
                     'imager.load_image_by_id', image_id=image_content.file_id)
                 api_data.append(data_dict)
@@ -267,6 +445,8 @@ def load_images_by_user(username, category="upload_time", sort="desc"):
         "message": message,
         "status": api_status
     }
+    if cursor is not None:
+        api_dict["next_cursor"] = next_cursor
     return jsonify(api_dict), api_status
 
 
@@ -281,6 +461,8 @@ def load_gallery(category="upload_time", sort="desc"):
 
     # Request Arguments.
     page = request.args.get("p", default=1, type=int)
+    cursor = request.args.get("cursor", default=None, type=str)
+    next_cursor = None
 
     if category == "upload_time":
         image_contents = get_image_contents_by_time(sort)
@@ -291,17 +473,31 @@ def load_gallery(category="upload_time", sort="desc"):
         api_status = 400
         message = "Invalid requests."
 
+    if image_contents and cursor is not None:
+        # Keyset pagination if cursor is passed, '' for first page.
+        image_contents, next_cursor = image_content_keyset_pagination(
+            image_contents,
+            category,
+            sort,
+            cursor)
+        if image_contents is None:
+            message = "Invalid cursor."
+            api_status = 400
+    elif image_contents:
+        image_contents = image_content_pagination(image_contents, page)
+
     api_data = []
     if image_contents:
         try:
-            image_contents = image_content_pagination(image_contents, page)
+            metrics = image_metrics(
+                [image_content.file_id for image_content in image_contents])
             for image_content in image_contents:
                 data_dict = {}
                 data_dict["title"] = image_content.title
                 data_dict["image_id"] = image_content.file_id
                 data_dict["upload_time"] = image_content.upload_time
                 data_dict["description"] = image_content.description
-                data_dict["metric"] = image_metric(image_content.file_id)
+                data_dict["metric"] = metrics.get(image_content.file_id)
                 data_dict["url"] = url_for(
                     'imager.load_image_by_id', image_id=image_content.file_id)
                 api_data.append(data_dict)
@@ -316,6 +512,8 @@ def load_gallery(category="upload_time", sort="desc"):
         "message": message,
         "status": api_status
     }
+    if cursor is not None:
+        api_dict["next_cursor"] = next_cursor
     return jsonify(api_dict), api_status
 
 
@@ -529,29 +727,24 @@ def vote_counter(image_id, vote_action):
 
     from .. import imager as img_
 
-    # Checks if image id is valid and image exists.
-    image_exists = img_.controllers.get_image_content_by_id(image_id)
-    if len(image_exists) == 0:
-        return jsonify(message="Image doesn't exist.", status=404), 404
-
-    # Perform vote action.
     if vote_action == "up":
-        vote_status = img_.controllers.upvote(user, image_id)
+        vote = img_.models.VoteEnum.UPVOTE.value
     elif vote_action == "down":
-        vote_status = img_.controllers.downvote(user, image_id)
+        vote = img_.models.VoteEnum.DOWNVOTE.value
     else:
         return jsonify(message="Invalid parameter.", status=400), 400
 
-    # Get metric information.
-    metric_data = None
-    if vote_status:
-        metric_data = img_.controllers.image_metric(image_id)
-        if metric_data is not None:
-            metric_data["status"] = 200
-            metric_data["message"] = "Success."
+    # Perform vote action, returns metric information or None if image
+    # doesn't exist.
+    metric_data = img_.controllers.vote_image(user, image_id, vote)
+    if metric_data is not None:
+        metric_data["status"] = 200
+        metric_data["message"] = "Success."
+    elif img_.controllers.get_image_content_by_id(image_id) is None:
+        return jsonify(message="Image doesn't exist.", status=404), 404
 
     # Check if error occured on the server, return 500 status code if so.
-    if vote_status is False or metric_data is None:
+    if metric_data is None:
         metric_data = {}
         metric_data["status"] = 500
         metric_data["message"] = "An error occured in the server and"\
@@ -1,4 +1,5 @@
 from .. import db
+from ..search import search
 from . import models
 from .. import login_manager
 
@@ -10,6 +11,9 @@ from .utils import (
 
 from flask import current_app
 
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
 from itsdangerous.url_safe import URLSafeTimedSerializer
 from itsdangerous.exc import BadSignature, SignatureExpired
 
@@ -19,7 +23,88 @@ from email_validator import validate_email, EmailNotValidError
 # Tells Flask-login how to load users given an id.
 @login_manager.user_loader
 def load_user(id):
-    return models.User.query.get(int(id))
+    user_cache = current_app.extensions["user_cache"]
+    if not user_cache.enabled:
+        return models.User.query.get(int(id))
+
+    # Cached users are tagged with generations of the user and of all users,
+    # read before loading so changes committed meanwhile miss next time.
+    generation = models.cached_user_generation(int(id))
+    cached_user = user_cache.get(int(id))
+    if cached_user is not None and cached_user[0] == generation:
+        return restore_cached_user(cached_user[1])
+
+    user = models.User.query.get(int(id))
+    if user is not None:
+        user_cache.set(user.id, (generation, cache_user(user)))
+    return user
+
+
+def column_values(obj):
+    """
+    Gets column values of a model object.
+
+    Args:
+      obj: Model object.
+
+    Returns:
+      Dict of column values keyed by attribute name.
+    """
+    return {
+        column.key: getattr(obj, column.key)
+        for column in inspect(obj).mapper.column_attrs}
+
+
+def cache_user(user):
+    """
+    Copies User, Role and Permissions column values to be cached, model
+    objects are bound to a session so can't be shared between requests.
+
+    Args:
+      user: User object.
+
+    Returns:
+      Dict of User details.
+    """
+    role = None
+    permissions = []
+    if user.role is not None:
+        role = column_values(user.role)
+        permissions = [
+            column_values(permission)
+            for permission in user.role.permissions]
+
+    return {
+        "user": column_values(user),
+        "role": role,
+        "permissions": permissions}
+
+
+def restore_cached_user(cached_user):
+    """
+    Rebuilds User from cached details and adds it to the session without
+    querying the database.
+
+    Args:
+      cached_user: Dict of User details created by cache_user.
+
+    Returns:
+      User object.
+    """
+    user = models.User(**cached_user["user"])
+    role = None
+    if cached_user["role"] is not None:
+        role = models.Role(**cached_user["role"])
+        role.permissions = [
+            models.Permissions(**permission)
+            for permission in cached_user["permissions"]]
+        for permission in role.permissions:
+            make_transient_to_detached(permission)
+        make_transient_to_detached(role)
+    user.role = role
+    make_transient_to_detached(user)
+
+    return db.session.merge(user, load=False)
 
 
 def generate_token(email, token_type):
@@ -328,20 +413,19 @@ def add_User(user_details):
         return False
 
 
-def search_by_username(search_value):
+def search_by_username(search_value, limit=None, offset=None):
     """
     Search User model by username.
 
     Args:
       search_value: Search value.
+      limit: Max number of results, all if None.
+      offset: Number of results skipped.
 
     Returns:
-      Username query results.
+      Username query results ordered by rank.
     """
-    # user_ = models.User()
-    search = "%{}%".format(search_value)
-    usernames = db.session.query(models.User).filter(
-        models.User.username.ilike(search)).all()
+    usernames = search(models.User, search_value, limit, offset).all()
     return usernames
 
 
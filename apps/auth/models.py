@@ -1,6 +1,12 @@
 from .. import db
+from ..search import register_search_index
+from ..suggest import register_suggestions
 from enum import Enum, auto
 
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
 from flask_login import UserMixin
 
 
@@ -17,6 +23,12 @@ class PermissionsEnum(Enum):
 # Permission Table
 class Permissions(db.Model):
     __tablename__ = "permissions"
+    __table_args__ = (
+        db.Index(
+            "ix_permissions_role_id_permission",
+            "role_id",
+            "permission"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     role_id = db.Column(db.Integer, db.ForeignKey('role.id'), nullable=False)
@@ -74,6 +86,34 @@ class User(UserMixin, db.Model):
         """
         return self.active
 
+    def get_permissions(self):
+        """
+        Gets permissions of user's role, resolved once from the eagerly
+        loaded role permissions until the user is expired or refreshed
+        e.g after a commit.
+
+        Returns:
+          Frozenset of PermissionsEnum.
+        """
+        permissions = getattr(self, "_permissions", None)
+        if permissions is None:
+            role_permissions = set()
+            if self.role is not None:
+                role_permissions = set(
+                    permission.permission
+                    for permission in self.role.permissions)
+            permissions = frozenset(
+                permission for permission in PermissionsEnum
+                if permission.value in role_permissions)
+            self._permissions = permissions
+        return permissions
+
+    def invalidate_permissions(self):
+        """
+        Clears resolved permissions, next check reloads them from the role.
+        """
+        self._permissions = None
+
     def can_view_admin_dashboard(self):
         """
         Checks whether user has role with permission to view admin dashboard.
@@ -81,12 +121,7 @@ class User(UserMixin, db.Model):
         Returns:
           Boolean value.
         """
-        permission = Permissions.query.filter_by(
-            role_id=self.user_role,
-            permission=PermissionsEnum.CAN_VIEW_ADMIN.value).first()
-        if permission:
-            return True
-        return False
+        return PermissionsEnum.CAN_VIEW_ADMIN in self.get_permissions()
 
     def can_update_admin_dashboard(self):
         """
@@ -95,13 +130,7 @@ class User(UserMixin, db.Model):
         Returns:
           Boolean value.
         """
-        permission = Permissions.query.filter_by(
-            role_id=self.user_role,
-            permission=PermissionsEnum.CAN_UPDATE_ADMIN.value).first()
-
-        if permission:
-            return True
-        return False
+        return PermissionsEnum.CAN_UPDATE_ADMIN in self.get_permissions()
 
     def can_delete_admin_dashboard(self):
         """
@@ -111,13 +140,7 @@ class User(UserMixin, db.Model):
         Returns:
           Boolean value.
         """
-        permission = Permissions.query.filter_by(
-            role_id=self.user_role,
-            permission=PermissionsEnum.CAN_DELETE_ADMIN.value).first()
-
-        if permission:
-            return True
-        return False
+        return PermissionsEnum.CAN_DELETE_ADMIN in self.get_permissions()
 
     def can_insert_admin_dashboard(self):
         """
@@ -127,12 +150,7 @@ class User(UserMixin, db.Model):
         Returns:
           Boolean value.
         """
-        permission = Permissions.query.filter_by(
-            role_id=self.user_role,
-            permission=PermissionsEnum.CAN_INSERT_ADMIN.value).first()
-        if permission:
-            return True
-        return False
+        return PermissionsEnum.CAN_INSERT_ADMIN in self.get_permissions()
 
     def can_view_main_dashboard(self):
         """
@@ -141,12 +159,7 @@ class User(UserMixin, db.Model):
         Returns:
           Boolean value.
         """
-        permission = Permissions.query.filter_by(
-            role_id=self.user_role,
-            permission=PermissionsEnum.CAN_VIEW_DASHBOARD.value).first()
-        if permission:
-            return True
-        return False
+        return PermissionsEnum.CAN_VIEW_DASHBOARD in self.get_permissions()
 
     def can_post_main_dashboard(self):
         """
@@ -155,12 +168,7 @@ class User(UserMixin, db.Model):
         Returns:
           Boolean value.
         """
-        permission = Permissions.query.filter_by(
-            role_id=self.user_role,
-            permission=PermissionsEnum.CAN_POST_DASHBOARD.value).first()
-        if permission:
-            return True
-        return False
+        return PermissionsEnum.CAN_POST_DASHBOARD in self.get_permissions()
 
     def check_hash(self, password):
         """
@@ -446,3 +454,88 @@ class User(UserMixin, db.Model):
 
     def __repr__(self):
         return "<User %s>" % self.username
+
+
+register_search_index(User, ["username"])
+register_suggestions(User, "user", "id", "username")
+
+
+@event.listens_for(User, "expire")
+@event.listens_for(User, "refresh")
+def invalidate_user_permissions(user, *args):
+    user.invalidate_permissions()
+
+
+def invalidate_cached_users(session, user_id=None):
+    """
+    Marks a cached user, or all cached users if user_id is None, to be
+    removed from the user cache once the session commits.
+    """
+    invalidated_users = session.info.setdefault("invalidated_users", set())
+    invalidated_users.add(user_id)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def invalidate_cached_user(mapper, connection, user):
+    invalidate_cached_users(object_session(user), user.id)
+
+
+@event.listens_for(Role, "after_insert")
+@event.listens_for(Role, "after_update")
+@event.listens_for(Role, "after_delete")
+@event.listens_for(Permissions, "after_insert")
+@event.listens_for(Permissions, "after_update")
+@event.listens_for(Permissions, "after_delete")
+def invalidate_cached_role(mapper, connection, target):
+    invalidate_cached_users(object_session(target))
+
+
+@event.listens_for(db.session, "after_bulk_update")
+@event.listens_for(db.session, "after_bulk_delete")
+def invalidate_cached_users_in_bulk(bulk_context):
+    if bulk_context.mapper.class_ in (User, Role, Permissions):
+        invalidate_cached_users(bulk_context.session)
+
+
+def cached_user_generation(user_id):
+    """
+    Gets generation counters of a cached user, kept with the page cache's
+    so the sqlite backend shares them between workers.
+
+    Args:
+      user_id: User ID.
+
+    Returns:
+      Tuple of generations of all users and of the user.
+    """
+    page_cache = current_app.extensions["page_cache"]
+    return (
+        page_cache.generation("users"),
+        page_cache.generation("user:{}".format(user_id)))
+
+
+@event.listens_for(db.session, "after_commit")
+def remove_cached_users(session):
+    invalidated_users = session.info.pop("invalidated_users", None)
+    if not invalidated_users or not has_app_context():
+        return
+
+    user_cache = current_app.extensions.get("user_cache")
+    if user_cache is None:
+        return
+
+    # Cached copies of other workers are invalidated by the generations.
+    page_cache = current_app.extensions["page_cache"]
+    if None in invalidated_users:
+        user_cache.clear()
+        page_cache.invalidate("users")
+    else:
+        for user_id in invalidated_users:
+            user_cache.delete(user_id)
+            page_cache.invalidate("user:{}".format(user_id))
+
+
+@event.listens_for(db.session, "after_rollback")
+def discard_cached_users(session):
+    session.info.pop("invalidated_users", None)
@@ -0,0 +1,362 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Thread safe in-memory cache, entries expire after ttl seconds and least
+    recently used entries are evicted once maxsize is reached. Each process
+    has its own copy, a ttl of 0 disables the cache.
+    """
+    def __init__(self, ttl=30, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # Counters aren't evicted or expired.
+        self._counters = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def get(self, key, default=None):
+        """
+        Gets cached value.
+
+        Args:
+          key: Cache key.
+          default: Value returned if key is missing or expired.
+
+        Returns:
+          Cached value or default.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """
+        Caches value for ttl seconds.
+
+        Args:
+          key: Cache key.
+          value: Value to be cached, shouldn't be modified once cached.
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key):
+        """
+        Increments counter.
+
+        Args:
+          key: Counter key.
+
+        Returns:
+          Value of counter after increment.
+        """
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def stats(self):
+        """
+        Gets cache hit/miss counters.
+
+        Returns:
+          Dict of cache statistics.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else None,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl}
+
+
+class SQLiteCache:
+    """
+    Cache shared by processes of a host in a SQLite file, entries expire
+    after ttl seconds and those closest to expiring are evicted once maxsize
+    is reached. Values are stored as JSON. Hit/miss counters are per
+    process, a ttl of 0 disables the cache.
+    """
+    def __init__(self, path, ttl=30, maxsize=1024):
+        self.path = path
+        self.ttl = ttl
+        self.maxsize = maxsize
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def _connection(self):
+        # sqlite3 connections can't be shared by threads or forked workers.
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path,
+                timeout=5,
+                isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entry ("
+                "key TEXT PRIMARY KEY, expires REAL, value TEXT)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_counter ("
+                "key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key, default=None):
+        """
+        Gets cached value.
+
+        Args:
+          key: Cache key string.
+          default: Value returned if key is missing or expired.
+
+        Returns:
+          Cached value or default.
+        """
+        entry = self._connection().execute(
+            "SELECT value FROM cache_entry WHERE key = ? AND expires > ?",
+            (key, time.time())).fetchone()
+        self._record(entry is not None)
+        if entry is None:
+            return default
+        return json.loads(entry[0])
+
+    def set(self, key, value):
+        """
+        Caches value for ttl seconds.
+
+        Args:
+          key: Cache key string.
+          value: JSON serializable value to be cached.
+        """
+        if not self.enabled:
+            return
+
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO cache_entry (key, expires, value) "
+                "VALUES (?, ?, ?)",
+                (key, time.time() + self.ttl, json.dumps(value)))
+            connection.execute(
+                "DELETE FROM cache_entry WHERE expires <= ? OR key NOT IN ("
+                "SELECT key FROM cache_entry ORDER BY expires DESC LIMIT ?)",
+                (time.time(), self.maxsize))
+
+    def delete(self, key):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM cache_entry WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM cache_entry")
+
+    def counter(self, key):
+        counter = self._connection().execute(
+            "SELECT value FROM cache_counter WHERE key = ?",
+            (key,)).fetchone()
+        return 0 if counter is None else counter[0]
+
+    def incr(self, key):
+        """
+        Increments counter shared by processes.
+
+        Args:
+          key: Counter key.
+
+        Returns:
+          Value of counter after increment.
+        """
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT INTO cache_counter (key, value) VALUES (?, 1) "
+                "ON CONFLICT (key) DO UPDATE SET value = value + 1",
+                (key,))
+            return connection.execute(
+                "SELECT value FROM cache_counter WHERE key = ?",
+                (key,)).fetchone()[0]
+
+    def stats(self):
+        """
+        Gets cache hit/miss counters.
+
+        Returns:
+          Dict of cache statistics.
+        """
+        size = self._connection().execute(
+            "SELECT count(*) FROM cache_entry").fetchone()[0]
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else None,
+                "size": size,
+                "maxsize": self.maxsize,
+                "ttl": self.ttl}
+
+
+class PageCache:
+    """
+    Caches results of pages on a TTLCache or SQLiteCache backend. Keys
+    include generation counters of the data a page shows, pages are
+    invalidated by incrementing the counter on writes instead of finding
+    their entries. Only the SQLite backend shares counters between
+    processes, other processes see writes once their entries expire.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+
+        self._lock = threading.Lock()
+        self.hit_time = 0
+        self.miss_time = 0
+
+    @property
+    def enabled(self):
+        return self.backend.enabled
+
+    def generation(self, generation):
+        """
+        Gets value of a generation counter.
+
+        Args:
+          generation: Name of the generation e.g gallery.
+
+        Returns:
+          Integer counter value.
+        """
+        return self.backend.counter("generation:" + generation)
+
+    def invalidate(self, generation):
+        """
+        Invalidates pages depending on a generation.
+
+        Args:
+          generation: Name of the generation e.g gallery.
+        """
+        self.backend.incr("generation:" + generation)
+
+    def get_or_load(self, generation, key, load):
+        """
+        Gets cached page, loaded and cached on a miss.
+
+        Args:
+          generation: Name of the generation the page depends on.
+          key: Tuple of strings identifying the page e.g category, filter
+            and page number.
+          load: Function loading the page, results of None aren't cached.
+
+        Returns:
+          Results of the page.
+        """
+        if not self.enabled:
+            return load()
+
+        start = time.perf_counter()
+        cache_key = ":".join(
+            [generation, str(self.generation(generation))] +
+            [str(part) for part in key])
+        value = self.backend.get(cache_key)
+        if value is not None:
+            with self._lock:
+                self.hit_time += time.perf_counter() - start
+            return value
+
+        value = load()
+        if value is not None:
+            self.backend.set(cache_key, value)
+        with self._lock:
+            self.miss_time += time.perf_counter() - start
+        return value
+
+    def stats(self):
+        """
+        Gets cache statistics including average time of a lookup.
+
+        Returns:
+          Dict of cache statistics.
+        """
+        stats = self.backend.stats()
+        with self._lock:
+            stats["hit_latency_ms"] = self.hit_time / stats["hits"] * 1000 \
+                if stats["hits"] else None
+            stats["miss_latency_ms"] = \
+                self.miss_time / stats["misses"] * 1000 \
+                if stats["misses"] else None
+        return stats
+
+
+def create_page_cache(backend, ttl, maxsize, path=None):
+    """
+    Creates page cache on a backend.
+
+    Args:
+      backend: Name of the backend i.e memory, sqlite.
+      ttl: Seconds pages are cached, 0 disables the cache.
+      maxsize: Max number of pages cached.
+      path: File path of the SQLite backend.
+
+    Returns:
+      PageCache object.
+    """
+    if backend == "sqlite":
+        return PageCache(SQLiteCache(path, ttl=ttl, maxsize=maxsize))
+    return PageCache(TTLCache(ttl=ttl, maxsize=maxsize))
@@ -5,3 +5,7 @@ imager_bp = Blueprint("imager", __name__)
 from . import views
 from . import controllers
 from . import models
+from . import derivatives
+from . import metadata
+from . import ingest
+from . import similarity
@@ -1,22 +1,32 @@
 import os
 
 from flask import current_app
+from flask_sqlalchemy import Pagination
 from sqlalchemy.sql import func
 
 from .. import db
+from ..search import search, count_results
 from . import models  # Imager Models
 from .. import auth
 from .utils import *
+from .vote_buffer import vote_buffer
+from .metadata import get_image_metadata
+from .ingest import INCOMING_DIRECTORY, ingest_upload
+from .similarity import dhash
 
-from PIL import Image, ImageOps
+from .derivatives import (
+    derivative_path,
+    generate_derivatives,
+    public_thumbnail_path,
+    publish_thumbnail,
+    queue_derivatives)
 
-from sqlalchemy import asc, desc, nulls_first, nulls_last
+from sqlalchemy import asc, desc, nulls_first, nulls_last, and_, or_
 
 # TODO: Move to be config parameters.
 PER_PAGE = 20
 ERROR_OUT = True
 MAX_PER_PAGE = 100
-THUMBNAIL_SIZE = (240, 240)
 
 
 def get_image_details(user, images):
@@ -30,33 +40,133 @@ def get_image_details(user, images):
     Returns:
       List of dictionaries with details of images.
     """
+    image_file_ids = [image.file_id for image in images]
+
+    # Loads voting metrics and user's votes for the whole page at once.
+    metrics = image_metrics(image_file_ids)
+    if user.is_anonymous:
+        personal_votes = {}
+    else:
+        personal_votes = get_user_votes(user, image_file_ids)
+
     data_dict = []
     for image in images:
         temp_dict = {}
         temp_dict["uploaded_by"] = image.user_content.user.username
         temp_dict["title"] = image.title
         temp_dict["file_id"] = image.file_id
+        temp_dict["public_thumbnail"] = public_thumbnail_path(image) \
+            if image.thumbnail_published else None
         temp_dict["description"] = "" if image.description is None else \
             image.description
-        temp_dict["voter_count"] = image_metric(image.file_id)
+        temp_dict["voter_count"] = metrics.get(image.file_id)
         temp_dict["upload_date"] = image.upload_time.strftime(
             "%Y-%m-%dT%H:%M:%S")
 
-        if user.is_anonymous:
-            temp_dict["personal_vote"] = None
-        else:
-            vote_counter = models.VoteCounter().query.filter_by(
-                user_id=current_user.id,
-                image_file_id=image.file_id).first()
-            if vote_counter:
-                temp_dict["personal_vote"] = vote_counter.vote
-            else:
-                temp_dict["personal_vote"] = None
+        temp_dict["personal_vote"] = personal_votes.get(image.file_id)
 
         data_dict.append(temp_dict)
     return data_dict
 
 
+def invalidate_gallery_pages():
+    """
+    Invalidates cached gallery pages after images or their votes change.
+    """
+    current_app.extensions["page_cache"].invalidate("gallery")
+
+
+def load_gallery_page(user, category, sort_order, page=1, cursor=None):
+    """
+    Loads a gallery page sorted by category, cached for anonymous users
+    until an image is uploaded, edited, deleted or voted on.
+
+    Args:
+      user: User object.
+      category: Category the gallery is sorted by i.e upload_time, score.
+      sort_order: Sort order of the gallery i.e asc, desc.
+      page: Integer of the page to be loaded.
+      cursor: Cursor of the page to be loaded if keyset paginated.
+
+    Returns:
+      Dict of image details, pagination details and next cursor of the
+      page or None if page doesn't exist.
+    """
+    def load():
+        if category == "upload_time":
+            image_contents = get_image_contents_by_time(sort_order)
+        else:
+            image_contents = get_image_contents_by_score(sort_order)
+
+        gallery_page = {
+            "images": [],
+            "page": page,
+            "per_page": PER_PAGE,
+            "total": 0,
+            "next_cursor": None}
+        if cursor is not None:
+            # Keyset pagination if cursor is passed, '' for first page.
+            images, gallery_page["next_cursor"] = \
+                image_content_keyset_pagination(
+                    image_contents,
+                    category,
+                    sort_order,
+                    cursor)
+            if images is None:
+                return None
+        else:
+            images_pagination = image_content_pagination(
+                image_contents,
+                page=page)
+            images = images_pagination.items
+            gallery_page["total"] = images_pagination.total
+        gallery_page["images"] = get_image_details(user, images)
+        return gallery_page
+
+    if not user.is_anonymous:
+        return load()
+
+    return current_app.extensions["page_cache"].get_or_load(
+        "gallery",
+        (category, sort_order, page if cursor is None else "c" + cursor),
+        load)
+
+
+def get_user_votes(user, image_file_ids):
+    """
+    Loads votes made by user for multiple images in a single query.
+
+    Args:
+      user: User object.
+      image_file_ids: List of Image IDs.
+
+    Returns:
+      Dict of user's vote keyed by Image ID, Images the user hasn't
+      voted on are left out.
+    """
+    if not image_file_ids:
+        return {}
+
+    vote_counters = db.session.query(
+        models.VoteCounter.image_file_id,
+        models.VoteCounter.vote).filter(
+        models.VoteCounter.user_id == user.id,
+        models.VoteCounter.image_file_id.in_(set(image_file_ids))).all()
+
+    user_votes = {}
+    for vote_counter in vote_counters:
+        user_votes[vote_counter.image_file_id] = vote_counter.vote
+
+    if current_app.config.get("VOTE_WRITE_BEHIND"):
+        pending_votes = vote_buffer.pending_votes(user.id, image_file_ids)
+        for image_file_id, vote in pending_votes.items():
+            if vote is None:
+                user_votes.pop(image_file_id, None)
+            else:
+                user_votes[image_file_id] = vote
+    return user_votes
+
+
 def update_gallery(image_content, new_data):
     try:
         if 'title' in new_data:
@@ -67,6 +177,7 @@ def update_gallery(image_content, new_data):
             return False
         # Commit Session
         db.session.commit()
+        invalidate_gallery_pages()
         return True
     except Exception as e:
         # Rollback session
@@ -101,10 +212,12 @@ def get_image_contents_by_time(sort_order="asc"):
     """
     if sort_order == "asc":
         image_content = models.ImageContent.query.order_by(
-            models.ImageContent.upload_time.asc())
+            models.ImageContent.upload_time.asc(),
+            models.ImageContent.id.asc())
     elif sort_order == "desc":
         image_content = models.ImageContent.query.order_by(
-            models.ImageContent.upload_time.desc())
+            models.ImageContent.upload_time.desc(),
+            models.ImageContent.id.desc())
     else:
         image_content = None
     return image_content
@@ -119,17 +232,13 @@ def get_image_contents_by_score(sort_order="asc"):
       ImageContent object.
     """
     if sort_order == "asc":
-        image_content = models.ImageContent.query.select_from(
-            models.ImageContent).outerjoin(
-            models.VoteCounter).group_by(
-            models.ImageContent).order_by(
-            nulls_first(asc(func.sum(models.VoteCounter.vote))))
+        image_content = models.ImageContent.query.order_by(
+            models.ImageContent.score.asc(),
+            models.ImageContent.id.asc())
     elif sort_order == "desc":
-        image_content = models.ImageContent.query.select_from(
-            models.ImageContent).outerjoin(
-            models.VoteCounter).group_by(
-            models.ImageContent).order_by(
-            nulls_last(desc(func.sum(models.VoteCounter.vote))))
+        image_content = models.ImageContent.query.order_by(
+            models.ImageContent.score.desc(),
+            models.ImageContent.id.desc())
     else:
         image_content = None
 
@@ -190,30 +299,26 @@ def get_image_contents_by_user(
         if category_filter == "asc":
             image_content = models.ImageContent.query.filter_by(
                 user_content_id=user_content.id).order_by(
-                models.ImageContent.upload_time.asc())
+                models.ImageContent.upload_time.asc(),
+                models.ImageContent.id.asc())
         elif category_filter == "desc":
             image_content = models.ImageContent.query.filter_by(
                 user_content_id=user_content.id).order_by(
-                models.ImageContent.upload_time.desc())
+                models.ImageContent.upload_time.desc(),
+                models.ImageContent.id.desc())
         else:
             image_content = None
     elif category == "score":
         if category_filter == "asc":
-            image_content = models.ImageContent.query.select_from(
-                models.ImageContent).filter_by(
-                user_content_id=user_content.id).outerjoin(
-                models.VoteCounter).group_by(
-                models.ImageContent).order_by(
-                    nulls_first(asc(func.sum(models.VoteCounter.vote)))
-            )
+            image_content = models.ImageContent.query.filter_by(
+                user_content_id=user_content.id).order_by(
+                models.ImageContent.score.asc(),
+                models.ImageContent.id.asc())
         elif category_filter == "desc":
-            image_content = models.ImageContent.query.select_from(
-                models.ImageContent).filter_by(
-                user_content_id=user_content.id).outerjoin(
-                models.VoteCounter).group_by(
-                models.ImageContent).order_by(
-                    nulls_last(desc(func.sum(models.VoteCounter.vote)))
-            )
+            image_content = models.ImageContent.query.filter_by(
+                user_content_id=user_content.id).order_by(
+                models.ImageContent.score.desc(),
+                models.ImageContent.id.desc())
         else:
             image_content = None
     else:
@@ -259,30 +364,55 @@ def get_image_content_by_id(image_id):
 
     return image_content
 
-def get_imagecontent_neighbours(image_content, image_contents):
+def get_imagecontent_neighbours(
+        image_content,
+        image_contents,
+        category="upload_time",
+        sort_order="desc"):
     """
-    Gets Image Neighbours for navigating in gallery.
+    Gets Image Neighbours for navigating in gallery using two indexed
+    queries seeking from the image instead of loading the whole gallery.
 
     Args:
       image_content: Image.
-      image_contents: List of all images filtered and sorted accordingly.
+      image_contents: ImageContent query filtered and sorted by category
+                      and ImageContent id.
+      category: Category image_contents is sorted by i.e upload_time, score.
+      sort_order: Sort order of image_contents i.e asc, desc.
 
     Returns:
       Neighbouring images as prev and next items in dictionary.
     """
-    img_index = image_contents.index(image_content)
     neighbours = {
         "next": None,
         "prev": None
     }
-    if len(image_contents) > 1:
-        if img_index == 0:
-            neighbours["next"] = image_contents[img_index + 1]
-        elif img_index == len(image_contents) - 1:
-            neighbours["prev"] = image_contents[img_index - 1]
-        else:
-            neighbours["prev"] = image_contents[img_index - 1]
-            neighbours["next"] = image_contents[img_index + 1]
+    if category not in ["upload_time", "score"] or \
+            sort_order not in ["asc", "desc"]:
+        return neighbours
+
+    sort_value = getattr(image_content, category)
+    sort_column = getattr(models.ImageContent, category)
+
+    neighbours["next"] = image_contents.filter(
+        keyset_filter(
+            category,
+            sort_order,
+            sort_value,
+            image_content.id)).first()
+
+    # Previous image is the first image when the sort order is reversed.
+    if sort_order == "desc":
+        reverse_order = [sort_column.asc(), models.ImageContent.id.asc()]
+    else:
+        reverse_order = [sort_column.desc(), models.ImageContent.id.desc()]
+    neighbours["prev"] = image_contents.filter(
+        keyset_filter(
+            category,
+            sort_order,
+            sort_value,
+            image_content.id,
+            after=False)).order_by(None).order_by(*reverse_order).first()
 
     return neighbours
 
@@ -311,43 +441,80 @@ def load_user_images(user_id, image_id):
     return image_content
 
 
-def search_by_title(search_value, get_list=True):
+def search_by_title(search_value, get_list=True, limit=None, offset=None):
     """
-    Search ImageContent model by title.
+    Search ImageContent model by title and description.
 
     Args:
       search_value: Search value.
       get_list: Boolean indicating whether to return a list or object.
+      limit: Max number of results, all if None.
+      offset: Number of results skipped.
 
     Returns:
-      ImageContent query results.
+      ImageContent query results ordered by rank.
     """
-    search = "%{}%".format(search_value)
+    titles = search(models.ImageContent, search_value, limit, offset)
     if get_list:
-        titles = db.session.query(models.ImageContent).filter(
-            models.ImageContent.title.ilike(search)).all()
-    else:
-        titles = db.session.query(models.ImageContent).filter(
-            models.ImageContent.title.ilike(search))
+        titles = titles.all()
     return titles
 
 
-def search_by_tags(search_value):
+def search_by_tags(search_value, limit=None, offset=None):
     """
     Search Tags model by tag_name.
 
     Args:
       search_value: Search value.
+      limit: Max number of results, all if None.
+      offset: Number of results skipped.
 
     Returns:
-      Tags query results.
+      Tags query results ordered by rank.
     """
-    search = "%{}%".format(search_value)
-    tags = db.session.query(models.Tags).filter(
-        models.Tags.tag_name.ilike(search)).all()
+    tags = search(models.Tags, search_value, limit, offset).all()
     return tags
 
 
+def search_pagination(search_value, page=1, per_page=PER_PAGE):
+    """
+    Loads a page of ImageContent search results. Only the page is loaded
+    and results are counted up to SEARCH_MAX_RESULTS, later pages aren't
+    available.
+
+    Args:
+      search_value: Search value.
+      page: Integer of the page to be loaded.
+      per_page: Number of images in a page.
+
+    Returns:
+      Tuple of pagination object, None if page is out of range, and Boolean
+      indicating whether there are more results than counted.
+    """
+    max_results = current_app.config["SEARCH_MAX_RESULTS"]
+    total, has_more = count_results(
+        search_by_title(search_value, get_list=False),
+        max_results)
+
+    offset = (page - 1) * per_page
+    if page < 1 or (page > 1 and offset >= total):
+        return None, has_more
+
+    if total > offset:
+        image_contents = search_by_title(
+            search_value,
+            limit=min(per_page, total - offset),
+            offset=offset)
+    else:
+        image_contents = []
+    return Pagination(
+        None,
+        page,
+        per_page,
+        total,
+        image_contents), has_more
+
+
 def create_user_content(user, directory_name):
     """
     Saves a record in UserContent with user and directory
@@ -452,59 +619,210 @@ def save_user_image(user, file, image_details):
 
     db.session.add(image_content)
 
-    file_ext = os.path.splitext(file.filename)[1]
+    file_ext = os.path.splitext(file.filename)[1][1:]
 
-    image_path = os.path.join(*[
-        file_path,
-        user_content.content_location,
-        filename + file_ext
-    ])
+    # Blob files written by this upload, removed if an error occurs.
+    blob_path = None
+    ingest_file = None
+    try:
+        ingest_file = ingest_upload(
+            file,
+            os.path.join(file_path, INCOMING_DIRECTORY))
+        content_hash = ingest_file.hexdigest()
 
-    thumbnail_path = os.path.join(*[
-        file_path,
-        user_content.content_location,
-        'thumbnails',
-        filename + file_ext
-    ])
+        blob, created = reference_blob(content_hash, file_ext)
+        image_path = get_blob_path(
+            file_path,
+            blob.content_hash,
+            blob.file_extension)
+        if created:
+            # Moves streamed upload into place.
+            os.makedirs(os.path.dirname(image_path), exist_ok=True)
+            ingest_file.save(image_path)
+            blob_path = image_path
+
+            # Stores file details so the file is found without a directory
+            # scan.
+            image_metadata = get_image_metadata(image_path, content_hash)
+            for key, value in image_metadata.items():
+                setattr(blob, key, value)
+
+        # Perceptual hash of existing blobs is copied from an image using
+        # it. New blobs are hashed with their thumbnail, by the derivative
+        # job if thumbnails are generated asynchronously.
+        if not created:
+            image_content.dhash = db.session.query(
+                models.ImageContent.dhash).filter(
+                models.ImageContent.blob_id == blob.id,
+                models.ImageContent.dhash.isnot(None)).limit(1).scalar()
+        if image_content.dhash is None and \
+                not current_app.config.get("THUMBNAIL_ASYNC"):
+            image_content.dhash = dhash(image_path)
+
+        image_content.blob = blob
+        for key in [
+                "content_hash",
+                "file_extension",
+                "file_size",
+                "width",
+                "height"]:
+            setattr(image_content, key, getattr(blob, key))
+
+        # Derivatives of existing blobs are reused.
+        if not created:
+            pass
+        elif current_app.config.get("THUMBNAIL_ASYNC"):
+            # Thumbnail and renditions are generated by
+            # `flask imager process-derivatives`.
+            queue_derivatives(filename)
+        else:
+            # Create Thumbnail and renditions using saved images.
+            generate_derivatives(image_path)
 
-    try:
-        # Saves file using user location and new filename.
-        file.save(image_path)
-        
-        # Create Thumbnails using saved images.
-        with Image.open(image_path) as original_image:
-            # original_image = img
-            thumbnail_image = ImageOps.fit(
-                image=original_image,
-                size=THUMBNAIL_SIZE,
-                method=3,
-                bleed=0.0,
-                centering=(0.5, 0.5))
-
-            # Save thumbnail to Thumbnail directory.
-            thumbnail_image.save(thumbnail_path)
+        publish_thumbnail(
+            image_content,
+            derivative_path(image_path, "thumbnail"))
 
         # Commits ImageContent with filename
         db.session.commit()
+        invalidate_gallery_pages()
         status = True
     except Exception as e:
         print("An error occured while saving user image: ", e)
 
         db.session.rollback()
 
-        # Removes file if an error occured and file was saved
-        try:
-            os.remove(image_path)
-            os.remove(thumbnail_path)
-        except Exception as e:
-            print("An exception occured while removing files: ", e)
+        # Removes files if an error occured and files were saved
+        if blob_path is not None:
+            delete_unreferenced_blob(blob_path)
+        delete_image_file(
+            file_path,
+            user_content.content_location,
+            filename)
         status = False
     finally:
         file.close()
+        if ingest_file is not None:
+            ingest_file.close()
 
     return status
 
 
+def reference_blob(content_hash, file_extension):
+    """
+    Adds a reference to the blob of a content hash, creating it if it
+    doesn't exist. The unique content hash constraint resolves concurrent
+    uploads of the same file instead of a lookup.
+
+    Args:
+      content_hash: Hex SHA-256 digest of uploaded file.
+      file_extension: File extension of uploaded file without the dot.
+
+    Returns:
+      Tuple of ImageBlob and boolean indicating if it was created, created
+      blobs have no file yet.
+    """
+    blob_table = models.ImageBlob.__table__
+    insert = get_dialect_insert(db.engine.dialect.name)
+
+    values = {
+        "content_hash": content_hash,
+        "file_extension": file_extension,
+        "ref_count": 1}
+    if insert is None:
+        blob_exists = db.session.query(models.ImageBlob.id).filter_by(
+            content_hash=content_hash).first() is not None
+        created = not blob_exists and db.session.execute(
+            blob_table.insert().values(**values)).rowcount == 1
+    else:
+        created = db.session.execute(
+            insert(blob_table).values(**values).on_conflict_do_nothing(
+                index_elements=["content_hash"])).rowcount == 1
+
+    if not created:
+        models.ImageBlob.query.filter_by(
+            content_hash=content_hash).update({
+                "ref_count": models.ImageBlob.ref_count + 1
+            }, synchronize_session=False)
+
+    blob = models.ImageBlob.query.filter_by(
+        content_hash=content_hash).populate_existing().one()
+    return blob, created
+
+
+def release_blob(image_content):
+    """
+    Removes a reference to the blob of an ImageContent being deleted, the
+    blob is deleted once unreferenced. Doesn't commit.
+
+    Args:
+      image_content: ImageContent object.
+
+    Returns:
+      File path of blob if it's no longer referenced, else None.
+    """
+    models.ImageBlob.query.filter_by(id=image_content.blob_id).update({
+        "ref_count": models.ImageBlob.ref_count - 1
+    }, synchronize_session=False)
+
+    deleted = models.ImageBlob.query.filter(
+        models.ImageBlob.id == image_content.blob_id,
+        models.ImageBlob.ref_count <= 0).delete(synchronize_session=False)
+    if not deleted:
+        return None
+    return get_blob_path(
+        current_app.config["UPLOAD_PATH"],
+        image_content.content_hash,
+        image_content.file_extension)
+
+
+def delete_unreferenced_blob(blob_path):
+    """
+    Removes files of a blob once no ImageBlob references them, unless an
+    upload of the same content created its blob since. The content hash is
+    claimed with a placeholder blob, never commited, while the files are
+    removed so concurrent uploads of the content wait for it.
+
+    Args:
+      blob_path: File path of blob.
+
+    Returns:
+      Boolean indicating if files were removed.
+    """
+    content_hash, file_extension = os.path.splitext(
+        os.path.basename(blob_path))
+    blob_table = models.ImageBlob.__table__
+    insert = get_dialect_insert(db.engine.dialect.name)
+
+    values = {
+        "content_hash": content_hash,
+        "file_extension": file_extension[1:],
+        "ref_count": 0}
+    try:
+        if insert is None:
+            blob_exists = models.ImageBlob.query.filter_by(
+                content_hash=content_hash).with_for_update().first() \
+                is not None
+            claimed = not blob_exists and db.session.execute(
+                blob_table.insert().values(**values)).rowcount == 1
+        else:
+            claimed = db.session.execute(
+                insert(blob_table).values(**values).on_conflict_do_nothing(
+                    index_elements=["content_hash"])).rowcount == 1
+
+        if claimed:
+            delete_blob_files(blob_path)
+            models.ImageBlob.query.filter_by(
+                content_hash=content_hash,
+                ref_count=0).delete(synchronize_session=False)
+        db.session.commit()
+        return claimed
+    except Exception as e:
+        print("An error occured while deleting blob: ", e)
+        db.session.rollback()
+        return False
+
+
 def image_content_pagination(obj, page=1):
     """
     Takes Models objects and paginates it.
@@ -524,49 +842,253 @@ def image_content_pagination(obj, page=1):
     return image_pagination
 
 
-def upvote(user, image_file_id):
+def update_image_score(image_file_id, old_vote, new_vote):
     """
-    Adds upvote metric to the db.
+    Adds change in a user's vote to the denormalized ImageContent score
+    columns, changes are commited together with the VoteCounter changes.
 
     Args:
-      user: User object, specifically current logged in user.
       image_file_id: File ID of image.
+      old_vote: Previous vote value of user or None.
+      new_vote: New vote value of user or None if vote was removed.
 
     Returns:
-      Boolean indicating result of operation.
+      Number of images updated i.e 0 if image doesn't exist.
     """
-    # Check if Image file ID is invalid.
-    image_content = models.ImageContent().query.filter_by(
-        file_id=image_file_id).one_or_none()
+    old_vote = old_vote or 0
+    new_vote = new_vote or 0
 
-    if image_content is None:
-        return False
+    return models.ImageContent.query.filter_by(
+        file_id=image_file_id).update({
+            "score": models.ImageContent.score + (new_vote - old_vote),
+            "upvotes": models.ImageContent.upvotes + (
+                max(new_vote, 0) - max(old_vote, 0)),
+            "downvotes": models.ImageContent.downvotes + (
+                min(new_vote, 0) - min(old_vote, 0))
+        }, synchronize_session=False)
+
+
+def keyset_filter(category, sort_order, sort_value, image_id, after=True):
+    """
+    Creates filter selecting ImageContent after (or before) an image in a
+    gallery sorted by category and ImageContent id.
+
+    Args:
+      category: Category the gallery is sorted by i.e upload_time, score.
+      sort_order: Sort order of the gallery i.e asc, desc.
+      sort_value: Value of the category for the image.
+      image_id: ImageContent id of the image.
+      after: Boolean indicating whether to select images after or before.
+
+    Returns:
+      SQLAlchemy filter expression.
+    """
+    sort_column = getattr(models.ImageContent, category)
+    id_column = models.ImageContent.id
+
+    # Images after an image in descending order have smaller values.
+    if (sort_order == "desc") == after:
+        return or_(
+            sort_column < sort_value,
+            and_(sort_column == sort_value, id_column < image_id))
+    else:
+        return or_(
+            sort_column > sort_value,
+            and_(sort_column == sort_value, id_column > image_id))
+
+
+def image_content_keyset_pagination(
+        obj,
+        category,
+        sort_order,
+        cursor=None,
+        per_page=PER_PAGE):
+    """
+    Takes Models objects sorted by category and ImageContent id and loads
+    the page after the cursor, avoids COUNT and OFFSET queries so cost
+    doesn't depend on how deep the page is.
+
+    Args:
+      obj: Model object to be paginated.
+      category: Category obj is sorted by i.e upload_time, score.
+      sort_order: Sort order of obj i.e asc, desc.
+      cursor: Cursor of the page to be loaded, None or '' for first page.
+      per_page: Number of images in a page.
+
+    Returns:
+      Tuple of list of ImageContent and cursor of the next page
+      (None if last page) or (None, None) if parameters are invalid.
+    """
+    if category not in ["upload_time", "score"] or \
+            sort_order not in ["asc", "desc"]:
+        return None, None
+
+    per_page = min(per_page, MAX_PER_PAGE)
+    if cursor:
+        cursor_values = decode_cursor(cursor, category, sort_order)
+        if cursor_values is None:
+            return None, None
+        obj = obj.filter(keyset_filter(category, sort_order, *cursor_values))
+
+    # Loads an extra image to check if there's a next page.
+    image_contents = obj.limit(per_page + 1).all()
+    if len(image_contents) > per_page:
+        image_contents = image_contents[:per_page]
+        last_image = image_contents[-1]
+        next_cursor = encode_cursor(
+            category,
+            sort_order,
+            getattr(last_image, category),
+            last_image.id)
+    else:
+        next_cursor = None
+    return image_contents, next_cursor
+
+
+def insert_vote(user_id, image_file_id, vote):
+    """
+    Inserts a user's vote unless the user already voted on the image, the
+    unique vote constraint resolves concurrent inserts instead of a lookup.
+
+    Args:
+      user_id: User ID.
+      image_file_id: File ID of image.
+      vote: Vote value.
 
-    upvote_obj = models.VoteCounter().query.filter_by(
+    Returns:
+      Number of votes inserted i.e 0 or 1.
+    """
+    vote_table = models.VoteCounter.__table__
+    insert = get_dialect_insert(db.engine.dialect.name)
+
+    values = {
+        "user_id": user_id,
+        "image_file_id": image_file_id,
+        "vote": vote}
+    if insert is None:
+        # Existing votes are toggled by the caller, concurrent inserts are
+        # rejected by the unique vote constraint.
+        vote_exists = db.session.query(models.VoteCounter.id).filter_by(
+            user_id=user_id,
+            image_file_id=image_file_id).first() is not None
+        if vote_exists:
+            return 0
+        return db.session.execute(
+            vote_table.insert().values(**values)).rowcount
+
+    insert_stmt = insert(vote_table).values(**values)
+    return db.session.execute(
+        insert_stmt.on_conflict_do_nothing(
+            index_elements=["user_id", "image_file_id"])).rowcount
+
+
+def vote_image(user, image_file_id, vote):
+    """
+    Toggles a user's vote on an image without reading it first: inserts the
+    vote, or removes it if the user already cast the same vote, or switches
+    an opposite vote. Each statement only changes rows matching the vote it
+    expects so concurrent votes can't create duplicates or skew the score.
+
+    Args:
+      user: User object, specifically current logged in user.
+      image_file_id: File ID of image.
+      vote: Vote value i.e VoteEnum.UPVOTE.value, VoteEnum.DOWNVOTE.value.
+
+    Returns:
+      ImageContent aggregated voting metric after the vote or None if image
+      doesn't exist or an error occured.
+    """
+    if current_app.config.get("VOTE_WRITE_BEHIND"):
+        return buffer_vote(user, image_file_id, vote)
+
+    user_vote = models.VoteCounter.query.filter_by(
         user_id=user.id,
         image_file_id=image_file_id)
-    upvote_ = upvote_obj.first()
 
-    if upvote_:
-        if upvote_.vote == models.VoteEnum.UPVOTE.value:
-            upvote_obj.delete()
+    try:
+        if insert_vote(user.id, image_file_id, vote):
+            old_vote, new_vote = None, vote
+        elif user_vote.filter_by(vote=vote).delete(
+                synchronize_session=False):
+            old_vote, new_vote = vote, None
+        elif user_vote.filter(models.VoteCounter.vote != vote).update(
+                {"vote": vote},
+                synchronize_session=False):
+            old_vote, new_vote = -vote, vote
         else:
-            upvote_.vote = models.VoteEnum.UPVOTE.value
-    else:
-        upvote = models.VoteCounter(
-            user_id=user.id,
-            image_file_id=image_file_id,
-            vote=models.VoteEnum.UPVOTE.value)
+            # Vote was changed concurrently, leaves score unchanged.
+            old_vote, new_vote = vote, vote
 
-        db.session.add(upvote)
+        # Updates image score in the same transaction as the vote.
+        if not update_image_score(image_file_id, old_vote, new_vote):
+            db.session.rollback()
+            return None
 
-    try:
+        metric_data = image_metric(image_file_id)
         db.session.commit()
-        return True
+        invalidate_gallery_pages()
+        return metric_data
     except Exception as e:
-        print("An error occured while upvoting content: ", e)
+        print("An error occured while voting content: ", e)
         db.session.rollback()
-        return False
+        return None
+
+
+def buffer_vote(user, image_file_id, vote):
+    """
+    Toggles a user's vote on an image in the vote write-behind buffer, the
+    vote is written to the db on the next flush.
+
+    Args:
+      user: User object, specifically current logged in user.
+      image_file_id: File ID of image.
+      vote: Vote value i.e VoteEnum.UPVOTE.value, VoteEnum.DOWNVOTE.value.
+
+    Returns:
+      ImageContent aggregated voting metric including buffered votes or None
+      if image doesn't exist.
+    """
+    is_pending, current_vote = vote_buffer.pending_vote(
+        user.id,
+        image_file_id)
+
+    if not is_pending:
+        # Checks image exists and loads user's vote in one query.
+        image_vote = db.session.query(
+            models.ImageContent.id,
+            models.VoteCounter.vote).outerjoin(
+            models.VoteCounter,
+            and_(
+                models.VoteCounter.image_file_id ==
+                models.ImageContent.file_id,
+                models.VoteCounter.user_id == user.id)).filter(
+            models.ImageContent.file_id == image_file_id).first()
+        if image_vote is None:
+            return None
+        current_vote = image_vote.vote
+
+    vote_buffer.add_vote(user.id, image_file_id, vote, current_vote)
+    vote_buffer.start(current_app._get_current_object())
+    invalidate_gallery_pages()
+    return image_metric(image_file_id)
+
+
+def upvote(user, image_file_id):
+    """
+    Adds upvote metric to the db.
+
+    Args:
+      user: User object, specifically current logged in user.
+      image_file_id: File ID of image.
+
+    Returns:
+      Boolean indicating result of operation.
+    """
+    metric_data = vote_image(
+        user,
+        image_file_id,
+        models.VoteEnum.UPVOTE.value)
+    return metric_data is not None
 
 
 def downvote(user, image_file_id):
@@ -580,37 +1102,74 @@ def downvote(user, image_file_id):
     Returns:
       Boolean indicating result of operation.
     """
-    # Check if Image file ID is invalid.
-    image_content = models.ImageContent().query.filter_by(
-        file_id=image_file_id).one_or_none()
-    if image_content is None:
-        return False
+    metric_data = vote_image(
+        user,
+        image_file_id,
+        models.VoteEnum.DOWNVOTE.value)
+    return metric_data is not None
 
-    downvote_obj = models.VoteCounter().query.filter_by(
-        user_id=user.id,
-        image_file_id=image_file_id)
-    downvote_ = downvote_obj.first()
 
-    if downvote_:
-        if downvote_.vote == models.VoteEnum.DOWNVOTE.value:
-            downvote_obj.delete()
-        else:
-            downvote_.vote = models.VoteEnum.DOWNVOTE.value
-    else:
-        downvote = models.VoteCounter(
-            user_id=user.id,
-            image_file_id=image_file_id,
-            vote=models.VoteEnum.DOWNVOTE.value)
+def image_scores(image_file_ids):
+    """
+    Loads score, upvotes and downvotes of multiple images using a single
+    query, including votes in the vote write-behind buffer.
 
-        db.session.add(downvote)
+    Args:
+      image_file_ids: List of Image IDs.
 
-    try:
-        db.session.commit()
-        return True
-    except Exception as e:
-        print("An error occured while downvoting content: ", e)
-        db.session.rollback()
-        return False
+    Returns:
+      Dict of (score, upvotes, downvotes) keyed by Image ID, Image IDs that
+      don't exist are left out.
+    """
+    if not image_file_ids:
+        return {}
+
+    image_file_ids = set(image_file_ids)
+    image_contents = db.session.query(
+        models.ImageContent.file_id,
+        models.ImageContent.score,
+        models.ImageContent.upvotes,
+        models.ImageContent.downvotes).filter(
+        models.ImageContent.file_id.in_(image_file_ids)).all()
+
+    scores = {}
+    for image_content in image_contents:
+        scores[image_content.file_id] = (
+            image_content.score,
+            image_content.upvotes,
+            image_content.downvotes)
+
+    if current_app.config.get("VOTE_WRITE_BEHIND"):
+        pending_scores = vote_buffer.pending_scores(scores.keys())
+        for image_file_id, deltas in pending_scores.items():
+            scores[image_file_id] = tuple(
+                value + delta for value, delta in zip(
+                    scores[image_file_id], deltas))
+    return scores
+
+
+def image_metrics(image_file_ids):
+    """
+    Loads aggregated ImageContent voting metric for multiple images
+    using a single query.
+
+    Args:
+      image_file_ids: List of Image IDs.
+
+    Returns:
+      Dict of ImageContent aggregated voting metric keyed by Image ID,
+      Image IDs that don't exist are left out.
+    """
+    metrics = {}
+    for image_file_id, (score, upvotes, downvotes) in image_scores(
+            image_file_ids).items():
+        metric_dict = {}
+        no_votes = upvotes == 0 and downvotes == 0
+        metric_dict['total'] = '--' if no_votes else score
+        metric_dict['upvotes'] = upvotes
+        metric_dict['downvotes'] = downvotes
+        metrics[image_file_id] = metric_dict
+    return metrics
 
 
 def image_metric(image_file_id):
@@ -623,31 +1182,7 @@ def image_metric(image_file_id):
     Returns:
       ImageContent aggregated voting metric.
     """
-    image_content = models.ImageContent().query.filter_by(
-        file_id=image_file_id).first()
-    metric_dict = {}
-    if image_content:
-        vote_enum = models.VoteEnum
-        sum_aggr = models.VoteCounter.query.with_entities(
-            func.sum(models.VoteCounter.vote).filter(
-                models.VoteCounter.image_file_id == image_file_id).label(
-                'total'),
-            func.sum(models.VoteCounter.vote).filter(
-                models.VoteCounter.image_file_id == image_file_id,
-                models.VoteCounter.vote == vote_enum.UPVOTE.value).label(
-                'upvotes'),
-            func.sum(models.VoteCounter.vote).filter(
-                models.VoteCounter.image_file_id == image_file_id,
-                models.VoteCounter.vote == vote_enum.DOWNVOTE.value).label(
-                'downvotes')).first()
-        metric_dict['total'] = '--' if sum_aggr.total is None else sum_aggr.total
-        metric_dict['upvotes'] = 0 if sum_aggr.upvotes is None \
-            else sum_aggr.upvotes
-        metric_dict['downvotes'] = 0 if sum_aggr.downvotes is None \
-            else sum_aggr.downvotes
-        return metric_dict
-    else:
-        return None
+    return image_metrics([image_file_id]).get(image_file_id)
 
 
 def delete_user_content(user, image_id):
@@ -682,16 +1217,48 @@ def delete_user_content(user, image_id):
             # VoteCounter records for image.
             vote_counter = models.VoteCounter().query.filter_by(
                 image_file_id=image_content.first().file_id)
+            derivative_jobs = models.DerivativeJob().query.filter_by(
+                image_file_id=image_content.first().file_id)
+            owned_image_content = image_content.first()
             if image_content:
                 try:
                     # Deletes Vote counter for image content.
                     vote_counter.delete()
 
+                    # Queued thumbnail jobs of a shared blob are handed to
+                    # another image using it.
+                    if owned_image_content.blob_id is not None:
+                        shared_image_content = db.session.query(
+                            models.ImageContent.file_id).filter(
+                            models.ImageContent.blob_id ==
+                            owned_image_content.blob_id,
+                            models.ImageContent.id !=
+                            owned_image_content.id).first()
+                        if shared_image_content is not None:
+                            derivative_jobs.update({
+                                "image_file_id": shared_image_content.file_id
+                            }, synchronize_session=False)
+
+                    # Deletes queued thumbnail jobs for image content.
+                    derivative_jobs.delete()
+
                     # Delete image content.
                     image_content.delete()
 
+                    # Blob is deleted once no image uses it.
+                    blob_path = None
+                    if owned_image_content.blob_id is not None:
+                        blob_path = release_blob(owned_image_content)
+
                     # Commit session.
                     db.session.commit()
+                    invalidate_gallery_pages()
+
+                    # Buffered votes would reference the deleted image.
+                    vote_buffer.discard_image(owned_image_content.file_id)
+
+                    if blob_path is not None:
+                        delete_unreferenced_blob(blob_path)
 
                     return True, image_name, user_directory
                 except Exception as e:
@@ -0,0 +1,654 @@
+import os
+import math
+import time
+import click
+import shutil
+from functools import lru_cache, partial
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+from sqlalchemy import or_
+from sqlalchemy.sql import func
+
+from PIL import Image, ImageOps, features
+
+from .. import db
+from . import imager_bp
+from . import models
+from .similarity import hash_image_file
+from .utils import get_image_file_paths
+
+THUMBNAIL_SIZE = (240, 240)
+
+# Images are decoded at no less than REDUCING_GAP times the size they are
+# resized to, the final resample keeps quality close to resizing the full
+# resolution image.
+REDUCING_GAP = 2
+
+# Encoder options of formats derivatives are also stored in.
+DERIVATIVE_FORMATS = {
+    "avif": {"quality": 60},
+    "webp": {"quality": 80, "method": 4},
+}
+
+# Modes Image.reduce supports, palette and bilevel images are converted to
+# one first.
+REDUCIBLE_MODES = (
+    "L", "LA", "I", "F", "RGB", "RGBA", "RGBX", "CMYK", "YCbCr")
+
+EXIF_ORIENTATION_TAG = 0x0112
+# EXIF orientations rotating the image by 90 or 270 degrees.
+EXIF_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def resize_scale(image_size, size, cover):
+    """
+    Gets scale an image is resized by.
+
+    Args:
+      image_size: Tuple of image width and height.
+      size: Tuple of width and height image is resized to.
+      cover: True if image is cropped to cover size, False if resized to fit
+        within size.
+
+    Returns:
+      Scale as a float.
+    """
+    scales = (size[0] / image_size[0], size[1] / image_size[1])
+    return max(scales) if cover else min(scales)
+
+
+def load_reduced_image(original_image, size, cover):
+    """
+    Decodes image close to the size it's resized to instead of at full
+    resolution. JPEGs are decoded at the nearest power of two scale using
+    draft mode, other images are reduced by an integer factor. Image is also
+    rotated according to its EXIF orientation.
+
+    Args:
+      original_image: PIL Image opened but not loaded.
+      size: Tuple of width and height image is resized to.
+      cover: True if image is cropped to cover size, False if resized to fit
+        within size.
+
+    Returns:
+      PIL Image.
+    """
+    # Draft size is in stored orientation i.e before rotation.
+    exif_orientation = original_image.getexif().get(EXIF_ORIENTATION_TAG)
+    draft_size = size
+    if exif_orientation in EXIF_TRANSPOSED_ORIENTATIONS:
+        draft_size = size[::-1]
+
+    scale = resize_scale(original_image.size, draft_size, cover)
+    if scale * REDUCING_GAP < 1:
+        original_image.draft(
+            original_image.mode,
+            (math.ceil(original_image.width * scale * REDUCING_GAP),
+             math.ceil(original_image.height * scale * REDUCING_GAP)))
+
+    image = original_image
+    if exif_orientation not in (None, 1):
+        image = ImageOps.exif_transpose(original_image)
+
+    # Reduces what draft mode couldn't e.g non JPEG images.
+    scale = resize_scale(image.size, size, cover)
+    reduce_factor = int(1 / (scale * REDUCING_GAP))
+    if reduce_factor > 1:
+        if image.mode in ("P", "PA"):
+            has_alpha = image.mode == "PA" or "transparency" in image.info
+            image = image.convert("RGBA" if has_alpha else "RGB")
+        elif image.mode == "1":
+            image = image.convert("L")
+
+        # Other modes e.g I;16 are only resized.
+        if image.mode in REDUCIBLE_MODES:
+            image = image.reduce(reduce_factor)
+    return image
+
+
+@lru_cache(maxsize=None)
+def is_format_supported(image_format):
+    """
+    Checks once per process if installed Pillow can encode a format, plugins
+    such as pillow-avif-plugin register their encoder when imported.
+
+    Args:
+      image_format: Format name i.e webp, avif.
+
+    Returns:
+      Boolean indicating if format is supported.
+    """
+    Image.init()
+    if image_format.upper() not in Image.SAVE:
+        return False
+    # Older Pillow doesn't know of formats added later, such as avif, and
+    # warns if they're checked as features.
+    if image_format in features.modules:
+        return features.check_module(image_format)
+    return True
+
+
+def get_supported_formats(formats):
+    """
+    Filters formats derivatives can be encoded in by installed Pillow.
+
+    Args:
+      formats: List of format names i.e webp, avif.
+
+    Returns:
+      List of supported format names.
+    """
+    return [
+        image_format for image_format in formats
+        if image_format in DERIVATIVE_FORMATS and
+        is_format_supported(image_format)]
+
+
+def format_path(derivative_path, image_format):
+    """
+    Gets file path of a derivative encoded in another format.
+
+    Args:
+      derivative_path: File path of derivative in the original format.
+      image_format: Format name i.e webp, avif.
+
+    Returns:
+      File path of derivative in the format.
+    """
+    return os.path.splitext(derivative_path)[0] + "." + image_format
+
+
+def save_derivative(image, output_path, original_format, formats=()):
+    """
+    Saves derivative in the format of the original image and in each of
+    formats, each is written to a temporary file first so a partially
+    written derivative is never served.
+
+    Args:
+      image: Resized PIL Image.
+      output_path: File path of derivative.
+      original_format: Format of original image i.e JPEG, PNG.
+      formats: List of supported format names i.e webp, avif.
+    """
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    if formats and image.mode not in ("RGB", "RGBA"):
+        has_alpha = "A" in image.getbands() or \
+            "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+
+    outputs = [(output_path, original_format, {})]
+    for image_format in formats:
+        outputs.append((
+            format_path(output_path, image_format),
+            image_format,
+            DERIVATIVE_FORMATS[image_format]))
+
+    for path, image_format, options in outputs:
+        temp_path = path + ".tmp"
+        image.save(temp_path, format=image_format, **options)
+        os.replace(temp_path, path)
+
+
+def generate_thumbnail(
+        image_path,
+        thumbnail_path,
+        size=THUMBNAIL_SIZE,
+        formats=()):
+    """
+    Creates thumbnail of an image.
+
+    Args:
+      image_path: File path of original image.
+      thumbnail_path: File path of thumbnail to be created.
+      size: Tuple of thumbnail width and height.
+      formats: List of other formats thumbnail is saved in.
+    """
+    with Image.open(image_path) as original_image:
+        thumbnail_image = ImageOps.fit(
+            image=load_reduced_image(original_image, size, cover=True),
+            size=size,
+            method=3,
+            bleed=0.0,
+            centering=(0.5, 0.5))
+
+        save_derivative(
+            thumbnail_image,
+            thumbnail_path,
+            original_image.format,
+            formats)
+
+
+def generate_rendition(image_path, rendition_path, size, formats=()):
+    """
+    Creates a resized copy of an image fitting within size and keeping its
+    aspect ratio. Images that already fit aren't copied, the original is
+    served in their place.
+
+    Args:
+      image_path: File path of original image.
+      rendition_path: File path of rendition to be created.
+      size: Tuple of max width and height.
+      formats: List of other formats rendition is saved in.
+    """
+    with Image.open(image_path) as original_image:
+        if original_image.width <= size[0] and \
+                original_image.height <= size[1]:
+            return
+
+        rendition_image = ImageOps.contain(
+            image=load_reduced_image(original_image, size, cover=False),
+            size=size,
+            method=Image.LANCZOS)
+
+        save_derivative(
+            rendition_image,
+            rendition_path,
+            original_image.format,
+            formats)
+
+
+def get_derivatives():
+    """
+    Gets functions creating each kind of derivative i.e the thumbnail crop
+    and a rendition for each size in IMAGE_RENDITIONS, saved in the
+    original format and each supported IMAGE_DERIVATIVE_FORMATS.
+
+    Returns:
+      Dict of functions taking original and output path keyed by kind.
+    """
+    formats = get_supported_formats(
+        current_app.config["IMAGE_DERIVATIVE_FORMATS"])
+
+    derivatives = {
+        "thumbnail": partial(generate_thumbnail, formats=formats)}
+    for size in current_app.config["IMAGE_RENDITIONS"]:
+        derivatives[str(size)] = partial(
+            generate_rendition,
+            size=(size, size),
+            formats=formats)
+    return derivatives
+
+
+def derivative_path(image_path, kind):
+    """
+    Gets file path of a derivative of an image.
+
+    Args:
+      image_path: File path of original image.
+      kind: Kind of derivative i.e thumbnail, rendition size.
+
+    Returns:
+      File path of derivative.
+    """
+    folder_path, filename = os.path.split(image_path)
+    if kind == "thumbnail":
+        return os.path.join(folder_path, "thumbnails", filename)
+    return os.path.join(folder_path, "renditions", kind, filename)
+
+
+def public_thumbnail_path(image_content):
+    """
+    Gets path thumbnail is published to under PUBLIC_THUMBNAIL_PATH i.e
+    <content hash prefix>/<file_id>.<extension>.
+
+    Args:
+      image_content: ImageContent object.
+
+    Returns:
+      Relative file path or None if image's file details aren't stored.
+    """
+    if not image_content.content_hash or not image_content.file_extension:
+        return None
+    return os.path.join(
+        image_content.content_hash[:2],
+        image_content.file_id + "." + image_content.file_extension)
+
+
+def publish_file(source_path, output_path):
+    """
+    Hard links file to output path, copied if on another filesystem.
+
+    Args:
+      source_path: File path of file to publish.
+      output_path: File path of published file.
+    """
+    temp_path = output_path + ".tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    try:
+        os.link(source_path, temp_path)
+    except OSError:
+        shutil.copyfile(source_path, temp_path)
+    os.replace(temp_path, output_path)
+
+
+def publish_thumbnail(image_content, thumbnail_path):
+    """
+    Publishes thumbnail and its other formats to PUBLIC_THUMBNAIL_PATH to be
+    served by a static file server or CDN, skipped unless
+    PUBLIC_THUMBNAIL_URL is set or if thumbnail isn't generated yet.
+    Doesn't commit.
+
+    Args:
+      image_content: ImageContent object.
+      thumbnail_path: File path of generated thumbnail.
+    """
+    public_path = public_thumbnail_path(image_content)
+    if not current_app.config.get("PUBLIC_THUMBNAIL_URL") or \
+            public_path is None or not os.path.isfile(thumbnail_path):
+        return
+
+    output_path = os.path.join(
+        current_app.config["PUBLIC_THUMBNAIL_PATH"],
+        public_path)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    formats = get_supported_formats(
+        current_app.config["IMAGE_DERIVATIVE_FORMATS"])
+    for image_format in formats:
+        thumbnail_format_path = format_path(thumbnail_path, image_format)
+        if os.path.isfile(thumbnail_format_path):
+            publish_file(
+                thumbnail_format_path,
+                format_path(output_path, image_format))
+    # Published last, it's what templates link to.
+    publish_file(thumbnail_path, output_path)
+
+    image_content.thumbnail_published = True
+
+
+def generate_derivatives(image_path):
+    """
+    Creates all derivatives of an image in the current process.
+
+    Args:
+      image_path: File path of original image.
+    """
+    for kind, generate_derivative in get_derivatives().items():
+        generate_derivative(image_path, derivative_path(image_path, kind))
+
+
+def queue_derivatives(image_file_id):
+    """
+    Adds jobs generating derivatives of an image to the session, they're
+    commited together with the ImageContent.
+
+    Args:
+      image_file_id: File ID of image.
+    """
+    for kind in get_derivatives():
+        db.session.add(models.DerivativeJob(
+            image_file_id=image_file_id,
+            kind=kind))
+
+
+def requeue_stale_jobs(stale_after):
+    """
+    Puts back running jobs not updated for stale_after seconds e.g jobs of a
+    worker that was killed.
+
+    Args:
+      stale_after: Seconds after which running jobs are assumed abandoned.
+
+    Returns:
+      Number of jobs requeued.
+    """
+    stale_time = datetime.now(timezone.utc) - timedelta(seconds=stale_after)
+    requeued = models.DerivativeJob.query.filter(
+        models.DerivativeJob.status == models.JobStatusEnum.RUNNING.value,
+        models.DerivativeJob.updated_time < stale_time).update({
+            "status": models.JobStatusEnum.PENDING.value,
+            "updated_time": func.now()
+        }, synchronize_session=False)
+    db.session.commit()
+    return requeued
+
+
+def claim_jobs(batch_size):
+    """
+    Marks pending jobs as running, each job is claimed with a conditional
+    update so concurrent workers never process the same job.
+
+    Args:
+      batch_size: Max number of jobs to claim.
+
+    Returns:
+      List of claimed DerivativeJob.
+    """
+    job_ids = db.session.query(models.DerivativeJob.id).filter_by(
+        status=models.JobStatusEnum.PENDING.value).order_by(
+        models.DerivativeJob.id).limit(batch_size).all()
+
+    claimed_ids = []
+    for job_id, in job_ids:
+        claimed = models.DerivativeJob.query.filter_by(
+            id=job_id,
+            status=models.JobStatusEnum.PENDING.value).update({
+                "status": models.JobStatusEnum.RUNNING.value,
+                "attempts": models.DerivativeJob.attempts + 1,
+                "updated_time": func.now()
+            }, synchronize_session=False)
+        if claimed:
+            claimed_ids.append(job_id)
+    db.session.commit()
+
+    if not claimed_ids:
+        return []
+    return models.DerivativeJob.query.filter(
+        models.DerivativeJob.id.in_(claimed_ids)).order_by(
+        models.DerivativeJob.id).all()
+
+
+def finish_job(job, error=None, max_attempts=3):
+    """
+    Marks job as done, or as failed if error occured, failed jobs are retried
+    until max_attempts is reached. Doesn't commit.
+
+    Args:
+      job: DerivativeJob object.
+      error: Error message or None if successful.
+      max_attempts: Number of times a job is attempted.
+    """
+    if error is None:
+        job.status = models.JobStatusEnum.DONE.value
+    elif job.attempts < max_attempts:
+        job.status = models.JobStatusEnum.PENDING.value
+    else:
+        job.status = models.JobStatusEnum.FAILED.value
+    job.error = error
+    job.updated_time = func.now()
+
+
+def shared_image_contents(image_content):
+    """
+    Gets images using the same blob as an image, the thumbnail of a blob is
+    published for each of them.
+
+    Args:
+      image_content: ImageContent object.
+
+    Returns:
+      List of ImageContent including image_content.
+    """
+    if image_content.blob_id is None:
+        return [image_content]
+    return models.ImageContent.query.filter_by(
+        blob_id=image_content.blob_id).all()
+
+
+def process_derivative_jobs(executor=None, batch_size=20, max_attempts=3):
+    """
+    Claims a batch of jobs and generates their derivatives.
+
+    Args:
+      executor: Executor generating derivatives in parallel, generated in the
+        current process if None.
+      batch_size: Max number of jobs to process.
+      max_attempts: Number of times a job is attempted.
+
+    Returns:
+      Number of jobs processed.
+    """
+    jobs = claim_jobs(batch_size)
+    upload_path = current_app.config["UPLOAD_PATH"]
+    derivatives = get_derivatives()
+
+    results = []
+    # ImageContent and file path of thumbnails, published once generated.
+    thumbnails = {}
+    # Perceptual hashes of images uploaded without one, computed with their
+    # thumbnail.
+    hashes = {}
+    for job in jobs:
+        image_content = models.ImageContent.query.filter_by(
+            file_id=job.image_file_id).one_or_none()
+        generate_derivative = derivatives.get(job.kind)
+        if image_content is None or generate_derivative is None:
+            results.append((job, None, "Invalid image or derivative."))
+            continue
+
+        folder_path, image_filenames = get_image_file_paths(
+            image_content,
+            upload_path)
+        if len(image_filenames) != 1:
+            results.append((job, None, "Image file not found."))
+            continue
+
+        image_path = os.path.join(folder_path, image_filenames[0])
+        output_path = derivative_path(image_path, job.kind)
+        if executor is None:
+            try:
+                generate_derivative(image_path, output_path)
+                results.append((job, None, None))
+            except Exception as e:
+                results.append((job, None, str(e)))
+        else:
+            results.append((job, executor.submit(
+                generate_derivative,
+                image_path,
+                output_path), None))
+
+        if job.kind == "thumbnail":
+            thumbnails[job.id] = (image_content, output_path)
+            if image_content.dhash is None:
+                if executor is None:
+                    hashes[job.id] = hash_image_file(image_path)
+                else:
+                    hashes[job.id] = executor.submit(
+                        hash_image_file,
+                        image_path)
+
+    for job, future, error in results:
+        if future is not None:
+            try:
+                future.result()
+            except Exception as e:
+                error = str(e)
+        if error is None and job.id in thumbnails:
+            try:
+                image_content, thumbnail_path = thumbnails[job.id]
+                hash_value = None
+                if job.id in hashes:
+                    hash_value, hash_error = hashes[job.id] \
+                        if executor is None else hashes[job.id].result()
+                    if hash_error is not None:
+                        # Left for `flask imager hash-images`.
+                        print("An error occured while hashing {}: {}".format(
+                            job.image_file_id, hash_error))
+
+                for shared_image_content in shared_image_contents(
+                        image_content):
+                    publish_thumbnail(shared_image_content, thumbnail_path)
+                    if hash_value is not None and \
+                            shared_image_content.dhash is None:
+                        shared_image_content.dhash = hash_value
+            except Exception as e:
+                error = str(e)
+        if error is not None:
+            print("An error occured while generating {} for {}: {}".format(
+                job.kind, job.image_file_id, error))
+        finish_job(job, error, max_attempts)
+
+    db.session.commit()
+    return len(jobs)
+
+
+@imager_bp.cli.command('queue-derivatives')
+def queue_all_derivatives():
+    """
+    Queues derivative jobs for every uploaded image e.g after changing
+    IMAGE_RENDITIONS or IMAGE_DERIVATIVE_FORMATS.
+    """
+    # Derivatives of each blob are generated once.
+    blob_file_ids = db.session.query(
+        func.min(models.ImageContent.file_id)).filter(
+        models.ImageContent.blob_id.isnot(None)).group_by(
+        models.ImageContent.blob_id)
+    image_file_ids = db.session.query(models.ImageContent.file_id).filter(
+        models.ImageContent.blob_id.is_(None)).union_all(blob_file_ids).all()
+    for image_file_id, in image_file_ids:
+        queue_derivatives(image_file_id)
+    db.session.commit()
+    click.echo("Queued derivatives of {} images.".format(
+        len(image_file_ids)))
+
+    # Published thumbnail paths include the content hash and extension.
+    if current_app.config.get("PUBLIC_THUMBNAIL_URL"):
+        unpublishable = models.ImageContent.query.filter(or_(
+            models.ImageContent.content_hash.is_(None),
+            models.ImageContent.file_extension.is_(None))).count()
+        if unpublishable:
+            click.echo(
+                "Thumbnails of {} images without file details won't be "
+                "published, run `flask imager backfill-file-metadata` "
+                "first.".format(unpublishable))
+
+
+@imager_bp.cli.command('process-derivatives')
+@click.option(
+    '--workers',
+    default=os.cpu_count(),
+    type=int,
+    help="Number of processes generating derivatives, 0 uses this process.")
+@click.option(
+    '--batch-size',
+    default=20,
+    type=int,
+    help="Number of jobs claimed at a time.")
+@click.option(
+    '--poll-interval',
+    default=2.0,
+    type=float,
+    help="Seconds to wait for new jobs when the queue is empty.")
+@click.option(
+    '--once',
+    is_flag=True,
+    help="Exit once the queue is empty.")
+def process_derivatives(workers, batch_size, poll_interval, once):
+    """
+    Generates thumbnails and renditions queued by uploads when
+    THUMBNAIL_ASYNC is enabled.
+    """
+    max_attempts = current_app.config["DERIVATIVE_MAX_ATTEMPTS"]
+    stale_after = current_app.config["DERIVATIVE_STALE_AFTER"]
+
+    executor = ProcessPoolExecutor(workers) if workers > 0 else None
+    try:
+        while True:
+            requeue_stale_jobs(stale_after)
+            processed = process_derivative_jobs(
+                executor,
+                batch_size,
+                max_attempts)
+            if processed:
+                click.echo("Processed {} jobs.".format(processed))
+            elif once:
+                break
+            else:
+                time.sleep(poll_interval)
+    finally:
+        if executor is not None:
+            executor.shutdown()
@@ -0,0 +1,105 @@
+import os
+import shutil
+import hashlib
+import tempfile
+
+from flask import Request, current_app
+
+# Directory in UPLOAD_PATH uploads are streamed to, on the same filesystem
+# as the user directories so they're moved into place with a rename.
+INCOMING_DIRECTORY = ".incoming"
+
+# Number of bytes kept from the start of an upload to check its type.
+HEADER_SIZE = 512
+CHUNK_SIZE = 64 * 1024
+
+
+class IngestFile:
+    """
+    Temporary file an upload is written to in chunks, hashed with SHA-256
+    as it's written. The file is removed when closed unless moved into
+    place with save.
+    """
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.name = tempfile.mkstemp(suffix=".part", dir=directory)
+        self._file = os.fdopen(fd, "wb+")
+        self._hash = hashlib.sha256()
+
+        self.header = b""
+        self.size = 0
+
+    def __getattr__(self, name):
+        # read, seek, tell etc of the underlying file.
+        return getattr(self._file, name)
+
+    def write(self, data):
+        if len(self.header) < HEADER_SIZE:
+            self.header += bytes(data[:HEADER_SIZE - len(self.header)])
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def save(self, file_path):
+        """
+        Moves file into place, a partially written file is never found at
+        file_path.
+
+        Args:
+          file_path: File path file is moved to.
+        """
+        self._file.close()
+        os.replace(self.name, file_path)
+        self.name = None
+
+    def close(self):
+        self._file.close()
+        if self.name is not None:
+            try:
+                os.remove(self.name)
+            except FileNotFoundError:
+                pass
+            self.name = None
+
+
+class IngestRequest(Request):
+    """
+    Request streaming uploaded files to IngestFile in UPLOAD_PATH instead of
+    memory or the system temporary directory.
+    """
+    def _get_file_stream(
+            self,
+            total_content_length,
+            content_type,
+            filename=None,
+            content_length=None):
+        return IngestFile(os.path.join(
+            current_app.config["UPLOAD_PATH"],
+            INCOMING_DIRECTORY))
+
+
+def ingest_upload(file, directory):
+    """
+    Gets IngestFile of an upload streamed by IngestRequest, other uploads
+    are copied to one in chunks.
+
+    Args:
+      file: FileStorage object containg uploaded data.
+      directory: Directory uploads not yet streamed are copied to.
+
+    Returns:
+      IngestFile, to be moved into place with save or removed with close.
+    """
+    if isinstance(file.stream, IngestFile):
+        return file.stream
+
+    ingest_file = IngestFile(directory)
+    try:
+        shutil.copyfileobj(file.stream, ingest_file, CHUNK_SIZE)
+    except Exception:
+        ingest_file.close()
+        raise
+    return ingest_file
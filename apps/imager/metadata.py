@@ -0,0 +1,130 @@
+import os
+import hashlib
+import click
+
+from flask import current_app
+
+from PIL import Image
+
+from .. import db
+from . import imager_bp
+from . import models
+from .utils import get_image_file_paths
+from .derivatives import (
+    EXIF_ORIENTATION_TAG,
+    EXIF_TRANSPOSED_ORIENTATIONS)
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def hash_file(image_path):
+    """
+    Gets SHA-256 digest of a file, read in chunks.
+
+    Args:
+      image_path: File path of image.
+
+    Returns:
+      Hex digest string.
+    """
+    file_hash = hashlib.sha256()
+    with open(image_path, "rb") as image_file:
+        for chunk in iter(lambda: image_file.read(HASH_CHUNK_SIZE), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_image_metadata(image_path, content_hash=None):
+    """
+    Gets details of an image file stored on ImageContent. Width and height
+    are of the image as displayed i.e after applying its EXIF orientation,
+    only the image header is read.
+
+    Args:
+      image_path: File path of image.
+      content_hash: Hex SHA-256 digest if already known, file is hashed if
+        None.
+
+    Returns:
+      Dict of file_extension, file_size, width, height and content_hash.
+    """
+    with Image.open(image_path) as image:
+        width, height = image.size
+        orientation = image.getexif().get(EXIF_ORIENTATION_TAG)
+        if orientation in EXIF_TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+
+    return {
+        "file_extension": os.path.splitext(image_path)[1][1:],
+        "file_size": os.path.getsize(image_path),
+        "width": width,
+        "height": height,
+        "content_hash": content_hash or hash_file(image_path)}
+
+
+def backfill_file_metadata(batch_size=100):
+    """
+    Stores file details of uploads missing them, uploads whose file is
+    missing are skipped.
+
+    Args:
+      batch_size: Number of ImageContent updated per commit.
+
+    Returns:
+      Tuple of number of updated and skipped ImageContent.
+    """
+    upload_path = current_app.config["UPLOAD_PATH"]
+
+    updated = 0
+    skipped = 0
+    last_id = 0
+    while True:
+        image_contents = models.ImageContent.query.filter(
+            models.ImageContent.file_extension.is_(None),
+            models.ImageContent.id > last_id).order_by(
+                models.ImageContent.id).limit(batch_size).all()
+        if not image_contents:
+            break
+
+        for image_content in image_contents:
+            last_id = image_content.id
+
+            folder_path, image_filenames = get_image_file_paths(
+                image_content,
+                upload_path)
+            if len(image_filenames) != 1:
+                skipped += 1
+                continue
+
+            try:
+                image_metadata = get_image_metadata(
+                    os.path.join(folder_path, image_filenames[0]))
+            except Exception as e:
+                print("An error occured while reading image file: ", e)
+                skipped += 1
+                continue
+
+            for key, value in image_metadata.items():
+                setattr(image_content, key, value)
+            updated += 1
+
+        db.session.commit()
+
+    return updated, skipped
+
+
+@imager_bp.cli.command('backfill-file-metadata')
+@click.option(
+    '--batch-size',
+    default=100,
+    show_default=True,
+    help="Number of images updated per commit.")
+def backfill_file_metadata_command(batch_size):
+    """
+    Stores file extension, size, dimensions and content hash of uploads
+    made before they were stored.
+    """
+    updated, skipped = backfill_file_metadata(batch_size)
+    click.echo("Updated {} images, skipped {} missing or invalid.".format(
+        updated,
+        skipped))
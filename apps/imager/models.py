@@ -1,5 +1,7 @@
 from .. import db
-from sqlalchemy.sql import func
+from ..search import register_search_index
+from ..suggest import register_suggestions
+from sqlalchemy.sql import func, false
 
 from enum import Enum
 
@@ -9,8 +11,22 @@ class VoteEnum(Enum):
     UPVOTE = 1
 
 
+class JobStatusEnum(Enum):
+    PENDING = 0
+    RUNNING = 1
+    DONE = 2
+    FAILED = 3
+
+
 class VoteCounter(db.Model):
     __tablename__ = "vote_counter"
+    __table_args__ = (
+        # A user has one vote per image, also indexes user vote lookups.
+        db.UniqueConstraint(
+            "user_id",
+            "image_file_id",
+            name="uq_vote_counter_user_id_image_file_id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(
@@ -19,7 +35,8 @@ class VoteCounter(db.Model):
         nullable=False)
     image_file_id = db.Column(
         db.String(50),
-        db.ForeignKey('image_content.file_id'))
+        db.ForeignKey('image_content.file_id'),
+        index=True)
     vote = db.Column(
         db.Integer,
         nullable=False)
@@ -43,7 +60,8 @@ class UserContent(db.Model):
     user_id = db.Column(
         db.Integer,
         db.ForeignKey('user.id'),
-        nullable=False)
+        nullable=False,
+        index=True)
     content_location = db.Column(
         db.String(100),
         nullable=False)
@@ -61,13 +79,45 @@ class UserContent(db.Model):
         return "<UserContent %s>" % self.id
 
 
+# Uploaded file stored once per content hash in UPLOAD_PATH/blobs and
+# shared by every ImageContent uploading the same bytes.
+class ImageBlob(db.Model):
+    __tablename__ = "image_blob"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # Hex SHA-256 digest of the file.
+    content_hash = db.Column(
+        db.String(64),
+        unique=True,
+        nullable=False)
+    file_extension = db.Column(
+        db.String(10),
+        nullable=False)
+    file_size = db.Column(db.BigInteger)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    # Number of ImageContent using the blob, files are removed at 0.
+    ref_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=1,
+        server_default="1")
+    created_time = db.Column(
+        db.DateTime(timezone=True),
+        server_default=func.now())
+
+    def __repr__(self):
+        return "<ImageBlob %s>" % self.id
+
+
 class ImageContent(db.Model):
     __tablename__ = "image_content"
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_content_id = db.Column(
         db.Integer,
-        db.ForeignKey('user_content.id'))
+        db.ForeignKey('user_content.id'),
+        index=True)
     file_id = db.Column(
         db.String(50),
         unique=True,
@@ -78,7 +128,51 @@ class ImageContent(db.Model):
     description = db.Column(db.Text)
     upload_time = db.Column(
         db.DateTime(timezone=True),
-        server_default=func.now())
+        server_default=func.now(),
+        index=True)
+
+    # Denormalized VoteCounter aggregates, kept in sync when voting.
+    score = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+        index=True)
+    upvotes = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0")
+    # Sum of downvotes i.e always less than or equal to zero.
+    downvotes = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0")
+
+    # Original file details, stored on upload so the file path is known
+    # without listing the user's directory. Null until backfilled with
+    # `flask imager backfill-file-metadata` for older uploads.
+    file_extension = db.Column(db.String(10))
+    file_size = db.Column(db.BigInteger)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    # Hex SHA-256 digest of the file.
+    content_hash = db.Column(db.String(64), index=True)
+    # Hex perceptual hash (dHash) used to find near-duplicate images.
+    dhash = db.Column(db.String(16))
+    # Shared file of the image, None for uploads stored in the user's
+    # directory before blobs were added.
+    blob_id = db.Column(
+        db.Integer,
+        db.ForeignKey('image_blob.id'),
+        index=True)
+    # Thumbnail is published to PUBLIC_THUMBNAIL_PATH.
+    thumbnail_published = db.Column(
+        db.Boolean,
+        nullable=False,
+        default=False,
+        server_default=false())
 
     tags = db.relationship(
         "ImageTags",
@@ -88,6 +182,8 @@ class ImageContent(db.Model):
         "UserContent",
         backref="image_content")
 
+    blob = db.relationship("ImageBlob")
+
     def __repr__(self):
         return "<ImageContent %s>" % self.id
 
@@ -105,8 +201,20 @@ class Tags(db.Model):
         return "<ImageTags %s>" % self.tag_name
 
 
+register_search_index(ImageContent, ["title", "description"])
+register_search_index(Tags, ["tag_name"])
+register_suggestions(ImageContent, "image", "file_id", "title")
+register_suggestions(Tags, "tag", "id", "tag_name")
+
+
 class ImageTags(db.Model):
     __tablename__ = "image_tags"
+    __table_args__ = (
+        db.Index(
+            "ix_image_tags_tag_id_image_content_id",
+            "tag_id",
+            "image_content_id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     tag_id = db.Column(
@@ -133,3 +241,45 @@ class ProfileImages(db.Model):
 
     def __repr__(self):
         return "<ProfileImages %s>" % self.id
+
+
+# Queue of derived images e.g thumbnails generated in the background by
+# `flask imager process-derivatives`.
+class DerivativeJob(db.Model):
+    __tablename__ = "derivative_job"
+    __table_args__ = (
+        db.Index(
+            "ix_derivative_job_status_id",
+            "status",
+            "id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    image_file_id = db.Column(
+        db.String(50),
+        db.ForeignKey('image_content.file_id'),
+        nullable=False,
+        index=True)
+    kind = db.Column(
+        db.String(20),
+        nullable=False)
+    status = db.Column(
+        db.Integer,
+        nullable=False,
+        default=JobStatusEnum.PENDING.value,
+        server_default=str(JobStatusEnum.PENDING.value))
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0")
+    error = db.Column(db.Text)
+    created_time = db.Column(
+        db.DateTime(timezone=True),
+        server_default=func.now())
+    updated_time = db.Column(
+        db.DateTime(timezone=True),
+        server_default=func.now())
+
+    def __repr__(self):
+        return "<DerivativeJob %s>" % self.id
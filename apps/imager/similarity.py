@@ -0,0 +1,429 @@
+import os
+import time
+import threading
+import click
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+
+from PIL import Image, ImageOps
+
+from .. import db
+from . import imager_bp
+from . import models
+from .utils import get_image_file_paths
+
+# dHash compares each pixel of a (DHASH_SIZE + 1) x DHASH_SIZE grayscale
+# copy with its right neighbour, giving a DHASH_SIZE ** 2 bit hash.
+DHASH_SIZE = 8
+
+# Max number of differing bits of near-duplicates, re-encoded or resized
+# copies usually differ by a few bits.
+MAX_HASH_DISTANCE = 10
+
+
+def dhash(image_path):
+    """
+    Computes difference hash of an image, similar images have hashes
+    differing by few bits. Images are decoded at reduced size with draft
+    mode where supported.
+
+    Args:
+      image_path: File path of image.
+
+    Returns:
+      Hex string of the hash.
+    """
+    size = (DHASH_SIZE + 1, DHASH_SIZE)
+    with Image.open(image_path) as image:
+        image.draft("L", (size[0] * 4, size[1] * 4))
+        image = ImageOps.exif_transpose(image).convert("L").resize(
+            size,
+            Image.BOX)
+        pixels = list(image.getdata())
+
+    hash_value = 0
+    for row in range(DHASH_SIZE):
+        for column in range(DHASH_SIZE):
+            left = pixels[row * size[0] + column]
+            right = pixels[row * size[0] + column + 1]
+            hash_value = (hash_value << 1) | (left > right)
+    return "{:0{}x}".format(hash_value, DHASH_SIZE ** 2 // 4)
+
+
+def hamming_distance(hash_value, other_hash_value):
+    return bin(hash_value ^ other_hash_value).count("1")
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree of hashes by Hamming distance. Searches only visit
+    children whose distance to their parent is within max_distance of the
+    query's, skipping most of the tree for small distances.
+    """
+    def __init__(self):
+        # Node is [hash, file ids, {distance: child node}].
+        self._root = None
+        self.size = 0
+
+    def add(self, hash_value, file_id):
+        self.size += 1
+        if self._root is None:
+            self._root = [hash_value, [file_id], {}]
+            return
+
+        node = self._root
+        while True:
+            distance = hamming_distance(hash_value, node[0])
+            if distance == 0:
+                node[1].append(file_id)
+                return
+
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hash_value, [file_id], {}]
+                return
+            node = child
+
+    def search(self, hash_value, max_distance):
+        """
+        Finds hashes within max_distance bits of hash_value.
+
+        Args:
+          hash_value: Integer hash.
+          max_distance: Max number of differing bits.
+
+        Returns:
+          List of tuples of distance and file id sorted by distance.
+        """
+        results = []
+        nodes = [self._root] if self._root is not None else []
+        while nodes:
+            node = nodes.pop()
+            distance = hamming_distance(hash_value, node[0])
+            if distance <= max_distance:
+                results.extend(
+                    (distance, file_id) for file_id in node[1])
+
+            for child_distance, child in node[2].items():
+                if abs(child_distance - distance) <= max_distance:
+                    nodes.append(child)
+        return sorted(results)
+
+
+class SimilarityIndex:
+    """
+    BK-tree of ImageContent perceptual hashes, built from the db on first
+    use. Images uploaded since, including by other processes, are added on
+    each search by loading rows with a greater id. Uploads waiting for the
+    derivative job to hash them are added once hashed. The tree is rebuilt
+    every rebuild_interval seconds in a background thread to drop deleted
+    images and pick up images hashed by `flask imager hash-images`, deleted
+    images are filtered out of results in between.
+
+    The db is queried without holding the lock searches take, it's only
+    held while adding hashes or swapping in a rebuilt tree.
+    """
+    def __init__(self, rebuild_interval=300):
+        self.rebuild_interval = rebuild_interval
+
+        self._lock = threading.Lock()
+        # Held while querying the db so one refresh or rebuild runs at once.
+        self._refresh_lock = threading.Lock()
+        self._tree = BKTree()
+        self._last_id = 0
+        # Ids of images waiting for the thumbnail job to hash them.
+        self._unhashed_ids = set()
+        self._built = False
+
+        self._rebuild_thread = None
+        self._pid = None
+
+    @property
+    def built(self):
+        return self._built
+
+    def _load_hashes(self, last_id, unhashed_ids):
+        image_hashes = db.session.query(
+            models.ImageContent.id,
+            models.ImageContent.file_id,
+            models.ImageContent.dhash).filter(
+            models.ImageContent.id > last_id).order_by(
+            models.ImageContent.id).all()
+        if unhashed_ids:
+            image_hashes += db.session.query(
+                models.ImageContent.id,
+                models.ImageContent.file_id,
+                models.ImageContent.dhash).filter(
+                models.ImageContent.id.in_(unhashed_ids),
+                models.ImageContent.dhash.isnot(None)).all()
+        return image_hashes
+
+    def _build(self):
+        # Images unhashed when the tree is built are only waited for if
+        # their thumbnail job is queued, others are left for the rebuild
+        # after `flask imager hash-images`. Read first so images hashed
+        # while loading are added by the next refresh.
+        unhashed_ids = set(
+            image_id for image_id, in db.session.query(
+                models.ImageContent.id).join(
+                models.DerivativeJob,
+                models.DerivativeJob.image_file_id ==
+                models.ImageContent.file_id).filter(
+                models.ImageContent.dhash.is_(None),
+                models.DerivativeJob.kind == "thumbnail",
+                models.DerivativeJob.status.in_([
+                    models.JobStatusEnum.PENDING.value,
+                    models.JobStatusEnum.RUNNING.value])))
+
+        tree = BKTree()
+        last_id = 0
+        for image_id, file_id, hash_value in self._load_hashes(0, ()):
+            last_id = max(last_id, image_id)
+            if hash_value is not None:
+                tree.add(int(hash_value, 16), file_id)
+                unhashed_ids.discard(image_id)
+
+        with self._lock:
+            self._tree = tree
+            self._last_id = last_id
+            self._unhashed_ids = unhashed_ids
+            self._built = True
+
+    def build(self):
+        """
+        Builds the tree from the db, replacing the current tree.
+        """
+        with self._refresh_lock:
+            self._build()
+
+    def refresh(self, wait=True):
+        """
+        Adds images uploaded or hashed since the last refresh, builds the
+        tree if not built.
+
+        Args:
+          wait: Whether to wait for a refresh or rebuild already running,
+            skipped if False.
+        """
+        if not self._built:
+            with self._refresh_lock:
+                if not self._built:
+                    self._build()
+            return
+
+        if not self._refresh_lock.acquire(blocking=wait):
+            return
+        try:
+            with self._lock:
+                last_id = self._last_id
+                unhashed_ids = set(self._unhashed_ids)
+
+            image_hashes = self._load_hashes(last_id, unhashed_ids)
+
+            with self._lock:
+                for image_id, file_id, hash_value in image_hashes:
+                    self._last_id = max(self._last_id, image_id)
+                    if hash_value is not None:
+                        self._tree.add(int(hash_value, 16), file_id)
+                        self._unhashed_ids.discard(image_id)
+                    else:
+                        self._unhashed_ids.add(image_id)
+        finally:
+            self._refresh_lock.release()
+
+    def start(self, app):
+        """
+        Starts thread rebuilding the tree every rebuild_interval seconds in
+        the current process, if not already running.
+
+        Args:
+          app: Flask app object.
+        """
+        if self.rebuild_interval <= 0:
+            return
+
+        with self._lock:
+            if self._pid == os.getpid() and self._rebuild_thread.is_alive():
+                return
+
+            self._pid = os.getpid()
+            self._rebuild_thread = threading.Thread(
+                target=self._rebuild_periodically,
+                args=(app,),
+                name="similarity-index-rebuild",
+                daemon=True)
+            self._rebuild_thread.start()
+
+    def _rebuild_periodically(self, app):
+        while True:
+            time.sleep(self.rebuild_interval)
+            with app.app_context():
+                try:
+                    self.build()
+                except Exception as e:
+                    db.session.rollback()
+                    print("An error occured while rebuilding similarity "
+                          "index: {}".format(e))
+                finally:
+                    db.session.remove()
+
+    def search(self, hash_value, max_distance=MAX_HASH_DISTANCE):
+        """
+        Finds near-duplicates of a hash.
+
+        Args:
+          hash_value: Hex string of the hash.
+          max_distance: Max number of differing bits.
+
+        Returns:
+          List of tuples of distance and file id sorted by distance.
+        """
+        # Searches don't queue behind a refresh another request is running.
+        self.refresh(wait=False)
+        with self._lock:
+            return self._tree.search(int(hash_value, 16), max_distance)
+
+
+def get_similarity_index():
+    app = current_app._get_current_object()
+    similarity_index = app.extensions.get("similarity_index")
+    if similarity_index is None:
+        similarity_index = app.extensions.setdefault(
+            "similarity_index",
+            SimilarityIndex(rebuild_interval=float(
+                app.config.get("SIMILARITY_REBUILD_INTERVAL") or 0)))
+    similarity_index.start(app)
+    return similarity_index
+
+
+def find_similar_images(image_content, max_distance=MAX_HASH_DISTANCE):
+    """
+    Finds near-duplicates of an image i.e re-encoded or resized copies.
+
+    Args:
+      image_content: ImageContent object.
+      max_distance: Max number of differing bits of perceptual hashes.
+
+    Returns:
+      List of tuples of distance and ImageContent sorted by distance, None
+      if image isn't hashed yet.
+    """
+    if image_content.dhash is None:
+        return None
+
+    matches = [
+        (distance, file_id)
+        for distance, file_id in get_similarity_index().search(
+            image_content.dhash,
+            max_distance)
+        if file_id != image_content.file_id]
+    if not matches:
+        return []
+
+    # Filters out deleted images.
+    image_contents = {
+        similar_image_content.file_id: similar_image_content
+        for similar_image_content in models.ImageContent.query.filter(
+            models.ImageContent.file_id.in_(
+                [file_id for _, file_id in matches])).all()}
+    return [
+        (distance, image_contents[file_id])
+        for distance, file_id in matches
+        if file_id in image_contents]
+
+
+def hash_image_file(image_path):
+    # Runs in worker processes, errors are returned instead of raised so
+    # one bad file doesn't stop the batch.
+    try:
+        return dhash(image_path), None
+    except Exception as e:
+        return None, str(e)
+
+
+def hash_unhashed_images(executor=None, batch_size=100):
+    """
+    Computes perceptual hashes of images missing them.
+
+    Args:
+      executor: Executor hashing images in parallel, hashed in the current
+        process if None.
+      batch_size: Number of ImageContent updated per commit.
+
+    Returns:
+      Tuple of number of hashed and skipped ImageContent.
+    """
+    upload_path = current_app.config["UPLOAD_PATH"]
+    map_function = map if executor is None else executor.map
+
+    hashed = 0
+    skipped = 0
+    last_id = 0
+    while True:
+        image_contents = models.ImageContent.query.filter(
+            models.ImageContent.dhash.is_(None),
+            models.ImageContent.id > last_id).order_by(
+                models.ImageContent.id).limit(batch_size).all()
+        if not image_contents:
+            break
+        last_id = image_contents[-1].id
+
+        image_paths = []
+        for image_content in image_contents:
+            folder_path, image_filenames = get_image_file_paths(
+                image_content,
+                upload_path)
+            if len(image_filenames) == 1:
+                image_paths.append(
+                    (image_content,
+                     os.path.join(folder_path, image_filenames[0])))
+            else:
+                skipped += 1
+
+        results = map_function(
+            hash_image_file,
+            [image_path for _, image_path in image_paths])
+        for (image_content, image_path), (hash_value, error) in zip(
+                image_paths,
+                results):
+            if error is not None:
+                print("An error occured while hashing {}: {}".format(
+                    image_path,
+                    error))
+                skipped += 1
+                continue
+
+            image_content.dhash = hash_value
+            hashed += 1
+
+        db.session.commit()
+
+    return hashed, skipped
+
+
+@imager_bp.cli.command('hash-images')
+@click.option(
+    '--workers',
+    default=os.cpu_count(),
+    type=int,
+    help="Number of processes hashing images, 0 uses this process.")
+@click.option(
+    '--batch-size',
+    default=100,
+    show_default=True,
+    help="Number of images updated per commit.")
+def hash_images(workers, batch_size):
+    """
+    Computes perceptual hashes of images uploaded before they were stored,
+    used to find near-duplicate images.
+    """
+    executor = ProcessPoolExecutor(workers) if workers > 0 else None
+    try:
+        hashed, skipped = hash_unhashed_images(executor, batch_size)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    click.echo("Hashed {} images, skipped {} missing or invalid.".format(
+        hashed,
+        skipped))
@@ -1,8 +1,15 @@
 import os
 import glob
+import json
 import uuid
-import imghdr
+import base64
+import re
+import datetime
 from functools import wraps
+from urllib.parse import quote
+
+import werkzeug.utils
+from flask import current_app, request, send_file
 from flask_login import current_user
 
 
@@ -10,6 +17,20 @@ PERMISSION_DENIED = "You don't have permission to post to this page,"\
     " Contact Administrator if you think you should."
 SERVER_ERROR = "An error occured in the server."
 
+# Directory in UPLOAD_PATH blobs are stored in.
+BLOB_DIRECTORY = "blobs"
+
+# Magic bytes of image formats and their extension.
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", ".jpeg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF8[79]a", ".gif"),
+    (b"RIFF.{4}WEBP", ".webp")]
+
+# MEDIA_SENDFILE values i.e front proxy headers file transfers are
+# offloaded with.
+MEDIA_SENDFILE_MODES = ("x-accel-redirect", "x-sendfile")
+
 MIN_TITLE_LENGTH = 1
 MAX_TITLE_LENGTH = 20
 INVALID_TITLE_LENGTH = "Title must be between {} and {} characters.".format(
@@ -112,7 +133,7 @@ def get_filter_options(category, sort_order):
 
 def validate_image(stream):
     """
-    Validates image using stream data.
+    Validates image using magic bytes at the start of stream data.
 
     Args:
       stream: Image stream.
@@ -120,12 +141,16 @@ def validate_image(stream):
     Returns:
       None or image extension.
     """
-    header = stream.read(512)
-    stream.seek(0)
-    format = imghdr.what(None, header)
-    if not format:
-        return None
-    return '.' + format
+    # Header is kept while the upload is streamed to disk.
+    header = getattr(stream, "header", None)
+    if header is None:
+        header = stream.read(512)
+        stream.seek(0)
+
+    for signature, extension in IMAGE_SIGNATURES:
+        if re.match(signature, header, re.DOTALL):
+            return extension
+    return None
 
 
 def create_content_directory(file_path, directory_name=None):
@@ -179,6 +204,26 @@ def generate_filename(name_len=8):
     return file_name
 
 
+def get_blob_path(upload_path, content_hash, file_extension):
+    """
+    Gets file path of blob i.e blobs/<hash prefix>/<hash>.<extension>.
+
+    Args:
+      upload_path: File path where user uploads directory is located
+                    on the server.
+      content_hash: Hex SHA-256 digest of the file.
+      file_extension: File extension without the dot.
+
+    Returns:
+      File path of blob.
+    """
+    return os.path.join(
+        upload_path,
+        BLOB_DIRECTORY,
+        content_hash[:2],
+        content_hash + "." + file_extension)
+
+
 def get_image_file_paths(image_content, upload_path):
     """
     Get file path for images based on ImageContent object from db.
@@ -197,22 +242,100 @@ def get_image_file_paths(image_content, upload_path):
         image_content.user_content.content_location
     )
 
+    if image_content.blob_id is not None:
+        folder_path, filename = os.path.split(get_blob_path(
+            upload_path,
+            image_content.content_hash,
+            image_content.file_extension))
+        return folder_path, [filename]
+
+    # Uses stored file extension, file isn't checked for existence.
+    if image_content.file_extension:
+        return folder_path, [
+            image_content.file_id + "." + image_content.file_extension]
+
     # File regex for file name by ID.
     file_regex = os.path.join(
         folder_path,
         image_content.file_id + ".*")
 
-    # Uses file_regex to get the proper filename with extension,
-    # Assumes file extension is not stored on db so need to get
-    # actual file with proper extension.
+    # Uses file_regex to get the proper filename with extension for
+    # uploads whose file extension isn't stored yet.
     image_filenames = [
         os.path.basename(fname) for fname in glob.glob(file_regex)]
     return folder_path, image_filenames
 
 
+def send_media(file_path, **kwargs):
+    """
+    Sends uploaded file, or hands the transfer to the front proxy when
+    MEDIA_SENDFILE is set so workers aren't tied up by slow clients. Only
+    headers are sent by the worker in that case.
+
+    Args:
+      file_path: File path of file in UPLOAD_PATH.
+      kwargs: Keyword arguments passed to send_file i.e etag.
+
+    Returns:
+      File response.
+    """
+    sendfile = current_app.config.get("MEDIA_SENDFILE")
+    if sendfile not in MEDIA_SENDFILE_MODES:
+        return send_file(file_path, **kwargs)
+
+    response = werkzeug.utils.send_file(
+        file_path,
+        request.environ,
+        use_x_sendfile=True,
+        response_class=current_app.response_class,
+        max_age=current_app.get_send_file_max_age,
+        **kwargs)
+    if sendfile == "x-accel-redirect":
+        # Nginx serves the file from an internal location aliased to
+        # UPLOAD_PATH.
+        file_path = response.headers.pop("X-Sendfile", None)
+        if file_path is not None:
+            response.headers["X-Accel-Redirect"] = quote(
+                current_app.config["MEDIA_ACCEL_PREFIX"].rstrip("/") +
+                "/" +
+                os.path.relpath(file_path, current_app.config["UPLOAD_PATH"]))
+    return response
+
+
+def delete_blob_files(blob_path):
+    """
+    Removes blob, its thumbnail and renditions. Only to be called once no
+    ImageContent references the blob.
+
+    Args:
+      blob_path: File path of blob.
+
+    Returns:
+      Boolean indicating result of operation.
+    """
+    folder_path, filename = os.path.split(blob_path)
+    content_hash = os.path.splitext(filename)[0]
+
+    blob_del_list = glob.glob(os.path.join(folder_path, content_hash + ".*"))
+    blob_del_list += glob.glob(os.path.join(
+        folder_path, 'thumbnails', content_hash + ".*"))
+    blob_del_list += glob.glob(os.path.join(
+        folder_path, 'renditions', '*', content_hash + ".*"))
+
+    try:
+        for blob_file in blob_del_list:
+            os.remove(blob_file)
+        return True
+
+    except Exception as e:
+        print("An error occured while deleting blob: ", e)
+        return False
+
+
 def delete_image_file(file_path, directory_name, file_id):
     """
-    Removes images and thumbnail image in their respective folder.
+    Removes images, thumbnail, renditions and published thumbnail in their
+    respective folder.
 
     Args:
       file_path: File path where images are stored.
@@ -239,8 +362,19 @@ def delete_image_file(file_path, directory_name, file_id):
     thumbnail_regex = os.path.join(*[dir_path, 'thumbnails', file_id + ".*"])
     image_del_list += glob.glob(thumbnail_regex)
 
+    # Renditions file regex.
+    rendition_regex = os.path.join(*[
+        dir_path, 'renditions', '*', file_id + ".*"])
+    image_del_list += glob.glob(rendition_regex)
+
+    # Published thumbnail file regex.
+    public_thumbnail_path = current_app.config.get("PUBLIC_THUMBNAIL_PATH")
+    if public_thumbnail_path:
+        image_del_list += glob.glob(os.path.join(
+            public_thumbnail_path, '*', file_id + ".*"))
+
     try:
-        # Remove image file and thumbnail from location.
+        # Remove image file, thumbnail and renditions from location.
         for image in image_del_list:
             os.remove(image)
 
@@ -250,3 +384,84 @@ def delete_image_file(file_path, directory_name, file_id):
         # TODO: Log error messages properly to a file.
         print("An error occured while removing files in the server: ", e)
         return False
+
+
+def encode_cursor(category, sort_order, sort_value, image_id):
+    """
+    Creates an opaque cursor pointing at an image in a sorted gallery,
+    used in keyset pagination.
+
+    Args:
+      category: Category the gallery is sorted by i.e upload_time, score.
+      sort_order: Sort order of the gallery i.e asc, desc.
+      sort_value: Value of the category for the image.
+      image_id: ImageContent id, used to break ties between images.
+
+    Returns:
+      Cursor string.
+    """
+    if isinstance(sort_value, datetime.datetime):
+        sort_value = sort_value.isoformat()
+
+    cursor_data = json.dumps(
+        [category, sort_order, sort_value, image_id],
+        separators=(",", ":"))
+    cursor = base64.urlsafe_b64encode(cursor_data.encode("utf-8"))
+    return cursor.decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, category, sort_order):
+    """
+    Decodes cursor created by encode_cursor.
+
+    Args:
+      cursor: Cursor string.
+      category: Category the gallery is sorted by i.e upload_time, score.
+      sort_order: Sort order of the gallery i.e asc, desc.
+
+    Returns:
+      Tuple of the category value and ImageContent id or None if cursor
+      is invalid or was created for a different category or sort order.
+    """
+    try:
+        cursor_data = base64.urlsafe_b64decode(
+            cursor + "=" * (-len(cursor) % 4))
+        cursor_category, cursor_sort, sort_value, image_id = json.loads(
+            cursor_data.decode("utf-8"))
+    except Exception:
+        return None
+
+    if cursor_category != category or cursor_sort != sort_order:
+        return None
+    if not isinstance(image_id, int):
+        return None
+
+    try:
+        if category == "upload_time":
+            sort_value = datetime.datetime.fromisoformat(sort_value)
+        elif category == "score":
+            sort_value = int(sort_value)
+        else:
+            return None
+    except (TypeError, ValueError):
+        return None
+    return sort_value, image_id
+
+
+def get_dialect_insert(dialect_name):
+    """
+    Gets insert construct supporting ON CONFLICT clauses for the database.
+
+    Args:
+      dialect_name: Name of database dialect i.e postgresql, sqlite.
+
+    Returns:
+      Dialect specific insert function or None if not supported.
+    """
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert
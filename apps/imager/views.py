@@ -8,17 +8,24 @@ from flask import (
     flash,
     jsonify,
     current_app,
-    send_from_directory,
     abort)
 from flask_login import (
     login_required,
     current_user)
 from werkzeug.utils import secure_filename
+from flask_sqlalchemy import Pagination
 
 from . import imager_bp
+from .models import VoteEnum
+from .derivatives import (
+    THUMBNAIL_SIZE,
+    derivative_path,
+    format_path,
+    get_supported_formats)
 from .forms import *
 from .controllers import *
 from .utils import (
+    send_media,
     get_filter_options,
     EMAIL_CHANGE_WARNING,
     USERNAME_SUCCESSFULLY_CHANGED,
@@ -32,6 +39,11 @@ from .utils import (
     EMAIL_SUCCESSFULLY_SENT,
     EMAIL_FAILED_SENT)
 
+# ETag suffix of original images.
+IMAGE_VARIANT = "original"
+# Images and derivatives are cached for a year.
+IMMUTABLE_MAX_AGE = 31536000
+
 
 @imager_bp.route("/about")
 def about():
@@ -43,6 +55,7 @@ def about():
 @imager_bp.route('/<string:category>/<string:category_filter>')
 def index(category="upload_time", category_filter="desc"):
     page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor', None, type=str)
 
     if category_filter not in ['asc', 'desc']:
         abort(404)
@@ -50,30 +63,43 @@ def index(category="upload_time", category_filter="desc"):
     if category == "upload_time":
         if category_filter is None:
             category_filter = "asc"  # Default value if no parameter.
-        image_contents = get_image_contents_by_time(category_filter)
     elif category == "score":
         if category_filter is None:
             category_filter = "desc"  # Default value if no parameter.
-        image_contents = get_image_contents_by_score(category_filter)
     elif category == "":
-        image_contents = get_image_contents_by_time()
+        category, category_filter = "upload_time", "asc"
     else:
         abort(404)
 
-    if not image_contents:
+    # Anonymous users share cached pages.
+    gallery_page = load_gallery_page(
+        current_user,
+        category,
+        category_filter,
+        page=page,
+        cursor=cursor)
+    if gallery_page is None:
+        abort(404)
+
+    data_dict = gallery_page["images"]
+    next_cursor = gallery_page["next_cursor"]
+    if cursor is not None:
         images_pagination = []
-        data_dict = []
     else:
-        images_pagination = image_content_pagination(
-            image_contents,
-            page=page)
-        data_dict = get_image_details(current_user, images_pagination.items)
+        images_pagination = Pagination(
+            None,
+            gallery_page["page"],
+            gallery_page["per_page"],
+            gallery_page["total"],
+            [])
 
     filter_options = get_filter_options(category, category_filter)
     return render_template(
         "imager/index.html",
         images=data_dict,
         images_pagination=images_pagination,
+        cursor=cursor,
+        next_cursor=next_cursor,
         filter_options=filter_options)
 
 
@@ -183,58 +209,259 @@ def upload_images():
         form=upload_file_form)
 
 
-@imager_bp.route("/upload/image/<string:image_id>")
-def load_image_by_id(image_id):
+def send_image_file(image_id, kind=None):
+    """
+    Sends uploaded image or one of its derivatives, falls back to the
+    original image until the derivative is generated.
+
+    File ids are never reused so images and generated derivatives are
+    cached for good, conditional requests with the ETag of the same file id
+    are answered before loading the image from the database.
+
+    Args:
+      image_id: File id representing the image.
+      kind: Kind of derivative i.e thumbnail, rendition size or None for the
+        original image.
+
+    Returns:
+      Image file response.
+    """
+    not_modified = not_modified_response(image_id, kind)
+    if not_modified is not None:
+        return not_modified
+
     image_content = get_image_content_by_id(image_id)
-    
-    if image_content:
-        # Gets filenames and filepath using ImageContent object.
-        folder_path, image_filenames = get_image_file_paths(
-            image_content,
-            current_app.config["UPLOAD_PATH"])
-        
-        # Checks if actual file exists.
-        if len(image_filenames) == 0:
-            abort(404)
-        # Check if duplicate files with same ID exists.
-        elif len(image_filenames) > 1:
-            # Log errors here, duplicates IDS not allowed.
-            print("Duplicate file {} found".format(file_regex))
-            abort(404)
+    if image_content is None:
+        abort(404)
+
+    # Gets filenames and filepath using ImageContent object.
+    folder_path, image_filenames = get_image_file_paths(
+        image_content,
+        current_app.config["UPLOAD_PATH"])
+
+    # Checks if actual file exists.
+    if len(image_filenames) == 0:
+        abort(404)
+    # Check if duplicate files with same ID exists.
+    elif len(image_filenames) > 1:
+        # Log errors here, duplicates IDS not allowed.
+        print("Duplicate file {} found".format(image_id))
+        abort(404)
+
+    image_path = os.path.join(folder_path, image_filenames[0])
+    if kind is None:
+        variant = IMAGE_VARIANT
+    else:
+        image_derivative_path = derivative_path(image_path, kind)
+        if os.path.isfile(image_derivative_path):
+            image_path = accepted_format_path(image_derivative_path)
+            variant = derivative_variant(kind, image_path)
+        elif rendition_not_needed(image_content, kind):
+            # Original image is the rendition.
+            variant = derivative_variant(kind, image_path)
         else:
-            return send_from_directory(
-                folder_path,
-                image_filenames[0])
+            variant = None
+
+    response = send_media(
+        image_path,
+        etag=image_etag(image_id, variant or kind + "-pending"))
+    if variant is None:
+        # Revalidated until the derivative is generated.
+        response.cache_control.no_cache = True
+    else:
+        set_immutable_cache_control(response)
+
+    if kind is not None:
+        # Caches have to keep a copy per format.
+        response.vary.add("Accept")
+    return response
+
+
+def image_etag(image_id, variant):
+    """
+    Gets ETag of an image or derivative.
+
+    Args:
+      image_id: File id representing the image.
+      variant: ETag suffix i.e original, thumbnail.webp.
+
+    Returns:
+      ETag string.
+    """
+    return "{}:{}".format(image_id, variant)
+
+
+def derivative_variant(kind, image_path):
+    """
+    Gets ETag suffix of a derivative i.e thumbnail.webp.
+
+    Args:
+      kind: Kind of derivative i.e thumbnail, rendition size.
+      image_path: File path of the file sent.
+
+    Returns:
+      ETag suffix string.
+    """
+    return kind + "." + os.path.splitext(image_path)[1][1:]
+
+
+def rendition_not_needed(image_content, kind):
+    """
+    Checks if image already fits within a rendition size using stored
+    image dimensions, renditions aren't created for such images.
+
+    Args:
+      image_content: ImageContent object.
+      kind: Kind of derivative i.e thumbnail, rendition size.
+
+    Returns:
+      Boolean indicating if original image is served as the rendition.
+    """
+    if not kind.isdigit() or \
+            image_content.width is None or image_content.height is None:
+        return False
+    return max(image_content.width, image_content.height) <= int(kind)
+
 
+def set_immutable_cache_control(response):
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+
+
+def not_modified_response(image_id, kind=None):
+    """
+    Answers conditional requests for an image or generated derivative
+    without loading it, as their content never changes. Only ETags sent
+    for the same file id match, ETags of derivatives not yet generated
+    don't and go through the full request.
+
+    Args:
+      image_id: File id representing the image.
+      kind: Kind of derivative i.e thumbnail, rendition size or None for the
+        original image.
+
+    Returns:
+      304 response or None if request has no matching ETag.
+    """
+    if not request.if_none_match:
+        return None
+
+    if kind is None:
+        variants = [IMAGE_VARIANT]
+    else:
+        # Derivatives are sent in one of the derivative formats or the
+        # format of the original image.
+        image_formats = get_supported_formats(
+            current_app.config["IMAGE_DERIVATIVE_FORMATS"]) + [
+            image_extension.lstrip(".")
+            for image_extension in current_app.config["UPLOAD_EXTENSIONS"]]
+        variants = [
+            kind + "." + image_format for image_format in image_formats]
+
+    matched_etag = None
+    for variant in variants:
+        etag = image_etag(image_id, variant)
+        if request.if_none_match.is_strong(etag):
+            matched_etag = etag
+            break
+
+    if matched_etag is None:
+        return None
+
+    response = current_app.response_class(status=304)
+    response.set_etag(matched_etag)
+    set_immutable_cache_control(response)
+    if kind is not None:
+        response.vary.add("Accept")
+    return response
+
+
+def accepted_format_path(image_derivative_path):
+    """
+    Gets file path of derivative in the first of IMAGE_DERIVATIVE_FORMATS
+    the browser explicitly accepts, wildcards such as */* are ignored as
+    browsers send them for formats they can't decode.
+
+    Args:
+      image_derivative_path: File path of derivative in the original format.
+
+    Returns:
+      File path of derivative in accepted format, or the original format.
+    """
+    accepted_mimetypes = {
+        mimetype for mimetype, quality in request.accept_mimetypes
+        if quality > 0}
+
+    formats = get_supported_formats(
+        current_app.config["IMAGE_DERIVATIVE_FORMATS"])
+    for image_format in formats:
+        if "image/" + image_format not in accepted_mimetypes:
+            continue
+
+        image_format_path = format_path(image_derivative_path, image_format)
+        if os.path.isfile(image_format_path):
+            return image_format_path
+    return image_derivative_path
+
+
+@imager_bp.route("/upload/image/<string:image_id>")
+def load_image_by_id(image_id):
+    return send_image_file(image_id)
+
+
+@imager_bp.route("/upload/image/<string:image_id>/<int:size>")
+def load_image_rendition_by_id(image_id, size):
+    if size == THUMBNAIL_SIZE[0]:
+        return send_image_file(image_id, "thumbnail")
+    elif size in current_app.config["IMAGE_RENDITIONS"]:
+        return send_image_file(image_id, str(size))
     abort(404)
 
 
 @imager_bp.route("/upload/thumbnail/<string:image_id>")
 def load_thumbnail_by_id(image_id):
-    image_content = get_image_content_by_id(image_id)
+    return send_image_file(image_id, "thumbnail")
 
-    if image_content:
-        # Gets filenames and filepath using ImageContent object.
-        folder_path, image_filenames = get_image_file_paths(
-            image_content,
-            current_app.config["UPLOAD_PATH"])
 
-        # Checks if actual file exists.
-        if len(image_filenames) == 0:
-            abort(404)
-        # Check if duplicate files with same ID exists.
-        elif len(image_filenames) > 1:
-            # Log errors here, duplicates IDS not allowed.
-            print("Duplicate file {} found".format(file_regex))
-            abort(404)
-        else:
-            return send_from_directory(
-                os.path.join(
-                    folder_path,
-                    "thumbnails"),
-                image_filenames[0])
+@imager_bp.app_template_global()
+def thumbnail_url(image):
+    """
+    Gets URL of thumbnail published under PUBLIC_THUMBNAIL_URL, or of the
+    thumbnail route if it isn't published.
 
-    abort(404)
+    Args:
+      image: Dict of image details from get_image_details.
+
+    Returns:
+      Thumbnail URL.
+    """
+    public_url = current_app.config.get("PUBLIC_THUMBNAIL_URL")
+    if public_url and image["public_thumbnail"] is not None:
+        return public_url.rstrip("/") + "/" + \
+            image["public_thumbnail"].replace(os.sep, "/")
+    return url_for('imager.load_thumbnail_by_id', image_id=image["file_id"])
+
+
+@imager_bp.app_template_global()
+def image_srcset(image_id):
+    """
+    Creates srcset attribute listing renditions of an image by width.
+
+    Args:
+      image_id: File id representing the image.
+
+    Returns:
+      srcset attribute value.
+    """
+    return ", ".join(
+        "{} {}w".format(
+            url_for(
+                'imager.load_image_rendition_by_id',
+                image_id=image_id,
+                size=size),
+            size)
+        for size in current_app.config["IMAGE_RENDITIONS"])
 
 
 @imager_bp.route("/gallery/<string:image_id>")
@@ -267,10 +494,17 @@ def load_gallery_image(image_id, username=None, category="upload_time", category
             abort(404)
 
     image_content = get_image_content_by_id(image_id)
-    
-    if image_content:
+
+    if image_content and image_contents:
+        # Image has to be in the user's gallery when navigating it.
+        if user and image_content.user_content.user_id != user.id:
+            abort(404)
+
         neighbours = get_imagecontent_neighbours(
-            image_content, image_contents.all())
+            image_content,
+            image_contents,
+            category,
+            category_filter)
 
         data_dict = get_image_details(current_user, [image_content])
         return render_template(
@@ -290,23 +524,24 @@ def load_gallery_search():
     page = request.args.get('page', 1, type=int)
 
     if query:
-        image_contents = search_by_title(query, False).all()
+        images_pagination, has_more = search_pagination(query, page=page)
+        if images_pagination is None:
+            abort(404)
     else:
-        image_contents = []
+        images_pagination, has_more = [], False
 
-    if not image_contents:
-        images_pagination = []
+    if not images_pagination or not images_pagination.items:
+        image_contents_len = 0
         data_dict = []
     else:
-        images_pagination = image_content_pagination(
-            search_by_title(query, False),
-            page=page)
+        image_contents_len = "{}+".format(images_pagination.total) \
+            if has_more else images_pagination.total
         data_dict = get_image_details(current_user, images_pagination.items)
     return render_template(
         "imager/search_result.html",
-        q="q=" + query,
+        q="q=" + (query or ""),
         images=data_dict,
-        image_contents_len=len(image_contents),
+        image_contents_len=image_contents_len,
         images_pagination=images_pagination)
 
 
@@ -565,10 +800,12 @@ def upvote_counter():
     """
     image_file_id = request.form.get('image_id', None)
     if image_file_id:
-        upvote_status = upvote(current_user, image_file_id)
-        if upvote_status:
-            metric_data = image_metric(image_file_id)
-            metric_data["status"] = upvote_status
+        metric_data = vote_image(
+            current_user,
+            image_file_id,
+            VoteEnum.UPVOTE.value)
+        if metric_data:
+            metric_data["status"] = True
             return jsonify(metric_data)
         else:
             return "An error occured performing operation.", 400
@@ -585,16 +822,30 @@ def downvote_counter():
     """
     image_file_id = request.form.get('image_id', None)
     if image_file_id:
-        downvote_status = downvote(current_user, image_file_id)
-        if downvote_status:
-            metric_data = image_metric(image_file_id)
-            metric_data["status"] = downvote_status
+        metric_data = vote_image(
+            current_user,
+            image_file_id,
+            VoteEnum.DOWNVOTE.value)
+        if metric_data:
+            metric_data["status"] = True
             return jsonify(metric_data)
         else:
             return "An error occured performing operation.", 400
     return "No parameter passed.", 400
 
 
+@imager_bp.route("/metric")
+def vote_metrics():
+    image_file_ids = request.args.getlist('image_id')
+    if len(image_file_ids) > MAX_PER_PAGE:
+        return "Too many parameters passed, max is {}.".format(
+            MAX_PER_PAGE), 400
+    if image_file_ids:
+        metric_data = image_metrics(image_file_ids)
+        return jsonify(metric_data)
+    return "No parameter passed.", 400
+
+
 @imager_bp.route("/metric/<string:image_file_id>")
 def vote_metric(image_file_id):
     metric_data = image_metric(image_file_id)
@@ -0,0 +1,327 @@
+"""
+Write-behind buffer for votes, enabled with VOTE_WRITE_BEHIND config.
+
+Votes are toggled in a process-local buffer and written to the db in a
+single transaction every VOTE_FLUSH_INTERVAL seconds, a viral image gets one
+score update per flush instead of one per vote.
+
+Durability:
+  - A vote is acknowledged once it's in the buffer. Votes not yet flushed are
+    lost if the process is killed, at most VOTE_FLUSH_INTERVAL seconds of
+    votes. Pending votes are flushed when the process exits normally.
+  - Pending votes are only visible to the process that buffered them, other
+    gunicorn workers see them after the flush.
+  - A failed flush puts votes back in the buffer to be retried unless they
+    were replaced by newer votes of the same user. Votes failing integrity
+    checks are dropped instead as retrying can't succeed.
+  - Votes of images or users deleted before the flush are dropped.
+  - Image scores are recomputed from VoteCounter when flushed, they are exact
+    after each flush even if different workers buffered votes of a user.
+"""
+import os
+import time
+import atexit
+import threading
+
+from sqlalchemy import and_, bindparam, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import func
+
+from flask import current_app
+
+from .. import db
+from .. import auth
+from . import models
+from .utils import get_dialect_insert
+
+
+class VoteBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+        # User votes keyed by (user_id, image_file_id), None if removed.
+        self._votes = {}
+        # Score deltas keyed by image_file_id i.e [score, upvotes, downvotes].
+        self._scores = {}
+
+        # Votes being written to db, still served until commited.
+        self._flushing_votes = {}
+        self._flushing_scores = {}
+
+        self._flush_thread = None
+        self._pid = None
+
+    def start(self, app):
+        """
+        Starts thread flushing the buffer every VOTE_FLUSH_INTERVAL seconds
+        in the current process, if not already running.
+
+        Args:
+          app: Flask app object.
+        """
+        interval = float(app.config.get("VOTE_FLUSH_INTERVAL") or 0)
+        if interval <= 0:
+            return
+
+        with self._lock:
+            if self._pid == os.getpid() and self._flush_thread.is_alive():
+                return
+
+            if self._pid != os.getpid():
+                atexit.register(self._flush_at_exit, app)
+            self._pid = os.getpid()
+            self._flush_thread = threading.Thread(
+                target=self._flush_periodically,
+                args=(app, interval),
+                name="vote-buffer-flush",
+                daemon=True)
+            self._flush_thread.start()
+
+    def _flush_periodically(self, app, interval):
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                self.flush()
+
+    def _flush_at_exit(self, app):
+        with app.app_context():
+            self.flush()
+
+    def pending_vote(self, user_id, image_file_id):
+        """
+        Loads a user's vote not yet flushed.
+
+        Args:
+          user_id: User ID.
+          image_file_id: File ID of image.
+
+        Returns:
+          Tuple of boolean indicating if a vote is pending and the vote,
+          None if vote was removed.
+        """
+        key = (user_id, image_file_id)
+        with self._lock:
+            for votes in (self._votes, self._flushing_votes):
+                if key in votes:
+                    return True, votes[key]
+        return False, None
+
+    def pending_votes(self, user_id, image_file_ids):
+        """
+        Loads a user's votes not yet flushed for multiple images.
+
+        Returns:
+          Dict of votes keyed by Image ID, None if vote was removed.
+        """
+        user_votes = {}
+        with self._lock:
+            for votes in (self._flushing_votes, self._votes):
+                for image_file_id in image_file_ids:
+                    key = (user_id, image_file_id)
+                    if key in votes:
+                        user_votes[image_file_id] = votes[key]
+        return user_votes
+
+    def pending_scores(self, image_file_ids):
+        """
+        Loads score changes not yet flushed for multiple images.
+
+        Returns:
+          Dict of [score, upvotes, downvotes] deltas keyed by Image ID.
+        """
+        image_scores = {}
+        with self._lock:
+            for scores in (self._flushing_scores, self._scores):
+                for image_file_id in image_file_ids:
+                    if image_file_id not in scores:
+                        continue
+                    total = image_scores.setdefault(image_file_id, [0, 0, 0])
+                    for index, delta in enumerate(scores[image_file_id]):
+                        total[index] += delta
+        return image_scores
+
+    def add_vote(self, user_id, image_file_id, vote, current_vote):
+        """
+        Toggles a user's vote in the buffer.
+
+        Args:
+          user_id: User ID.
+          image_file_id: File ID of image.
+          vote: Vote value i.e VoteEnum.UPVOTE.value, VoteEnum.DOWNVOTE.value.
+          current_vote: User's vote in the db, used if no vote is pending.
+
+        Returns:
+          New vote of user, None if vote was removed.
+        """
+        key = (user_id, image_file_id)
+        with self._lock:
+            if key in self._votes:
+                current_vote = self._votes[key]
+            elif key in self._flushing_votes:
+                current_vote = self._flushing_votes[key]
+
+            new_vote = None if current_vote == vote else vote
+            self._votes[key] = new_vote
+
+            old_vote = current_vote or 0
+            scores = self._scores.setdefault(image_file_id, [0, 0, 0])
+            scores[0] += (new_vote or 0) - old_vote
+            scores[1] += max(new_vote or 0, 0) - max(old_vote, 0)
+            scores[2] += min(new_vote or 0, 0) - min(old_vote, 0)
+        return new_vote
+
+    def discard_image(self, image_file_id):
+        """
+        Removes buffered votes of a deleted image.
+
+        Args:
+          image_file_id: File ID of image.
+        """
+        with self._lock:
+            for key in [key for key in self._votes if key[1] == image_file_id]:
+                del self._votes[key]
+            self._scores.pop(image_file_id, None)
+
+    def flush(self):
+        """
+        Writes buffered votes and recomputes scores of voted images in a
+        single transaction.
+
+        Returns:
+          Number of votes written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                votes, scores = self._votes, self._scores
+                self._votes, self._scores = {}, {}
+                self._flushing_votes = votes
+                self._flushing_scores = scores
+
+            if not votes:
+                return 0
+
+            try:
+                written = write_votes(votes)
+                db.session.commit()
+            except IntegrityError as e:
+                print("An error occured while flushing votes, dropped "
+                      "{} votes: {}".format(len(votes), e))
+                db.session.rollback()
+                return 0
+            except Exception as e:
+                print("An error occured while flushing votes: ", e)
+                db.session.rollback()
+
+                # Requeues votes not replaced while flushing.
+                with self._lock:
+                    self._flushing_votes = {}
+                    self._flushing_scores = {}
+                    for key, vote in votes.items():
+                        self._votes.setdefault(key, vote)
+                    for image_file_id, deltas in scores.items():
+                        total = self._scores.setdefault(
+                            image_file_id, [0, 0, 0])
+                        for index, delta in enumerate(deltas):
+                            total[index] += delta
+                return 0
+            finally:
+                with self._lock:
+                    self._flushing_votes = {}
+                    self._flushing_scores = {}
+
+            # Cached pages of other processes don't include these votes.
+            current_app.extensions["page_cache"].invalidate("gallery")
+            return written
+
+
+def write_votes(votes):
+    """
+    Writes votes to the db and recomputes scores of the voted images from
+    VoteCounter, doesn't commit. Votes of images or users deleted since they
+    were buffered are skipped.
+
+    Args:
+      votes: Dict of votes keyed by (user_id, image_file_id), None if vote
+      was removed.
+
+    Returns:
+      Number of votes written.
+    """
+    existing_file_ids = set(
+        file_id for file_id, in db.session.query(
+            models.ImageContent.file_id).filter(
+            models.ImageContent.file_id.in_(
+                set(image_file_id for _, image_file_id in votes))))
+    existing_user_ids = set(
+        user_id for user_id, in db.session.query(
+            auth.models.User.id).filter(
+            auth.models.User.id.in_(
+                set(user_id for user_id, _ in votes))))
+    votes = {
+        key: vote for key, vote in votes.items()
+        if key[0] in existing_user_ids and key[1] in existing_file_ids}
+    if not votes:
+        return 0
+
+    vote_table = models.VoteCounter.__table__
+    removed_votes = []
+    added_votes = []
+    for (user_id, image_file_id), vote in votes.items():
+        vote_dict = {
+            "voter_id": user_id,
+            "voted_file_id": image_file_id,
+            "vote": vote}
+        if vote is None:
+            removed_votes.append(vote_dict)
+        else:
+            added_votes.append(vote_dict)
+
+    user_vote = and_(
+        vote_table.c.user_id == bindparam("voter_id"),
+        vote_table.c.image_file_id == bindparam("voted_file_id"))
+    insert = get_dialect_insert(db.engine.dialect.name)
+    if insert is None:
+        # Replaces votes as upserts aren't supported.
+        removed_votes = removed_votes + added_votes
+
+    if removed_votes:
+        db.session.execute(vote_table.delete().where(user_vote), removed_votes)
+
+    if added_votes:
+        values = {
+            "user_id": bindparam("voter_id"),
+            "image_file_id": bindparam("voted_file_id"),
+            "vote": bindparam("vote")}
+        if insert is None:
+            insert_stmt = vote_table.insert().values(**values)
+        else:
+            insert_stmt = insert(vote_table).values(**values)
+            insert_stmt = insert_stmt.on_conflict_do_update(
+                index_elements=["user_id", "image_file_id"],
+                set_={"vote": insert_stmt.excluded.vote})
+        db.session.execute(insert_stmt, added_votes)
+
+    image_file_ids = set(image_file_id for _, image_file_id in votes)
+
+    def vote_sum(*criteria):
+        return func.coalesce(
+            select(func.sum(models.VoteCounter.vote)).where(
+                models.VoteCounter.image_file_id ==
+                models.ImageContent.file_id,
+                *criteria).scalar_subquery(),
+            0)
+
+    models.ImageContent.query.filter(
+        models.ImageContent.file_id.in_(image_file_ids)).update({
+            "score": vote_sum(),
+            "upvotes": vote_sum(
+                models.VoteCounter.vote == models.VoteEnum.UPVOTE.value),
+            "downvotes": vote_sum(
+                models.VoteCounter.vote == models.VoteEnum.DOWNVOTE.value)
+        }, synchronize_session=False)
+    return len(votes)
+
+
+# Votes buffered by the current process.
+vote_buffer = VoteBuffer()
@@ -0,0 +1,278 @@
+import re
+import json
+import base64
+
+import sqlalchemy as sa
+from sqlalchemy import event
+
+from . import db
+
+# Text search configuration, "simple" doesn't stem or drop stop words so
+# titles and usernames match as typed.
+TEXT_SEARCH_CONFIG = "simple"
+
+# Words of search values, punctuation and underscores split words as they do
+# in the indexes.
+SEARCH_WORD_PATTERN = re.compile(r"[^\W_]+")
+
+search_indexes = {}
+
+
+class SearchIndex:
+    """
+    Full-text index of text columns of a table. PostgreSQL uses a GIN index
+    on their tsvector, SQLite an FTS5 table with the table as its external
+    content. Both are kept in sync by the database on insert, update and
+    delete, other databases fall back to ILIKE.
+    """
+    def __init__(self, table, columns):
+        self.table = table
+        self.columns = columns
+        self.name = "{}_search".format(table.name)
+        # Quoted as tables like "user" are reserved words in PostgreSQL.
+        self.quoted_table_name = '"{}"'.format(table.name)
+
+    def document(self, qualified=False):
+        # tsvector of the searched columns, qualified with the table name in
+        # queries. Queries have to use the index expression as is.
+        columns = [
+            column if not qualified else
+            "{}.{}".format(self.quoted_table_name, column)
+            for column in self.columns]
+        return "to_tsvector('{}', {})".format(
+            TEXT_SEARCH_CONFIG,
+            " || ' ' || ".join(
+                "coalesce({}, '')".format(column) for column in columns))
+
+    def create_statements(self, dialect_name):
+        """
+        Gets statements creating the index.
+
+        Args:
+          dialect_name: Name of the database dialect.
+
+        Returns:
+          List of SQL statements, empty if the dialect isn't supported.
+        """
+        if dialect_name == "postgresql":
+            return [
+                "CREATE INDEX {} ON {} USING gin ({})".format(
+                    self.name,
+                    self.quoted_table_name,
+                    self.document())]
+
+        if dialect_name == "sqlite":
+            columns = ", ".join(self.columns)
+            new_values = ", ".join(
+                "new.{}".format(column) for column in self.columns)
+            old_values = ", ".join(
+                "old.{}".format(column) for column in self.columns)
+            delete_old = (
+                "INSERT INTO {0}({0}, rowid, {1}) "
+                "VALUES ('delete', old.id, {2});").format(
+                    self.name,
+                    columns,
+                    old_values)
+            insert_new = (
+                "INSERT INTO {}(rowid, {}) "
+                "VALUES (new.id, {});").format(
+                    self.name,
+                    columns,
+                    new_values)
+            return [
+                ("CREATE VIRTUAL TABLE {} USING fts5({}, content='{}', "
+                 "content_rowid='id')").format(
+                    self.name,
+                    columns,
+                    self.table.name),
+                ("CREATE TRIGGER {0}_insert AFTER INSERT ON {1} "
+                 "BEGIN {2} END").format(
+                    self.name,
+                    self.quoted_table_name,
+                    insert_new),
+                ("CREATE TRIGGER {0}_delete AFTER DELETE ON {1} "
+                 "BEGIN {2} END").format(
+                    self.name,
+                    self.quoted_table_name,
+                    delete_old),
+                ("CREATE TRIGGER {0}_update AFTER UPDATE OF {1} ON {2} "
+                 "BEGIN {3} {4} END").format(
+                    self.name,
+                    columns,
+                    self.quoted_table_name,
+                    delete_old,
+                    insert_new),
+                # Indexes rows already in the table.
+                "INSERT INTO {0}({0}) VALUES ('rebuild')".format(self.name),
+            ]
+
+        return []
+
+    def drop_statements(self, dialect_name):
+        if dialect_name == "postgresql":
+            return ["DROP INDEX IF EXISTS {}".format(self.name)]
+
+        if dialect_name == "sqlite":
+            # Triggers are dropped with the table they're on.
+            return ["DROP TABLE IF EXISTS {}".format(self.name)]
+
+        return []
+
+    def filter(self, query, model, words, dialect_name):
+        """
+        Filters query to rows matching all words as prefixes, best matches
+        first.
+
+        Args:
+          query: Query of model.
+          model: Model of the indexed table.
+          words: List of search words.
+          dialect_name: Name of the database dialect.
+
+        Returns:
+          Filtered query.
+        """
+        if dialect_name == "postgresql":
+            document = sa.literal_column(self.document(qualified=True))
+            ts_query = sa.func.to_tsquery(
+                sa.literal_column("'{}'".format(TEXT_SEARCH_CONFIG)),
+                " & ".join("{}:*".format(word) for word in words))
+            return query.filter(
+                document.op("@@")(ts_query)).order_by(
+                sa.func.ts_rank(document, ts_query).desc(),
+                model.id)
+
+        if dialect_name == "sqlite":
+            search_table = sa.table(
+                self.name,
+                sa.column("rowid"),
+                sa.column("rank"))
+            # Words are quoted so they're never parsed as FTS5 syntax.
+            match = " ".join('"{}"*'.format(word) for word in words)
+            return query.join(
+                search_table,
+                search_table.c.rowid == model.id).filter(
+                sa.literal_column(self.name).op("MATCH")(match)).order_by(
+                search_table.c.rank,
+                model.id)
+
+        return query.filter(*[
+            sa.or_(*[
+                getattr(model, column).ilike("%{}%".format(word))
+                for column in self.columns])
+            for word in words]).order_by(model.id)
+
+
+def _create_search_index(target, connection, **kw):
+    for statement in search_indexes[target.name].create_statements(
+            connection.dialect.name):
+        connection.exec_driver_sql(statement)
+
+
+def _drop_search_index(target, connection, **kw):
+    for statement in search_indexes[target.name].drop_statements(
+            connection.dialect.name):
+        connection.exec_driver_sql(statement)
+
+
+def register_search_index(model, columns):
+    """
+    Adds full-text index of model's columns, created and dropped with its
+    table by db.create_all and db.drop_all. Migrations create it otherwise.
+
+    Args:
+      model: Model being indexed.
+      columns: List of names of text columns searched.
+    """
+    search_indexes[model.__table__.name] = SearchIndex(
+        model.__table__,
+        columns)
+    event.listen(model.__table__, "after_create", _create_search_index)
+    event.listen(model.__table__, "before_drop", _drop_search_index)
+
+
+def search(model, search_value, limit=None, offset=None):
+    """
+    Searches indexed columns of a model, each word of search_value matches
+    words starting with it.
+
+    Args:
+      model: Model with a search index.
+      search_value: Search value.
+      limit: Max number of results, all if None.
+      offset: Number of results skipped.
+
+    Returns:
+      Query of model ordered by rank.
+    """
+    search_index = search_indexes[model.__table__.name]
+    words = SEARCH_WORD_PATTERN.findall(search_value)
+
+    query = db.session.query(model)
+    if not words:
+        return query.filter(sa.false())
+
+    query = search_index.filter(query, model, words, db.engine.dialect.name)
+    if offset:
+        query = query.offset(offset)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def count_results(query, max_count):
+    """
+    Counts results of a search query up to max_count, common words aren't
+    counted past it.
+
+    Args:
+      query: Search query without limit or offset.
+      max_count: Max number of results counted.
+
+    Returns:
+      Tuple of number of results, at most max_count, and Boolean indicating
+      whether there are more.
+    """
+    count = db.session.query(sa.func.count()).select_from(
+        query.order_by(None).limit(max_count + 1).subquery()).scalar()
+    return min(count, max_count), count > max_count
+
+
+def encode_search_cursor(offset):
+    """
+    Creates an opaque cursor pointing at a page of search results.
+
+    Args:
+      offset: Number of results before the page.
+
+    Returns:
+      Cursor string.
+    """
+    cursor = base64.urlsafe_b64encode(
+        json.dumps(["search", offset]).encode("utf-8"))
+    return cursor.decode("ascii").rstrip("=")
+
+
+def decode_search_cursor(cursor):
+    """
+    Decodes cursor created by encode_search_cursor.
+
+    Args:
+      cursor: Cursor string, '' for first page.
+
+    Returns:
+      Offset of the page or None if cursor is invalid.
+    """
+    if not cursor:
+        return 0
+
+    try:
+        cursor_data = base64.urlsafe_b64decode(
+            cursor + "=" * (-len(cursor) % 4))
+        cursor_type, offset = json.loads(cursor_data.decode("utf-8"))
+    except Exception:
+        return None
+
+    if cursor_type != "search" or not isinstance(offset, int) or offset < 0:
+        return None
+    return offset
@@ -142,7 +142,7 @@ function load_picture_modal(pic) {
 
 	original_pic = pic.querySelector("img");
 	if (original_pic) {
-		image_elem.src = original_pic.src;
+		image_elem.src = original_pic.dataset.original || original_pic.src;
 		image_elem.alt = original_pic.alt;
 
 		image_modal.classList.toggle("show-modal");
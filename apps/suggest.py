@@ -0,0 +1,315 @@
+"""
+In-process prefix index of image titles, tag names and usernames answering
+the search dropdown without querying the db.
+
+Each worker loads the index from the db, then applies changes recorded in
+the suggestion_change table by the models' insert, update and delete events
+every SUGGEST_REFRESH_INTERVAL seconds in a background thread. A refresh
+interval of 0 applies them before each lookup instead.
+
+Consistency:
+  - Changes show up in suggestions of other workers after at most
+    SUGGEST_REFRESH_INTERVAL seconds.
+  - Bulk updates and deletes skip model events, and transactions may commit
+    changes with lower ids than ones already applied. The index is reloaded
+    every SUGGEST_RELOAD_INTERVAL seconds to pick them up.
+  - Changes applied by every worker's last reload are pruned on reload.
+"""
+import os
+import time
+import bisect
+import threading
+
+import sqlalchemy as sa
+from sqlalchemy import event
+
+from flask import current_app
+
+from . import db
+from .search import SEARCH_WORD_PATTERN
+
+# Models with suggestions keyed by kind i.e (model, id attribute, label
+# attribute).
+suggestion_models = {}
+
+
+class SuggestionChange(db.Model):
+    """
+    Change log of suggested labels, label is None if the item was deleted.
+    """
+    __tablename__ = "suggestion_change"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(10), nullable=False)
+    item_id = db.Column(db.String(64), nullable=False)
+    label = db.Column(db.Text)
+
+    def __repr__(self):
+        return "<SuggestionChange %s>" % self.id
+
+
+def suggestion_keys(label):
+    # Label from the start of each word, so later words of titles match.
+    label = label.casefold()
+    return {label[word.start():] for word in SEARCH_WORD_PATTERN.finditer(
+        label)} or {label}
+
+
+class SuggestionIndex:
+    """
+    Sorted list of (key, item id) of each kind, searched with bisect.
+    """
+    def __init__(self, refresh_interval=0, reload_interval=3600):
+        self.refresh_interval = refresh_interval
+        self.reload_interval = reload_interval
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._keys = {}
+        self._labels = {}
+
+        self._loaded = False
+        self._loaded_time = 0
+        self._last_change_id = 0
+        # Last change applied when loaded previously, older changes were
+        # applied by every worker running since.
+        self._previous_load_change_id = None
+
+        self._refresh_thread = None
+        self._pid = None
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def _add(self, kind, item_id, label):
+        keys = self._keys.setdefault(kind, [])
+        self._labels[(kind, item_id)] = label
+        for key in suggestion_keys(label):
+            bisect.insort(keys, (key, item_id))
+
+    def _remove(self, kind, item_id):
+        label = self._labels.pop((kind, item_id), None)
+        if label is None:
+            return
+
+        keys = self._keys[kind]
+        for key in suggestion_keys(label):
+            index = bisect.bisect_left(keys, (key, item_id))
+            if index < len(keys) and keys[index] == (key, item_id):
+                del keys[index]
+
+    def load(self):
+        """
+        Loads suggestions of all items from the db, replacing the index.
+        """
+        with self._refresh_lock:
+            # Read first so changes committed while loading are applied
+            # again by the next refresh.
+            last_change_id = db.session.query(
+                sa.func.max(SuggestionChange.id)).scalar() or 0
+
+            keys = {}
+            labels = {}
+            for kind, (model, id_attr, label_attr) in \
+                    suggestion_models.items():
+                kind_keys = keys.setdefault(kind, [])
+                for item_id, label in db.session.query(
+                        getattr(model, id_attr),
+                        getattr(model, label_attr)):
+                    if label is None:
+                        continue
+                    labels[(kind, str(item_id))] = label
+                    kind_keys.extend(
+                        (key, str(item_id)) for key in suggestion_keys(label))
+                kind_keys.sort()
+
+            if self._previous_load_change_id:
+                SuggestionChange.query.filter(
+                    SuggestionChange.id <= self._previous_load_change_id
+                ).delete(synchronize_session=False)
+            db.session.commit()
+
+            with self._lock:
+                self._keys = keys
+                self._labels = labels
+                self._previous_load_change_id = self._last_change_id
+                self._last_change_id = last_change_id
+                self._loaded = True
+                self._loaded_time = time.monotonic()
+
+    def refresh(self):
+        """
+        Applies changes recorded since the last refresh, reloads the index
+        if not loaded or reload_interval seconds have passed.
+        """
+        if not self._loaded or \
+                time.monotonic() - self._loaded_time > self.reload_interval:
+            self.load()
+            return
+
+        with self._refresh_lock:
+            changes = db.session.query(
+                SuggestionChange.id,
+                SuggestionChange.kind,
+                SuggestionChange.item_id,
+                SuggestionChange.label).filter(
+                SuggestionChange.id > self._last_change_id).order_by(
+                SuggestionChange.id).all()
+
+            with self._lock:
+                for change_id, kind, item_id, label in changes:
+                    self._remove(kind, item_id)
+                    if label is not None:
+                        self._add(kind, item_id, label)
+                    self._last_change_id = change_id
+
+    def start(self, app):
+        """
+        Starts thread refreshing the index every refresh_interval seconds in
+        the current process, if not already running.
+
+        Args:
+          app: Flask app object.
+        """
+        if self.refresh_interval <= 0:
+            return
+
+        with self._lock:
+            if self._pid == os.getpid() and self._refresh_thread.is_alive():
+                return
+
+            self._pid = os.getpid()
+            self._refresh_thread = threading.Thread(
+                target=self._refresh_periodically,
+                args=(app,),
+                name="suggestion-index-refresh",
+                daemon=True)
+            self._refresh_thread.start()
+
+    def _refresh_periodically(self, app):
+        while True:
+            time.sleep(self.refresh_interval)
+            with app.app_context():
+                try:
+                    self.refresh()
+                except Exception as e:
+                    db.session.rollback()
+                    print("An error occured while refreshing suggestions: "
+                          "{}".format(e))
+                finally:
+                    db.session.remove()
+
+    def suggest(self, kind, prefix, limit):
+        """
+        Gets items of a kind with a word starting with prefix.
+
+        Args:
+          kind: Kind of suggestion i.e image, tag or user.
+          prefix: Search value.
+          limit: Max number of suggestions.
+
+        Returns:
+          List of tuples of item id and label, in order of matched words.
+        """
+        prefix = prefix.casefold().lstrip()
+        if not prefix:
+            return []
+
+        suggestions = []
+        with self._lock:
+            keys = self._keys.get(kind, [])
+            index = bisect.bisect_left(keys, (prefix,))
+            item_ids = set()
+            while index < len(keys) and len(suggestions) < limit:
+                key, item_id = keys[index]
+                if not key.startswith(prefix):
+                    break
+                if item_id not in item_ids:
+                    item_ids.add(item_id)
+                    suggestions.append(
+                        (item_id, self._labels[(kind, item_id)]))
+                index += 1
+        return suggestions
+
+
+def _record_change(kind, connection, target, deleted=False):
+    _, id_attr, label_attr = suggestion_models[kind]
+    connection.execute(
+        SuggestionChange.__table__.insert().values(
+            kind=kind,
+            item_id=str(getattr(target, id_attr)),
+            label=None if deleted else getattr(target, label_attr)))
+
+
+def register_suggestions(model, kind, id_attr, label_attr):
+    """
+    Adds model's labels to suggestions, changes are recorded in the same
+    transaction as the model's.
+
+    Args:
+      model: Model being suggested.
+      kind: Kind of suggestion.
+      id_attr: Name of attribute identifying items in suggestions.
+      label_attr: Name of attribute being suggested.
+    """
+    suggestion_models[kind] = (model, id_attr, label_attr)
+
+    @event.listens_for(model, "after_insert")
+    def record_insert(mapper, connection, target):
+        _record_change(kind, connection, target)
+
+    @event.listens_for(model, "after_update")
+    def record_update(mapper, connection, target):
+        if sa.inspect(target).attrs[label_attr].history.has_changes():
+            _record_change(kind, connection, target)
+
+    @event.listens_for(model, "after_delete")
+    def record_delete(mapper, connection, target):
+        _record_change(kind, connection, target, deleted=True)
+
+
+def get_suggestion_index(app=None):
+    """
+    Gets suggestion index of the app, loaded on first use.
+
+    Args:
+      app: Flask app object, current app if None.
+
+    Returns:
+      SuggestionIndex object.
+    """
+    app = app or current_app._get_current_object()
+    suggestion_index = app.extensions.get("suggestion_index")
+    if suggestion_index is None:
+        suggestion_index = app.extensions.setdefault(
+            "suggestion_index",
+            SuggestionIndex(
+                refresh_interval=float(
+                    app.config.get("SUGGEST_REFRESH_INTERVAL") or 0),
+                reload_interval=float(
+                    app.config.get("SUGGEST_RELOAD_INTERVAL") or 3600)))
+
+    if suggestion_index.refresh_interval <= 0 or \
+            not suggestion_index.loaded:
+        suggestion_index.refresh()
+    suggestion_index.start(app)
+    return suggestion_index
+
+
+def load_suggestion_index(app):
+    """
+    Loads suggestion index of a worker before it handles requests.
+
+    Args:
+      app: Flask app object.
+    """
+    with app.app_context():
+        try:
+            get_suggestion_index(app)
+        except Exception as e:
+            # Loaded by the first lookup instead.
+            db.session.rollback()
+            print("An error occured while loading suggestions: {}".format(e))
+        finally:
+            db.session.remove()
@@ -0,0 +1,105 @@
+"""
+Compares file size and encode time of thumbnails and renditions in each
+format derivatives can be stored in.
+
+Usage:
+    python -m benchmarks.derivative_formats [--repeat N]
+
+Runs over the images in tests/assets and a synthetic photo-like image,
+formats not supported by the installed Pillow are skipped.
+"""
+import argparse
+import glob
+import io
+import os
+import time
+
+from PIL import Image, ImageOps, features
+
+from apps.imager.derivatives import (
+    DERIVATIVE_FORMATS,
+    THUMBNAIL_SIZE,
+    load_reduced_image)
+
+ASSETS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "tests",
+    "assets")
+
+# Original formats are saved with Pillow's default options.
+FORMATS = {"jpeg": {}, "png": {}}
+FORMATS.update(DERIVATIVE_FORMATS)
+
+RENDITION_SIZE = (1024, 1024)
+
+
+def create_synthetic_image(size=(3000, 2000)):
+    gradient = Image.linear_gradient("L").resize(size)
+    image = Image.merge("RGB", (
+        gradient,
+        gradient.transpose(Image.Transpose.ROTATE_90).resize(size),
+        Image.effect_noise(size, 32)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    buffer.seek(0)
+    return buffer
+
+
+def derivatives(image_file):
+    with Image.open(image_file) as original_image:
+        original_image.load()
+        thumbnail_image = ImageOps.fit(
+            image=load_reduced_image(original_image, THUMBNAIL_SIZE, True),
+            size=THUMBNAIL_SIZE,
+            method=3)
+    with Image.open(image_file) as original_image:
+        rendition_image = ImageOps.contain(
+            image=load_reduced_image(original_image, RENDITION_SIZE, False),
+            size=RENDITION_SIZE,
+            method=Image.LANCZOS)
+    return {
+        "thumbnail": thumbnail_image.convert("RGB"),
+        "1024": rendition_image.convert("RGB")}
+
+
+def measure(image, image_format, options, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format, **options)
+    elapsed = (time.perf_counter() - start) / repeat
+    return buffer.tell(), elapsed * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    images = {
+        os.path.basename(image_path): image_path
+        for image_path in sorted(
+            glob.glob(os.path.join(ASSETS_DIR, "*.jpg")) +
+            glob.glob(os.path.join(ASSETS_DIR, "*.png")))}
+    images["synthetic_3000x2000.jpg"] = create_synthetic_image()
+
+    print("{:<26} {:<10} {:<6} {:>10} {:>10}".format(
+        "image", "kind", "format", "bytes", "encode ms"))
+    for name, image_file in images.items():
+        for kind, image in derivatives(image_file).items():
+            for image_format, options in FORMATS.items():
+                if image_format in DERIVATIVE_FORMATS and \
+                        not features.check(image_format):
+                    continue
+
+                size, elapsed = measure(
+                    image,
+                    image_format,
+                    options,
+                    args.repeat)
+                print("{:<26} {:<10} {:<6} {:>10} {:>10.1f}".format(
+                    name, kind, image_format, size, elapsed))
+
+
+if __name__ == "__main__":
+    main()
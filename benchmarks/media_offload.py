@@ -0,0 +1,108 @@
+"""
+Compares requests/sec of a worker serving an uploaded image itself and
+handing the transfer to the front proxy with X-Sendfile/X-Accel-Redirect.
+
+Usage:
+    python -m benchmarks.media_offload [--size-mb N] [--requests N]
+
+Requests go through the Flask test client, so the numbers are the time a
+worker is busy per request. Offloaded responses only carry headers, the
+proxy then sends the file without holding a worker.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+import sqlalchemy as sa
+
+from apps import create_app, db
+from apps.auth.models import Role, User
+from apps.imager.models import UserContent, ImageContent
+
+
+def seed(upload_path, size_mb):
+    db.drop_all()
+    db.create_all()
+
+    content_location = str(uuid.uuid4())
+    file_id = str(uuid.uuid4())
+
+    db.session.execute(sa.insert(Role.__table__), [{"id": 1, "name": "user"}])
+    db.session.execute(sa.insert(User.__table__), [{
+        "id": 1,
+        "username": "user_1",
+        "first_name": "First",
+        "last_name": "Last",
+        "email": "user_1@example.com",
+        "password_hash": "-",
+        "user_role": 1,
+        "email_confirmed": True,
+        "active": True}])
+    db.session.execute(sa.insert(UserContent.__table__), [
+        {"id": 1, "user_id": 1, "content_location": content_location}])
+    db.session.execute(sa.insert(ImageContent.__table__), [{
+        "user_content_id": 1,
+        "file_id": file_id,
+        "file_location": "-",
+        "file_extension": "jpg",
+        "title": "large"}])
+    db.session.commit()
+
+    # Only the bytes matter, the file isn't decoded when served.
+    os.makedirs(os.path.join(upload_path, content_location))
+    with open(os.path.join(
+            upload_path,
+            content_location,
+            file_id + ".jpg"), "wb") as image_file:
+        image_file.write(os.urandom(size_mb * 1024 * 1024))
+    return file_id
+
+
+def run(app, label, file_id, requests):
+    client = app.test_client()
+
+    start = time.perf_counter()
+    sent = 0
+    for _ in range(requests):
+        response = client.get("/upload/image/{}".format(file_id))
+        sent += len(response.get_data())
+        response.close()
+    elapsed = time.perf_counter() - start
+
+    print("{:<18} {:>10.0f} req/sec {:>10.1f} MiB sent by worker".format(
+        label,
+        requests / elapsed,
+        sent / 1024 / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--size-mb", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    upload_path = os.path.join(temp_dir, "user_uploads")
+
+    app = create_app("config.TestingConfig")
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(
+        temp_dir,
+        "media_offload.db")
+    app.config["UPLOAD_PATH"] = upload_path
+
+    try:
+        with app.app_context():
+            file_id = seed(upload_path, args.size_mb)
+
+        for sendfile in [None, "x-sendfile", "x-accel-redirect"]:
+            app.config["MEDIA_SENDFILE"] = sendfile
+            run(app, sendfile or "send_file", file_id, args.requests)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Compares requests/sec of anonymous gallery pages without the page cache and
+with its memory and sqlite backends.
+
+Usage:
+    python -m benchmarks.page_cache [--images N] [--requests N]
+
+Requests go through the Flask test client against a SQLite db, cycling
+through the first pages of each sort order.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+import sqlalchemy as sa
+
+from apps import create_app, db
+from apps.auth.models import Role, User
+from apps.cache import create_page_cache
+from apps.imager.models import UserContent, ImageContent
+
+PAGES = [
+    "/?page={}",
+    "/upload_time/desc?page={}",
+    "/score/desc?page={}",
+]
+
+
+def seed(images):
+    db.drop_all()
+    db.create_all()
+
+    db.session.execute(sa.insert(Role.__table__), [{"id": 1, "name": "user"}])
+    db.session.execute(sa.insert(User.__table__), [{
+        "id": 1,
+        "username": "user_1",
+        "first_name": "First",
+        "last_name": "Last",
+        "email": "user_1@example.com",
+        "password_hash": "-",
+        "user_role": 1,
+        "email_confirmed": True,
+        "active": True}])
+    db.session.execute(sa.insert(UserContent.__table__), [
+        {"id": 1, "user_id": 1, "content_location": "-"}])
+    db.session.execute(sa.insert(ImageContent.__table__), [{
+        "user_content_id": 1,
+        "file_id": str(uuid.uuid4()),
+        "file_location": "-",
+        "title": "image_{}".format(index),
+        "score": index % 50}
+        for index in range(images)])
+    db.session.commit()
+
+
+def run(app, label, requests):
+    client = app.test_client()
+    urls = [url.format(page) for page in range(1, 4) for url in PAGES]
+
+    start = time.perf_counter()
+    for index in range(requests):
+        client.get(urls[index % len(urls)])
+    elapsed = time.perf_counter() - start
+
+    stats = app.extensions["page_cache"].stats()
+    print("{:<10} {:>10.0f} req/sec   hit ratio {}".format(
+        label,
+        requests / elapsed,
+        "-" if stats["hit_ratio"] is None else
+        "{:.2f}".format(stats["hit_ratio"])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--images", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    app = create_app("config.TestingConfig")
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(
+        temp_dir,
+        "page_cache.db")
+
+    try:
+        with app.app_context():
+            seed(args.images)
+
+        for label, backend, ttl in [
+                ("uncached", "memory", 0),
+                ("memory", "memory", 30),
+                ("sqlite", "sqlite", 30)]:
+            app.extensions["page_cache"] = create_page_cache(
+                backend,
+                ttl=ttl,
+                maxsize=256,
+                path=os.path.join(temp_dir, "page_cache.sqlite3"))
+            run(app, label, args.requests)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Shows query plans and timings of the hot query paths before and after the
+indexes added in migration c4f8a2e61b93, on a seeded dataset.
+
+Usage:
+    python -m benchmarks.query_plans [--database-url URL] [--users N]
+        [--images N] [--votes N] [--repeat N]
+
+Defaults to a throw away SQLite database, pass a PostgreSQL url to compare
+plans on the production database engine. All tables are dropped and
+recreated in the given database.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+
+from apps import db
+from apps.auth.models import Role, User, Permissions
+from apps.imager.models import (
+    VoteCounter,
+    UserContent,
+    ImageContent,
+    Tags,
+    ImageTags)
+
+
+# Indexes and constraints added for the hot query paths.
+HOT_PATH_INDEXES = (
+    "ix_vote_counter_image_file_id",
+    "ix_user_content_user_id",
+    "ix_image_content_user_content_id",
+    "ix_image_content_upload_time",
+    "ix_image_tags_tag_id_image_content_id",
+    "ix_permissions_role_id_permission",
+)
+HOT_PATH_CONSTRAINTS = (
+    "uq_vote_counter_user_id_image_file_id",
+)
+
+HOT_QUERIES = {
+    "personal votes (gallery page)": (
+        "SELECT image_file_id, vote FROM vote_counter "
+        "WHERE user_id = :user_id AND image_file_id IN (:file_a, :file_b)"),
+    "votes of an image": (
+        "SELECT vote FROM vote_counter WHERE image_file_id = :file_a"),
+    "user gallery (upload time)": (
+        "SELECT image_content.id FROM image_content "
+        "WHERE user_content_id = :user_content_id "
+        "ORDER BY upload_time DESC, id DESC LIMIT 21"),
+    "home page (upload time)": (
+        "SELECT id FROM image_content "
+        "ORDER BY upload_time DESC, id DESC LIMIT 21"),
+    "user content of a user": (
+        "SELECT id FROM user_content WHERE user_id = :user_id"),
+    "images by tag": (
+        "SELECT image_content_id FROM image_tags WHERE tag_id = :tag_id"),
+    "permission check": (
+        "SELECT id FROM permissions "
+        "WHERE role_id = :role_id AND permission = :permission"),
+}
+
+
+def detach_hot_path_indexes():
+    """
+    Removes hot path indexes and constraints from the model metadata so the
+    tables can be created as they were before the migration.
+    """
+    detached = []
+    for table in db.metadata.sorted_tables:
+        for index in list(table.indexes):
+            if index.name in HOT_PATH_INDEXES:
+                table.indexes.discard(index)
+                detached.append(index)
+
+        for constraint in list(table.constraints):
+            if constraint.name in HOT_PATH_CONSTRAINTS:
+                table.constraints.discard(constraint)
+                # Unique index equivalent, can be created on existing tables
+                # in every database engine.
+                detached.append(sa.Index(
+                    constraint.name,
+                    *constraint.columns,
+                    unique=True,
+                    _table=table))
+                table.indexes.discard(detached[-1])
+    return detached
+
+
+def seed(connection, users, images, votes):
+    random.seed(0)
+    now = datetime.now()
+
+    connection.execute(sa.insert(Role.__table__), [
+        {"id": 1, "name": "admin"},
+        {"id": 2, "name": "user"}])
+    connection.execute(sa.insert(Permissions.__table__), [
+        {"role_id": role_id, "permission": permission}
+        for role_id in (1, 2)
+        for permission in range(1, 7)])
+
+    connection.execute(sa.insert(User.__table__), [
+        {
+            "id": user_id,
+            "username": "user_{}".format(user_id),
+            "first_name": "First",
+            "last_name": "Last",
+            "email": "user_{}@example.com".format(user_id),
+            "password_hash": "-",
+            "user_role": 2,
+            "email_confirmed": True,
+            "active": True}
+        for user_id in range(1, users + 1)])
+    connection.execute(sa.insert(UserContent.__table__), [
+        {
+            "id": user_id,
+            "user_id": user_id,
+            "content_location": str(uuid.uuid4())}
+        for user_id in range(1, users + 1)])
+
+    file_ids = [str(uuid.uuid4()) for _ in range(images)]
+    connection.execute(sa.insert(ImageContent.__table__), [
+        {
+            "id": image_id,
+            "user_content_id": random.randint(1, users),
+            "file_id": file_id,
+            "file_location": "-",
+            "title": "image_{}".format(image_id),
+            "upload_time": now - timedelta(minutes=image_id)}
+        for image_id, file_id in enumerate(file_ids, 1)])
+
+    connection.execute(sa.insert(Tags.__table__), [
+        {"id": tag_id, "tag_name": "tag_{}".format(tag_id)}
+        for tag_id in range(1, 51)])
+    connection.execute(sa.insert(ImageTags.__table__), [
+        {"tag_id": random.randint(1, 50), "image_content_id": image_id}
+        for image_id in range(1, images + 1)])
+
+    voted = set()
+    while len(voted) < min(votes, users * images):
+        voted.add((random.randint(1, users), random.choice(file_ids)))
+    connection.execute(sa.insert(VoteCounter.__table__), [
+        {
+            "user_id": user_id,
+            "image_file_id": file_id,
+            "vote": random.choice((1, -1))}
+        for user_id, file_id in voted])
+    return file_ids
+
+
+def query_params(users, file_ids):
+    return {
+        "user_id": random.randint(1, users),
+        "user_content_id": random.randint(1, users),
+        "file_a": random.choice(file_ids),
+        "file_b": random.choice(file_ids),
+        "tag_id": random.randint(1, 50),
+        "role_id": 2,
+        "permission": random.randint(1, 6)}
+
+
+def report(connection, label, users, file_ids, repeat):
+    explain = "EXPLAIN QUERY PLAN " \
+        if connection.dialect.name == "sqlite" else "EXPLAIN "
+    print("=" * 72)
+    print(label)
+    print("=" * 72)
+    for name, query in HOT_QUERIES.items():
+        params = query_params(users, file_ids)
+        plan = connection.execute(sa.text(explain + query), params).fetchall()
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            connection.execute(
+                sa.text(query),
+                query_params(users, file_ids)).fetchall()
+        elapsed = (time.perf_counter() - start) / repeat * 1000
+
+        print("\n{} ({:.3f} ms/query)".format(name, elapsed))
+        for row in plan:
+            print("    {}".format(row[-1]))
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--images", type=int, default=20000)
+    parser.add_argument("--votes", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    database_url = args.database_url
+    if database_url is None:
+        database_file = os.path.join(
+            tempfile.mkdtemp(), "query_plans.db")
+        database_url = "sqlite:///" + database_file
+
+    engine = sa.create_engine(database_url)
+    detached = detach_hot_path_indexes()
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+
+    with engine.begin() as connection:
+        file_ids = seed(connection, args.users, args.images, args.votes)
+        connection.execute(sa.text("ANALYZE"))
+
+    with engine.connect() as connection:
+        report(
+            connection,
+            "Before hot path indexes",
+            args.users,
+            file_ids,
+            args.repeat)
+
+    with engine.begin() as connection:
+        for index in detached:
+            index.create(connection)
+        connection.execute(sa.text("ANALYZE"))
+
+    with engine.connect() as connection:
+        report(
+            connection,
+            "After hot path indexes",
+            args.users,
+            file_ids,
+            args.repeat)
+
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Compares time per search dropdown lookup of the in-memory suggestion index
+with the db full-text search it replaces.
+
+Usage:
+    python -m benchmarks.suggest [--images N] [--lookups N]
+
+Uses a SQLite db with FTS5, PostgreSQL queries also pay a network round
+trip per search.
+"""
+import argparse
+import os
+import random
+import shutil
+import string
+import tempfile
+import time
+import uuid
+
+import sqlalchemy as sa
+
+from apps import create_app, db
+from apps.auth.models import Role, User
+from apps.auth.controllers import search_by_username
+from apps.imager.models import UserContent, ImageContent
+from apps.imager.controllers import search_by_title, search_by_tags
+from apps.suggest import get_suggestion_index
+
+WORDS = [
+    "".join(random.choices(string.ascii_lowercase, k=random.randint(3, 9)))
+    for _ in range(2000)]
+
+
+def seed(images):
+    db.drop_all()
+    db.create_all()
+
+    db.session.execute(sa.insert(Role.__table__), [{"id": 1, "name": "user"}])
+    db.session.execute(sa.insert(User.__table__), [{
+        "id": 1,
+        "username": "user_1",
+        "first_name": "First",
+        "last_name": "Last",
+        "email": "user_1@example.com",
+        "password_hash": "-",
+        "user_role": 1,
+        "email_confirmed": True,
+        "active": True}])
+    db.session.execute(sa.insert(UserContent.__table__), [
+        {"id": 1, "user_id": 1, "content_location": "-"}])
+    db.session.execute(sa.insert(ImageContent.__table__), [{
+        "user_content_id": 1,
+        "file_id": str(uuid.uuid4()),
+        "file_location": "-",
+        "title": " ".join(random.choices(WORDS, k=2))[:20]}
+        for _ in range(images)])
+    db.session.commit()
+
+
+def run(label, lookup, prefixes):
+    start = time.perf_counter()
+    for prefix in prefixes:
+        lookup(prefix)
+    elapsed = time.perf_counter() - start
+    print("{:<12} {:>10.1f} us/lookup".format(
+        label,
+        elapsed / len(prefixes) * 1000000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--images", type=int, default=50000)
+    parser.add_argument("--lookups", type=int, default=1000)
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    app = create_app("config.TestingConfig")
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(
+        temp_dir,
+        "suggest.db")
+    app.config["SUGGEST_REFRESH_INTERVAL"] = 3600
+    limit = app.config["SEARCH_RESULT_LIMIT"]
+
+    # Prefixes typed a key at a time.
+    prefixes = [
+        word[:length]
+        for word in random.choices(WORDS, k=args.lookups)
+        for length in range(1, 4)]
+
+    try:
+        with app.app_context():
+            seed(args.images)
+            suggestion_index = get_suggestion_index()
+
+            def suggest(prefix):
+                for kind in ["user", "image", "tag"]:
+                    suggestion_index.suggest(kind, prefix, limit)
+
+            def search(prefix):
+                search_by_username(prefix, limit)
+                search_by_title(prefix, limit=limit)
+                search_by_tags(prefix, limit)
+
+            run("suggest", suggest, prefixes)
+            run("db search", search, prefixes)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Compares time and peak RSS per thumbnail of decoding the full resolution
+image before ImageOps.fit with draft mode/reduce decoding.
+
+Usage:
+    python -m benchmarks.thumbnail_decode [--repeat N]
+
+Runs over the images in tests/assets and synthetic large JPEG and PNG
+images. Each measurement runs in a fresh process so peak RSS isn't shared
+between them.
+"""
+import argparse
+import glob
+import os
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from PIL import Image, ImageOps
+
+from apps.imager.derivatives import THUMBNAIL_SIZE, generate_thumbnail
+
+ASSETS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "tests",
+    "assets")
+
+SYNTHETIC_IMAGES = {
+    "synthetic_4000x3000.jpg": (4000, 3000),
+    "synthetic_6000x4000.jpg": (6000, 4000),
+    "synthetic_4000x3000.png": (4000, 3000),
+}
+
+
+def full_decode_thumbnail(image_path, thumbnail_path, size=THUMBNAIL_SIZE):
+    # Thumbnail path before draft mode decoding.
+    with Image.open(image_path) as original_image:
+        thumbnail_image = ImageOps.fit(
+            image=original_image,
+            size=size,
+            method=3,
+            bleed=0.0,
+            centering=(0.5, 0.5))
+        thumbnail_image.save(thumbnail_path)
+
+
+THUMBNAIL_FUNCTIONS = {
+    "full decode": full_decode_thumbnail,
+    "draft/reduce": generate_thumbnail,
+}
+
+
+def create_synthetic_images(directory):
+    image_paths = []
+    for filename, size in SYNTHETIC_IMAGES.items():
+        image_path = os.path.join(directory, filename)
+        # Gradient so images don't compress to nothing.
+        gradient = Image.linear_gradient("L").resize(size)
+        image = Image.merge("RGB", (
+            gradient,
+            gradient.transpose(Image.Transpose.ROTATE_90).resize(size),
+            Image.effect_noise(size, 64)))
+        image.save(image_path)
+        image_paths.append(image_path)
+    return image_paths
+
+
+def peak_rss():
+    """
+    Gets peak RSS of the process in MiB, uses VmHWM on Linux as ru_maxrss
+    keeps the peak of the parent process across exec.
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KiB on Linux and bytes on macOS.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(function_name, image_path, repeat):
+    thumbnail = THUMBNAIL_FUNCTIONS[function_name]
+    output_dir = tempfile.mkdtemp()
+    thumbnail_path = os.path.join(output_dir, os.path.basename(image_path))
+
+    baseline_rss = peak_rss()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        thumbnail(image_path, thumbnail_path)
+    elapsed = (time.perf_counter() - start) / repeat
+    thumbnail_rss = peak_rss() - baseline_rss
+
+    shutil.rmtree(output_dir)
+    return elapsed * 1000, thumbnail_rss
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    synthetic_dir = tempfile.mkdtemp()
+    image_paths = sorted(
+        glob.glob(os.path.join(ASSETS_DIR, "*.jpg")) +
+        glob.glob(os.path.join(ASSETS_DIR, "*.png")))
+    image_paths += create_synthetic_images(synthetic_dir)
+
+    print("{:<28} {:<14} {:>12} {:>16}".format(
+        "image", "path", "ms/thumbnail", "peak RSS (MiB)"))
+    try:
+        for image_path in image_paths:
+            for function_name in THUMBNAIL_FUNCTIONS:
+                with ProcessPoolExecutor(
+                        max_workers=1,
+                        mp_context=get_context("spawn")) as executor:
+                    elapsed, thumbnail_rss = executor.submit(
+                        measure,
+                        function_name,
+                        image_path,
+                        args.repeat).result()
+                print("{:<28} {:<14} {:>12.1f} {:>16.1f}".format(
+                    os.path.basename(image_path),
+                    function_name,
+                    elapsed,
+                    thumbnail_rss))
+    finally:
+        shutil.rmtree(synthetic_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Compares time and peak Python memory of parsing an uploaded file and
+saving it with the default Werkzeug request (spooled to the system temp
+directory then copied with FileStorage.save) and with IngestRequest
+(streamed to UPLOAD_PATH, hashed while written, then renamed into place).
+
+Usage:
+    python -m benchmarks.upload_ingest [--sizes-mb 1,10,100]
+
+The multipart body is read from a file on disk so the request body itself
+isn't held in memory.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from flask import Request, request
+
+from apps import create_app
+from apps.imager.ingest import IngestRequest, ingest_upload
+from apps.imager.metadata import hash_file
+
+BOUNDARY = "benchmarkboundary"
+
+
+def create_body(directory, size_mb):
+    body_path = os.path.join(directory, "body_{}.bin".format(size_mb))
+    with open(body_path, "wb") as body:
+        body.write((
+            "--{0}\r\n"
+            "Content-Disposition: form-data; name=\"file\"; "
+            "filename=\"upload.jpg\"\r\n"
+            "Content-Type: image/jpeg\r\n\r\n").format(BOUNDARY).encode())
+        body.write(b"\xff\xd8\xff\xe0")
+        for _ in range(size_mb):
+            body.write(os.urandom(1024 * 1024))
+        body.write("\r\n--{0}--\r\n".format(BOUNDARY).encode())
+    return body_path
+
+
+def default_save(file, file_path):
+    # Upload path before streaming ingestion.
+    file.save(file_path)
+    return hash_file(file_path)
+
+
+def ingest_save(file, file_path):
+    ingest_file = ingest_upload(file, os.path.dirname(file_path))
+    ingest_file.save(file_path)
+    return ingest_file.hexdigest()
+
+
+def measure(app, request_class, save, body_path, output_path):
+    app.request_class = request_class
+    with open(body_path, "rb") as body:
+        with app.test_request_context(
+                "/upload",
+                method="POST",
+                input_stream=body,
+                content_length=os.path.getsize(body_path),
+                content_type="multipart/form-data; boundary=" + BOUNDARY):
+            tracemalloc.start()
+            start = time.perf_counter()
+            save(request.files["file"], output_path)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    os.remove(output_path)
+    return elapsed * 1000, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--sizes-mb", default="1,10,100")
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    app = create_app("config.TestingConfig")
+    app.config["UPLOAD_PATH"] = os.path.join(temp_dir, "user_uploads")
+    app.config["MAX_CONTENT_LENGTH"] = None
+    os.makedirs(app.config["UPLOAD_PATH"])
+    output_path = os.path.join(app.config["UPLOAD_PATH"], "upload.jpg")
+
+    paths = {
+        "FileStorage.save": (Request, default_save),
+        "IngestRequest": (IngestRequest, ingest_save),
+    }
+
+    print("{:<10} {:<18} {:>10} {:>16}".format(
+        "size (MiB)", "path", "ms", "peak alloc (MiB)"))
+    try:
+        for size_mb in [int(size) for size in args.sizes_mb.split(",")]:
+            body_path = create_body(temp_dir, size_mb)
+            for label, (request_class, save) in paths.items():
+                elapsed, peak = measure(
+                    app,
+                    request_class,
+                    save,
+                    body_path,
+                    output_path)
+                print("{:<10} {:<18} {:>10.1f} {:>16.2f}".format(
+                    size_mb, label, elapsed, peak))
+            os.remove(body_path)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == "__main__":
+    main()
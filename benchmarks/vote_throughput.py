@@ -0,0 +1,135 @@
+"""
+Compares votes/sec on a single viral image with synchronous votes and with
+the vote write-behind buffer.
+
+Usage:
+    python -m benchmarks.vote_throughput [--database-url URL] [--users N]
+        [--threads N]
+
+Defaults to a throw away SQLite database, pass a PostgreSQL url to compare
+on the production database engine. All tables are dropped and recreated in
+the given database.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+import sqlalchemy as sa
+
+from apps import create_app, db
+from apps.auth.models import Role, User
+from apps.imager import controllers
+from apps.imager.models import (
+    VoteEnum,
+    UserContent,
+    ImageContent)
+from apps.imager.vote_buffer import vote_buffer
+
+
+def seed(users):
+    db.drop_all()
+    db.create_all()
+
+    db.session.execute(sa.insert(Role.__table__), [{"id": 1, "name": "user"}])
+    db.session.execute(sa.insert(User.__table__), [
+        {
+            "id": user_id,
+            "username": "user_{}".format(user_id),
+            "first_name": "First",
+            "last_name": "Last",
+            "email": "user_{}@example.com".format(user_id),
+            "password_hash": "-",
+            "user_role": 1,
+            "email_confirmed": True,
+            "active": True}
+        for user_id in range(1, users + 1)])
+    db.session.execute(sa.insert(UserContent.__table__), [
+        {"id": 1, "user_id": 1, "content_location": str(uuid.uuid4())}])
+
+    file_id = str(uuid.uuid4())
+    db.session.execute(sa.insert(ImageContent.__table__), [
+        {
+            "user_content_id": 1,
+            "file_id": file_id,
+            "file_location": "-",
+            "title": "viral"}])
+    db.session.commit()
+    return file_id
+
+
+def cast_votes(app, user_ids, file_id, errors):
+    with app.app_context():
+        for user_id in user_ids:
+            user = User.query.get(user_id)
+            metric_data = controllers.vote_image(
+                user,
+                file_id,
+                VoteEnum.UPVOTE.value)
+            if metric_data is None:
+                errors.append(user_id)
+
+
+def run(app, label, users, threads):
+    with app.app_context():
+        file_id = seed(users)
+
+    errors = []
+    workers = [
+        threading.Thread(
+            target=cast_votes,
+            args=(app, range(index + 1, users + 1, threads), file_id, errors))
+        for index in range(threads)]
+
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    voted = time.perf_counter() - start
+
+    with app.app_context():
+        vote_buffer.flush()
+        flushed = time.perf_counter() - start
+        image_content = ImageContent.query.filter_by(file_id=file_id).one()
+        score = image_content.score
+
+    print("{}: {:.0f} votes/sec ({:.0f} votes/sec including flush), "
+          "score {} of {}, {} failed votes".format(
+              label,
+              users / voted,
+              users / flushed,
+              score,
+              users,
+              len(errors)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    database_url = args.database_url
+    if database_url is None:
+        database_file = os.path.join(
+            tempfile.mkdtemp(), "vote_throughput.db")
+        database_url = "sqlite:///" + database_file
+
+    app = create_app("config.TestingConfig")
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+
+    app.config["VOTE_WRITE_BEHIND"] = False
+    run(app, "Synchronous", args.users, args.threads)
+
+    # Flushed once at the end to measure the buffer alone.
+    app.config["VOTE_WRITE_BEHIND"] = True
+    app.config["VOTE_FLUSH_INTERVAL"] = 0
+    run(app, "Write-behind", args.users, args.threads)
+
+
+if __name__ == "__main__":
+    main()
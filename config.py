@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
@@ -29,6 +30,89 @@ class Config:
             MEDIA_ROOT,
             "user_uploads")
 
+    # Hands transfers of uploaded files to the front proxy, either
+    # "x-accel-redirect" (nginx) or "x-sendfile" (apache, lighttpd). With
+    # nginx, MEDIA_ACCEL_PREFIX is an internal location aliased to
+    # UPLOAD_PATH. Files are sent by the app if unset.
+    MEDIA_SENDFILE = os.getenv("MEDIA_SENDFILE")
+    MEDIA_ACCEL_PREFIX = os.getenv("MEDIA_ACCEL_PREFIX") or "/protected-media/"
+
+    # Vote write-behind, buffers votes in each process and flushes them to
+    # the db every VOTE_FLUSH_INTERVAL seconds. Votes not yet flushed are
+    # lost if the process is killed.
+    VOTE_WRITE_BEHIND = os.getenv("VOTE_WRITE_BEHIND") == "True"
+    VOTE_FLUSH_INTERVAL = float(os.getenv("VOTE_FLUSH_INTERVAL") or 5)
+
+    # Generates thumbnails and renditions in the background with
+    # `flask imager process-derivatives` instead of during uploads.
+    THUMBNAIL_ASYNC = os.getenv("THUMBNAIL_ASYNC") == "True"
+    DERIVATIVE_MAX_ATTEMPTS = int(os.getenv("DERIVATIVE_MAX_ATTEMPTS") or 3)
+    DERIVATIVE_STALE_AFTER = int(os.getenv("DERIVATIVE_STALE_AFTER") or 600)
+
+    # Max width/height of resized copies of uploaded images served to
+    # smaller screens, in addition to the 240x240 thumbnail crop. Only
+    # created by default when derivatives are generated in the background,
+    # during uploads they add most of a second per image. The gallery page
+    # shows the original image without renditions.
+    IMAGE_RENDITIONS = [
+        int(size) for size in (
+            os.getenv("IMAGE_RENDITIONS") or
+            ("480,1024,2048" if THUMBNAIL_ASYNC else "")).split(",")
+        if size]
+
+    # Formats thumbnails and renditions are also stored in, served to
+    # browsers accepting them. Skipped if not supported by installed Pillow.
+    # Encoding them takes seconds per upload, so they're only stored by
+    # default when derivatives are generated in the background.
+    IMAGE_DERIVATIVE_FORMATS = [
+        image_format for image_format in (
+            os.getenv("IMAGE_DERIVATIVE_FORMATS") or
+            ("avif,webp" if THUMBNAIL_ASYNC else "")).split(",")
+        if image_format]
+
+    # Publishes thumbnails to PUBLIC_THUMBNAIL_PATH as
+    # <hash prefix>/<file_id>.<ext>, linked in pages under
+    # PUBLIC_THUMBNAIL_URL e.g "/media/t" or a CDN url, so they're served
+    # without the app. Thumbnails are served by the app if unset.
+    PUBLIC_THUMBNAIL_URL = os.getenv("PUBLIC_THUMBNAIL_URL")
+    PUBLIC_THUMBNAIL_PATH = os.getenv("PUBLIC_THUMBNAIL_PATH") or \
+        os.path.join(MEDIA_ROOT, "t")
+
+    # Max number of users, images and tags returned by each search.
+    SEARCH_RESULT_LIMIT = int(os.getenv("SEARCH_RESULT_LIMIT") or 10)
+    # Results past it aren't paginated or counted, deep pages of common
+    # words would scan most of the index.
+    SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS") or 1000)
+
+    # Seconds between each worker applying changes to its search suggestion
+    # index and between full reloads, 0 applies them on each lookup.
+    SUGGEST_REFRESH_INTERVAL = float(
+        os.getenv("SUGGEST_REFRESH_INTERVAL") or 2)
+    SUGGEST_RELOAD_INTERVAL = float(
+        os.getenv("SUGGEST_RELOAD_INTERVAL") or 3600)
+
+    # Seconds between each worker rebuilding its similar image index in the
+    # background, dropping deleted images. 0 never rebuilds it.
+    SIMILARITY_REBUILD_INTERVAL = float(
+        os.getenv("SIMILARITY_REBUILD_INTERVAL") or 300)
+
+    # Seconds gallery pages of anonymous users are cached, 0 disables it.
+    # The sqlite backend shares pages and invalidations between workers.
+    PAGE_CACHE_BACKEND = os.getenv("PAGE_CACHE_BACKEND") or "memory"
+    PAGE_CACHE_TTL = float(os.getenv("PAGE_CACHE_TTL") or 30)
+    PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE") or 256)
+    PAGE_CACHE_PATH = os.getenv("PAGE_CACHE_PATH") or \
+        os.path.join(tempfile.gettempdir(), "imager_page_cache.sqlite3")
+
+    # Seconds logged in users are cached between requests, 0 disables it.
+    # Users are cached by each worker. Changes are invalidated through the
+    # page cache's generation counters, shared between workers only with
+    # PAGE_CACHE_BACKEND=sqlite. Other workers otherwise keep serving the
+    # old role, permissions or active status for up to USER_CACHE_TTL
+    # seconds, hence disabled by default.
+    USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL") or 0)
+    USER_CACHE_SIZE = os.getenv("USER_CACHE_SIZE") or 1024
+
 
 class ProductionConfig(Config):
     DEBUG = False
@@ -89,3 +173,16 @@ class TestingConfig(Config):
     
     WTF_CSRF_ENABLED = False
     SQLALCHEMY_TRACK_MODIFICATIONS = True
+
+    # API configurations.
+    API_PER_PAGE = 20
+    API_MAX_PER_PAGE = 50
+
+    # Applies search suggestion changes on each lookup.
+    SUGGEST_REFRESH_INTERVAL = 0
+    SIMILARITY_REBUILD_INTERVAL = 0
+
+    IMAGE_RENDITIONS = [480, 1024, 2048]
+    IMAGE_DERIVATIVE_FORMATS = ["avif", "webp"]
+
+    USER_CACHE_TTL = 30
@@ -1,3 +1,9 @@
 # Gunicorn Settings.
 workers = 4
 bind = ["127.0.0.1:5000"]  # Can be changed to meet your needs.
+
+
+def post_worker_init(worker):
+    # Loads search suggestions before the worker handles requests.
+    from apps.suggest import load_suggestion_index
+    load_suggestion_index(worker.wsgi)
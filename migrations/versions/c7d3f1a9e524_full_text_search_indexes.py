@@ -0,0 +1,84 @@
+"""Full-text search indexes
+
+Revision ID: c7d3f1a9e524
+Revises: b5e1c9f3d702
+Create Date: 2026-10-18 19:12:47.305126
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d3f1a9e524'
+down_revision = 'b5e1c9f3d702'
+branch_labels = None
+depends_on = None
+
+# Table and searched columns, as in apps/search.py at this revision.
+search_indexes = [
+    ('image_content', ['title', 'description']),
+    ('tags', ['tag_name']),
+    ('user', ['username']),
+]
+
+
+def upgrade():
+    dialect_name = op.get_bind().dialect.name
+    for table_name, columns in search_indexes:
+        index_name = '{}_search'.format(table_name)
+        if dialect_name == 'postgresql':
+            op.execute(
+                'CREATE INDEX {} ON "{}" USING gin '
+                '(to_tsvector(\'simple\', {}))'.format(
+                    index_name,
+                    table_name,
+                    " || ' ' || ".join(
+                        "coalesce({}, '')".format(column)
+                        for column in columns)))
+
+        elif dialect_name == 'sqlite':
+            column_names = ', '.join(columns)
+            delete_old = (
+                "INSERT INTO {0}({0}, rowid, {1}) "
+                "VALUES ('delete', old.id, {2});").format(
+                    index_name,
+                    column_names,
+                    ', '.join('old.' + column for column in columns))
+            insert_new = (
+                "INSERT INTO {}(rowid, {}) VALUES (new.id, {});").format(
+                    index_name,
+                    column_names,
+                    ', '.join('new.' + column for column in columns))
+            op.execute(
+                "CREATE VIRTUAL TABLE {} USING fts5({}, content='{}', "
+                "content_rowid='id')".format(
+                    index_name,
+                    column_names,
+                    table_name))
+            op.execute(
+                'CREATE TRIGGER {0}_insert AFTER INSERT ON "{1}" '
+                'BEGIN {2} END'.format(index_name, table_name, insert_new))
+            op.execute(
+                'CREATE TRIGGER {0}_delete AFTER DELETE ON "{1}" '
+                'BEGIN {2} END'.format(index_name, table_name, delete_old))
+            op.execute(
+                'CREATE TRIGGER {0}_update AFTER UPDATE OF {1} ON "{2}" '
+                'BEGIN {3} {4} END'.format(
+                    index_name,
+                    column_names,
+                    table_name,
+                    delete_old,
+                    insert_new))
+            op.execute(
+                "INSERT INTO {0}({0}) VALUES ('rebuild')".format(index_name))
+
+
+def downgrade():
+    dialect_name = op.get_bind().dialect.name
+    for table_name, _ in search_indexes:
+        index_name = '{}_search'.format(table_name)
+        if dialect_name == 'postgresql':
+            op.execute('DROP INDEX IF EXISTS {}'.format(index_name))
+        elif dialect_name == 'sqlite':
+            op.execute('DROP TABLE IF EXISTS {}'.format(index_name))
@@ -265,6 +265,37 @@ class TestAdminPanel(unittest.TestCase):
             self.assertEqual(response.status_code, 200)
             self.assertEqual(user.role.name, auth.auth.DEFAULT_ADMIN_ROLE)
     
+    def test_edit_user_role_invalidates_cached_user(self):
+        with self.app.app_context():
+            user = auth.models.User.query.filter_by(
+                username=self.created_user_username).first()
+            admin_role = auth.models.Role.query.filter_by(
+                name=auth.auth.DEFAULT_ADMIN_ROLE).first()
+            user_cache = self.app.extensions["user_cache"]
+
+            auth.controllers.load_user(user.id)
+            self.assertIsNotNone(user_cache.get(user.id))
+
+            admin_panel.controllers.update_user_role(user, admin_role.id)
+            self.assertIsNone(user_cache.get(user.id))
+
+    def test_cache_stats(self):
+        with self.app.app_context():
+            self.client.post(
+                "/auth/login",
+                data={
+                    "username_email": self.created_admin_username,
+                    "password": self.created_admin_pwd,
+                    "next": ""},
+                follow_redirects=True)
+
+            response = self.client.get("/admin/cache/stats")
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("hits", response.json["user_cache"])
+            self.assertIn("misses", response.json["user_cache"])
+            self.assertIn("hit_ratio", response.json["page_cache"])
+            self.assertIn("hit_latency_ms", response.json["page_cache"])
+
     def test_edit_user_status_deactivate(self):
         with self.app.app_context():
             user = auth.models.User.query.filter_by(
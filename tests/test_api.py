@@ -10,6 +10,8 @@ from apps import create_app, db
 
 import apps.auth as auth
 import apps.api as api
+import apps.imager as imager
+from apps.suggest import SuggestionChange, get_suggestion_index
 
 
 class TestAPI(unittest.TestCase):
@@ -112,5 +114,205 @@ class TestAPI(unittest.TestCase):
             self.assertEqual(response.status_code, 200)
             self.assertTrue(re.search("Client Info", response.get_data(as_text=True)))
 
+    def test_load_gallery_cursor(self):
+        with self.app.app_context():
+            user = auth.models.User.query.filter_by(
+                username=self.created_user_username).one_or_none()
+            user_content = imager.models.UserContent(
+                user_id=user.id,
+                content_location="test_directory")
+            db.session.add(user_content)
+            db.session.commit()
+
+            for index in range(3):
+                db.session.add(imager.models.ImageContent(
+                    user_content_id=user_content.id,
+                    file_id="file_{}".format(index),
+                    title="img_{}".format(index)))
+            db.session.commit()
+            self.app.config["API_PER_PAGE"] = 2
+
+            response = self.client.get("/api/v1/gallery/score/desc?cursor=")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json["data"]), 2)
+            self.assertIsNotNone(response.json["next_cursor"])
+
+            response = self.client.get(
+                "/api/v1/gallery/user/{}/score/desc?cursor={}".format(
+                    self.created_user_username,
+                    response.json["next_cursor"]))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json["data"]), 1)
+            self.assertEqual(response.json["data"][0]["title"], "img_0")
+            self.assertIsNone(response.json["next_cursor"])
+
+            response = self.client.get(
+                "/api/v1/gallery/score/desc?cursor=not_a_cursor")
+            self.assertEqual(response.status_code, 400)
+
+    def test_load_similar_images(self):
+        with self.app.app_context():
+            user = auth.models.User.query.filter_by(
+                username=self.created_user_username).one_or_none()
+            user_content = imager.models.UserContent(
+                user_id=user.id,
+                content_location="test_directory")
+            db.session.add(user_content)
+            db.session.commit()
+
+            image_hashes = {
+                "original": "f0f0f0f0f0f0f0f0",
+                "reencoded": "f0f0f0f0f0f0f0f1",
+                "resized": "f0f0f0f0f0f0f0f3",
+                "different": "0f0f0f0f0f0f0f0f",
+                "unhashed": None}
+            for file_id, dhash in image_hashes.items():
+                db.session.add(imager.models.ImageContent(
+                    user_content_id=user_content.id,
+                    file_id=file_id,
+                    title=file_id,
+                    dhash=dhash))
+            db.session.commit()
+
+            response = self.client.get(
+                "/api/v1/gallery/image/original/similar")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                [(image["image_id"], image["distance"])
+                 for image in response.json["data"]],
+                [("reencoded", 1), ("resized", 2)])
+
+            response = self.client.get(
+                "/api/v1/gallery/image/original/similar?distance=1")
+            self.assertEqual(len(response.json["data"]), 1)
+
+            response = self.client.get(
+                "/api/v1/gallery/image/original/similar?distance=64")
+            self.assertEqual(response.status_code, 400)
+
+            response = self.client.get(
+                "/api/v1/gallery/image/unhashed/similar")
+            self.assertEqual(response.status_code, 409)
+
+            response = self.client.get(
+                "/api/v1/gallery/image/missing/similar")
+            self.assertEqual(response.status_code, 404)
+
+    def test_search_pagination(self):
+        with self.app.app_context():
+            user = auth.models.User.query.filter_by(
+                username=self.created_user_username).one_or_none()
+            user_content = imager.models.UserContent(
+                user_id=user.id,
+                content_location="test_directory")
+            db.session.add(user_content)
+            db.session.commit()
+
+            db.session.add_all([
+                imager.models.ImageContent(
+                    user_content_id=user_content.id,
+                    file_id="image_{}".format(index),
+                    title="Sunset {}".format(index))
+                for index in range(5)])
+            db.session.commit()
+
+            image_ids = []
+            cursor = ""
+            while cursor is not None:
+                response = self.client.get(
+                    "/api/v1/search/sun?limit=2&cursor=" + cursor)
+                self.assertEqual(response.status_code, 200)
+                self.assertLessEqual(
+                    len(response.json["results"]["image"]),
+                    2)
+                image_ids.extend(
+                    image["image_id"]
+                    for image in response.json["results"]["image"])
+                cursor = response.json["next_cursor"]
+            self.assertEqual(
+                sorted(image_ids),
+                ["image_{}".format(index) for index in range(5)])
+
+            response = self.client.get("/api/v1/search/sun?total=true")
+            self.assertEqual(len(response.json["results"]["image"]), 5)
+            self.assertNotIn("next_cursor", response.json)
+            self.assertEqual(
+                response.json["totals"],
+                {"users": 0, "image": 5, "tags": 0})
+
+            # Results past SEARCH_MAX_RESULTS aren't paginated or counted.
+            self.app.config["SEARCH_MAX_RESULTS"] = 3
+            response = self.client.get(
+                "/api/v1/search/sun?limit=2&cursor=&total=true")
+            self.assertEqual(response.json["totals"]["image"], 3)
+            response = self.client.get(
+                "/api/v1/search/sun?limit=2&cursor=" +
+                response.json["next_cursor"])
+            self.assertEqual(len(response.json["results"]["image"]), 1)
+            self.assertIsNone(response.json["next_cursor"])
+
+            response = self.client.get("/api/v1/search/sun?cursor=invalid")
+            self.assertEqual(response.status_code, 400)
+            response = self.client.get("/api/v1/search/sun?limit=0")
+            self.assertEqual(response.status_code, 400)
+
+    def test_suggest(self):
+        with self.app.app_context():
+            user = auth.models.User.query.filter_by(
+                username=self.created_user_username).one_or_none()
+            user_content = imager.models.UserContent(
+                user_id=user.id,
+                content_location="test_directory")
+            tag = imager.models.Tags(tag_name="sunsets")
+            db.session.add_all([user_content, tag])
+            db.session.commit()
+
+            image_contents = [
+                imager.models.ImageContent(
+                    user_content_id=user_content.id,
+                    file_id="image_{}".format(index),
+                    title=title)
+                for index, title in enumerate(
+                    ["Sunset Beach", "Beach Sunrise", "Mountains"])]
+            db.session.add_all(image_contents)
+            db.session.commit()
+
+            response = self.client.get("/api/v1/suggest/SUN")
+            self.assertEqual(response.status_code, 200)
+            results = response.json["results"]
+            self.assertEqual(
+                [image["image_id"] for image in results["image"]],
+                ["image_1", "image_0"])
+            self.assertEqual(
+                results["tags"],
+                [{"id": tag.id, "tag_name": "sunsets"}])
+            self.assertEqual(results["users"], [])
+
+            response = self.client.get("/api/v1/suggest/sunset b")
+            self.assertEqual(
+                [image["image_id"] for image in
+                 response.json["results"]["image"]],
+                ["image_0"])
+
+            # Changes are applied to the loaded index.
+            image_contents[1].title = "Beach"
+            db.session.delete(image_contents[0])
+            user.username = "sunny"
+            db.session.commit()
+
+            response = self.client.get("/api/v1/suggest/sun")
+            results = response.json["results"]
+            self.assertEqual(results["image"], [])
+            self.assertEqual(results["users"], [{"username": "sunny"}])
+
+            # Reloading prunes changes applied by the previous reload.
+            suggestion_index = get_suggestion_index()
+            suggestion_index.load()
+            suggestion_index.load()
+            self.assertEqual(SuggestionChange.query.count(), 0)
+            self.assertEqual(
+                suggestion_index.suggest("image", "bea", 10),
+                [("image_1", "Beach")])
+
 if __name__ == "__main__":
     unittest.main()
@@ -261,6 +261,84 @@ class TestAuth(unittest.TestCase):
             self.assertIsNotNone(user_permissions)
             self.assertGreater(len(user_permissions), 0)
     
+    def test_user_permissions(self):
+        with self.app.app_context():
+            user = auth.models.User.query.filter_by(
+                username=self.created_user_username).one_or_none()
+            self.assertEqual(
+                user.get_permissions(),
+                frozenset(auth.auth.GENERAL_USER_PERMISSIONS))
+
+            # Permission checks don't query the database.
+            statements = []
+
+            def count_statement(*args):
+                statements.append(args)
+
+            db.event.listen(db.engine, "before_cursor_execute", count_statement)
+            self.assertTrue(user.can_post_main_dashboard())
+            self.assertTrue(user.can_view_main_dashboard())
+            self.assertFalse(user.can_view_admin_dashboard())
+            self.assertFalse(user.can_update_admin_dashboard())
+            db.event.remove(db.engine, "before_cursor_execute", count_statement)
+            self.assertEqual(len(statements), 0)
+
+            # Role changes are picked up after commit.
+            role_permission = auth.models.Permissions(
+                role_id=user.user_role,
+                permission=auth.models.PermissionsEnum.CAN_VIEW_ADMIN.value)
+            db.session.add(role_permission)
+            db.session.commit()
+            self.assertTrue(user.can_view_admin_dashboard())
+
+    def test_load_user_cache(self):
+        with self.app.app_context():
+            user = auth.models.User.query.filter_by(
+                username=self.created_user_username).one_or_none()
+            user_id = user.id
+            user_cache = self.app.extensions["user_cache"]
+            db.session.remove()
+
+            loaded_user = auth.controllers.load_user(user_id)
+            self.assertEqual(user_cache.stats()["misses"], 1)
+            db.session.remove()
+
+            # Cached users are loaded without querying the database.
+            statements = []
+
+            def count_statement(*args):
+                statements.append(args)
+
+            db.event.listen(db.engine, "before_cursor_execute", count_statement)
+            loaded_user = auth.controllers.load_user(user_id)
+            self.assertEqual(loaded_user.username, self.created_user_username)
+            self.assertTrue(loaded_user.can_post_main_dashboard())
+            self.assertFalse(loaded_user.can_view_admin_dashboard())
+            db.event.remove(db.engine, "before_cursor_execute", count_statement)
+            self.assertEqual(len(statements), 0)
+            self.assertEqual(user_cache.stats()["hits"], 1)
+
+            # Changes to the user invalidate the cached user.
+            status = auth.controllers.change_username(
+                loaded_user, "new_username")
+            self.assertTrue(status)
+            self.assertIsNone(user_cache.get(user_id))
+            loaded_user = auth.controllers.load_user(user_id)
+            self.assertEqual(loaded_user.username, "new_username")
+
+            # Changes committed by other workers bump the shared generation.
+            self.assertIsNotNone(user_cache.get(user_id))
+            user_table = auth.models.User.__table__
+            db.session.execute(user_table.update().where(
+                user_table.c.id == user_id).values(username="other_username"))
+            db.session.commit()
+            self.app.extensions["page_cache"].invalidate(
+                "user:{}".format(user_id))
+            self.assertIsNotNone(user_cache.get(user_id))
+            db.session.remove()
+            loaded_user = auth.controllers.load_user(user_id)
+            self.assertEqual(loaded_user.username, "other_username")
+
     def test_add_role(self):
         test_role = auth.controllers.add_Role(role_name="TestRole")
         self.assertIsNotNone(test_role)
@@ -299,6 +377,19 @@ class TestAuth(unittest.TestCase):
             user_searched = auth.controllers.search_by_username(
                 self.created_user_username)
             self.assertGreater(len(user_searched), 0)
+
+            user = auth.models.User.query.filter_by(
+                username=self.created_user_username).one()
+            user.username = "renamed_user"
+            db.session.commit()
+
+            self.assertEqual(
+                auth.controllers.search_by_username(
+                    self.created_user_username),
+                [])
+            self.assertEqual(
+                auth.controllers.search_by_username("renamed"),
+                [user])
     
     def test_account_creation(self):
         with self.app.app_context():
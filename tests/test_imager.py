@@ -3,6 +3,7 @@ import os
 import re
 import uuid
 import shutil
+import datetime
 
 from bcrypt import (
     gensalt,
@@ -14,10 +15,13 @@ from unittest import mock
 import werkzeug
 from werkzeug.datastructures import FileStorage
 
+from PIL import Image
+
 import apps.api as api
 import apps.auth as auth
 import apps.imager as imager
 from apps import create_app, db
+from apps.cache import PageCache, SQLiteCache
 
 
 class TestImager(unittest.TestCase):
@@ -224,6 +228,22 @@ class TestImager(unittest.TestCase):
             self.assertIsInstance(data_dict, list)
             self.assertGreater(len(data_dict), 0)
     
+    def test_get_user_votes(self):
+        with self.app.app_context():
+            user = auth.models.User().query.filter_by(
+                username=self.created_user_username
+            ).first()
+            user_votes = imager.controllers.get_user_votes(
+                user, [self.file_name])
+            self.assertEqual(user_votes, {})
+
+            imager.controllers.downvote(user, self.file_name)
+            user_votes = imager.controllers.get_user_votes(
+                user, [self.file_name, "not_image_id"])
+            self.assertEqual(
+                user_votes,
+                {self.file_name: imager.models.VoteEnum.DOWNVOTE.value})
+
     def test_update_gallery(self):
         with self.app.app_context():
             image_content = imager.models.ImageContent.query.order_by(
@@ -377,6 +397,7 @@ class TestImager(unittest.TestCase):
     def test_get_imagecontent_neighbours(self):
         with self.app.app_context():
             image_content_1 = imager.models.ImageContent.query.one_or_none()
+            image_content_1.upload_time = datetime.datetime(2021, 1, 1)
             user_content = imager.models.UserContent.query.one_or_none()
 
             # Add two more image_content for testing.
@@ -384,36 +405,66 @@ class TestImager(unittest.TestCase):
                 user_content_id=user_content.id,
                 file_id="123",
                 title="img_2",
-                description="")
+                description="",
+                upload_time=datetime.datetime(2021, 1, 2))
             db.session.add(image_content_2)
 
             image_content_3 = imager.models.ImageContent(
                 user_content_id=user_content.id,
                 file_id="456",
                 title="img_3",
-                description="")
+                description="",
+                upload_time=datetime.datetime(2021, 1, 2))
             db.session.add(image_content_3)
             db.session.commit()
 
-            all_image_contents = imager.models.ImageContent.query.all()
+            all_image_contents = imager.controllers.get_image_contents_by_time(
+                "asc")
 
             neighbours_img_1 = imager.controllers.get_imagecontent_neighbours(
                 image_content_1,
-                all_image_contents)
+                all_image_contents,
+                "upload_time",
+                "asc")
             self.assertIsNone(neighbours_img_1["prev"])
             self.assertEqual(neighbours_img_1["next"].title, "img_2")
             
             neighbours_img_2 = imager.controllers.get_imagecontent_neighbours(
                 image_content_2,
-                all_image_contents)
+                all_image_contents,
+                "upload_time",
+                "asc")
             self.assertEqual(neighbours_img_2["prev"].title, self.img_title)
             self.assertEqual(neighbours_img_2["next"].title, "img_3")
 
             neighbours_img_3 = imager.controllers.get_imagecontent_neighbours(
                 image_content_3,
-                all_image_contents)
+                all_image_contents,
+                "upload_time",
+                "asc")
             self.assertEqual(neighbours_img_3["prev"].title, "img_2")
             self.assertIsNone(neighbours_img_3["next"])
+
+            # Descending score order, img_3 has the highest score.
+            image_content_3.score = 1
+            db.session.commit()
+            score_image_contents = imager.controllers.get_image_contents_by_score(
+                "desc")
+            neighbours_img_3 = imager.controllers.get_imagecontent_neighbours(
+                image_content_3,
+                score_image_contents,
+                "score",
+                "desc")
+            self.assertIsNone(neighbours_img_3["prev"])
+            self.assertEqual(neighbours_img_3["next"].title, "img_2")
+
+            neighbours_img_1 = imager.controllers.get_imagecontent_neighbours(
+                image_content_1,
+                score_image_contents,
+                "score",
+                "desc")
+            self.assertEqual(neighbours_img_1["prev"].title, "img_2")
+            self.assertIsNone(neighbours_img_1["next"])
     
     def test_load_user_images(self):
         with self.app.app_context():
@@ -453,6 +504,148 @@ class TestImager(unittest.TestCase):
                 get_list=False)
             self.assertNotIsInstance(no_title_obj, list)
 
+    def test_search_index_sync(self):
+        with self.app.app_context():
+            image_content = imager.models.ImageContent.query.filter_by(
+                file_id=self.file_name).one()
+            image_contents = [
+                imager.models.ImageContent(
+                    user_content_id=image_content.user_content_id,
+                    file_id="search_{}".format(index),
+                    title="Sunset {}".format(index),
+                    description="Beach at dusk")
+                for index in range(3)]
+            db.session.add_all(image_contents)
+            db.session.commit()
+
+            self.assertEqual(
+                len(imager.controllers.search_by_title("sun be")),
+                3)
+            self.assertEqual(
+                len(imager.controllers.search_by_title("sun", limit=2)),
+                2)
+            self.assertEqual(imager.controllers.search_by_title("unset"), [])
+            self.assertEqual(imager.controllers.search_by_title("%_"), [])
+
+            image_contents[0].title = "Sunrise"
+            db.session.delete(image_contents[1])
+            db.session.commit()
+
+            self.assertEqual(
+                [result.file_id for result in
+                 imager.controllers.search_by_title("sunset")],
+                ["search_2"])
+            self.assertEqual(
+                [result.file_id for result in
+                 imager.controllers.search_by_title("sunr dus")],
+                ["search_0"])
+
+    def test_search_pagination(self):
+        with self.app.app_context():
+            image_content = imager.models.ImageContent.query.filter_by(
+                file_id=self.file_name).one()
+            db.session.add_all([
+                imager.models.ImageContent(
+                    user_content_id=image_content.user_content_id,
+                    file_id="search_{}".format(index),
+                    title="Sunset {}".format(index))
+                for index in range(5)])
+            db.session.commit()
+
+            images_pagination, has_more = \
+                imager.controllers.search_pagination("sun", per_page=2)
+            self.assertEqual(images_pagination.total, 5)
+            self.assertEqual(images_pagination.pages, 3)
+            self.assertEqual(len(images_pagination.items), 2)
+            self.assertFalse(has_more)
+
+            images_pagination, _ = imager.controllers.search_pagination(
+                "sun",
+                page=3,
+                per_page=2)
+            self.assertEqual(len(images_pagination.items), 1)
+
+            images_pagination, _ = imager.controllers.search_pagination(
+                "sun",
+                page=4,
+                per_page=2)
+            self.assertIsNone(images_pagination)
+
+            self.app.config["SEARCH_MAX_RESULTS"] = 3
+            images_pagination, has_more = \
+                imager.controllers.search_pagination("sun", per_page=2)
+            self.assertEqual(images_pagination.total, 3)
+            self.assertTrue(has_more)
+
+            images_pagination, _ = imager.controllers.search_pagination(
+                "sun",
+                page=2,
+                per_page=2)
+            self.assertEqual(len(images_pagination.items), 1)
+
+            response = self.client.get("/gallery/search?q=sun&page=9")
+            self.assertEqual(response.status_code, 404)
+
+    def test_gallery_page_cache(self):
+        with self.app.app_context():
+            page_cache = self.app.extensions["page_cache"]
+
+            response = self.client.get("/upload_time/desc")
+            self.assertIn(self.img_title, response.get_data(as_text=True))
+            response = self.client.get("/upload_time/desc")
+            self.assertEqual(page_cache.stats()["hits"], 1)
+            self.assertEqual(page_cache.stats()["misses"], 1)
+
+            # Writes invalidate cached pages.
+            image_content = imager.models.ImageContent.query.filter_by(
+                file_id=self.file_name).one()
+            self.assertTrue(imager.controllers.update_gallery(
+                image_content,
+                {"title": "Edited Title"}))
+            response = self.client.get("/upload_time/desc")
+            self.assertIn("Edited Title", response.get_data(as_text=True))
+
+            user = auth.models.User.query.filter_by(
+                username=self.created_user_username).one()
+            self.assertTrue(imager.controllers.upvote(user, self.file_name))
+            response = self.client.get("/score/desc")
+            response = self.client.get("/score/desc")
+            self.assertEqual(page_cache.stats()["hits"], 2)
+            self.assertEqual(page_cache.stats()["misses"], 3)
+
+    def test_sqlite_cache(self):
+        cache_path = os.path.join(self.upload_path, "cache.sqlite3")
+        cache = SQLiteCache(cache_path, ttl=30, maxsize=2)
+        other_cache = SQLiteCache(cache_path, ttl=30, maxsize=2)
+
+        cache.set("page:1", {"images": ["a"]})
+        self.assertEqual(other_cache.get("page:1"), {"images": ["a"]})
+        self.assertIsNone(other_cache.get("page:2"))
+
+        self.assertEqual(cache.incr("generation:gallery"), 1)
+        self.assertEqual(other_cache.incr("generation:gallery"), 2)
+        self.assertEqual(cache.counter("generation:gallery"), 2)
+
+        cache.set("page:2", [2])
+        cache.set("page:3", [3])
+        self.assertIsNone(cache.get("page:1"))
+        self.assertEqual(cache.stats()["size"], 2)
+
+        loads = []
+
+        def load():
+            loads.append(1)
+            return ["image"]
+
+        page_cache = PageCache(cache)
+        for _ in range(2):
+            self.assertEqual(
+                page_cache.get_or_load("gallery", ("score", 1), load),
+                ["image"])
+        page_cache.invalidate("gallery")
+        page_cache.get_or_load("gallery", ("score", 1), load)
+        self.assertEqual(len(loads), 2)
+
     def test_search_by_tags(self):
         with self.app.app_context():
             tag = imager.controllers.search_by_tags(self.tag_name[:2])
@@ -515,19 +708,430 @@ class TestImager(unittest.TestCase):
             self.assertTrue(status)
             self.assertIsNotNone(image_content)
             
-            image_path = os.path.join(
+            # Stored once per content hash.
+            image_path = imager.utils.get_blob_path(
                 self.upload_path,
-                image_content.user_content.content_location,
-                image_content.file_id + ".jpg")
+                image_content.content_hash,
+                "jpg")
+            thumbnail_path = imager.derivatives.derivative_path(
+                image_path,
+                "thumbnail")
+            self.assertTrue(os.path.exists(image_path))
+            self.assertTrue(os.path.exists(thumbnail_path))
+
+            self.assertEqual(image_content.file_extension, "jpg")
+            self.assertEqual(
+                image_content.file_size,
+                os.path.getsize(self.img_path))
+            self.assertEqual(
+                (image_content.width, image_content.height),
+                (512, 512))
+            self.assertEqual(
+                image_content.content_hash,
+                imager.metadata.hash_file(self.img_path))
+            self.assertEqual(
+                image_content.dhash,
+                imager.similarity.dhash(self.img_path))
+
+            # Renditions are only created for sizes smaller than the image.
+            rendition_path = imager.derivatives.derivative_path(
+                image_path,
+                "480")
+            self.assertTrue(os.path.exists(rendition_path))
+            with Image.open(rendition_path) as rendition_image:
+                self.assertEqual(rendition_image.size, (480, 480))
+            self.assertFalse(os.path.exists(
+                imager.derivatives.derivative_path(image_path, "1024")))
+
+    def test_generate_derivatives_exif_orientation(self):
+        # Landscape image stored with EXIF orientation rotating it to portrait.
+        image_path = os.path.join(self.upload_path, "exif_test.jpg")
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        Image.new("RGB", (2400, 1200), "red").save(image_path, exif=exif)
+
+        thumbnail_path = os.path.join(self.upload_path, "exif_thumbnail.jpg")
+        imager.derivatives.generate_thumbnail(image_path, thumbnail_path)
+        with Image.open(thumbnail_path) as thumbnail_image:
+            self.assertEqual(thumbnail_image.size, (240, 240))
+
+        rendition_path = os.path.join(self.upload_path, "exif_rendition.jpg")
+        imager.derivatives.generate_rendition(
+            image_path,
+            rendition_path,
+            (480, 480))
+        with Image.open(rendition_path) as rendition_image:
+            self.assertEqual(rendition_image.size, (240, 480))
+            self.assertIsNone(rendition_image.getexif().get(0x0112))
+
+    def test_save_user_image_palette(self):
+        with self.app.app_context():
+            user = auth.models.User().query.filter_by(
+                username=self.created_user_username).first()
+
+            # Modes Image.reduce doesn't support are converted or resized.
+            gradient = Image.linear_gradient("L").resize((2000, 1500))
+            for mode in ["P", "1", "I;16"]:
+                stream = io.BytesIO()
+                gradient.convert(mode).save(stream, format="PNG")
+                stream.seek(0)
+                uploaded_file = FileStorage(
+                    stream=stream,
+                    filename="palette.png",
+                    name='file',
+                    content_type='image/png')
+                self.assertTrue(imager.controllers.save_user_image(
+                    user,
+                    uploaded_file,
+                    {"title": "Mode " + mode}))
+
+                image_content = imager.models.ImageContent.query.filter_by(
+                    title="Mode " + mode).one()
+                image_path = imager.utils.get_blob_path(
+                    self.upload_path,
+                    image_content.content_hash,
+                    "png")
+                thumbnail_path = imager.derivatives.derivative_path(
+                    image_path,
+                    "thumbnail")
+                with Image.open(thumbnail_path) as thumbnail_image:
+                    self.assertEqual(
+                        thumbnail_image.size,
+                        imager.derivatives.THUMBNAIL_SIZE)
+
+    def test_save_user_image_duplicate_blob(self):
+        with self.app.app_context():
+            user = auth.models.User().query.filter_by(
+                username=self.created_user_username).first()
+
+            file_ids = []
+            with mock.patch(
+                    "apps.imager.controllers.generate_derivatives",
+                    wraps=imager.derivatives.generate_derivatives) as generate:
+                for title in ["First Copy", "Second Copy"]:
+                    with open(self.img_path, "rb") as f:
+                        uploaded_file = FileStorage(
+                            stream=io.BytesIO(f.read()),
+                            filename="test_image_512.jpg",
+                            name='file',
+                            content_type='image/jpg')
+                    self.assertTrue(imager.controllers.save_user_image(
+                        user,
+                        uploaded_file,
+                        {"title": title}))
+                    file_ids.append(imager.models.ImageContent.query.filter_by(
+                        title=title).one().file_id)
+                # Derivatives of the first copy are reused.
+                self.assertEqual(generate.call_count, 1)
+
+            blob = imager.models.ImageBlob.query.one()
+            self.assertEqual(blob.ref_count, 2)
+            blob_path = imager.utils.get_blob_path(
+                self.upload_path,
+                blob.content_hash,
+                blob.file_extension)
+            thumbnail_path = imager.derivatives.derivative_path(
+                blob_path,
+                "thumbnail")
+
+            for file_id in file_ids:
+                response = self.client.get(f"/upload/thumbnail/{file_id}")
+                self.assertEqual(response.status_code, 200)
+                response.close()
+
+            # Files are kept while the blob is referenced.
+            status, _, _ = imager.controllers.delete_user_content(
+                user,
+                file_ids[0])
+            self.assertTrue(status)
+            db.session.refresh(blob)
+            self.assertEqual(blob.ref_count, 1)
+            self.assertTrue(os.path.exists(blob_path))
+            self.assertTrue(os.path.exists(thumbnail_path))
+
+            status, _, _ = imager.controllers.delete_user_content(
+                user,
+                file_ids[1])
+            self.assertTrue(status)
+            self.assertIsNone(imager.models.ImageBlob.query.one_or_none())
+            self.assertFalse(os.path.exists(blob_path))
+            self.assertFalse(os.path.exists(thumbnail_path))
+
+            # Files of a blob uploaded again before they're removed are kept.
+            with open(self.img_path, "rb") as f:
+                uploaded_file = FileStorage(
+                    stream=io.BytesIO(f.read()),
+                    filename="test_image_512.jpg",
+                    name='file',
+                    content_type='image/jpg')
+            self.assertTrue(imager.controllers.save_user_image(
+                user,
+                uploaded_file,
+                {"title": "Third Copy"}))
+            self.assertFalse(
+                imager.controllers.delete_unreferenced_blob(blob_path))
+            self.assertTrue(os.path.exists(blob_path))
+            blob = imager.models.ImageBlob.query.one()
+            self.assertEqual(blob.ref_count, 1)
+
+    def test_save_user_image_public_thumbnail(self):
+        public_path = os.path.join(self.upload_path, "t")
+        self.app.config["PUBLIC_THUMBNAIL_URL"] = "/media/t"
+        self.app.config["PUBLIC_THUMBNAIL_PATH"] = public_path
+
+        with open(self.img_path, "rb") as f:
+            uploaded_file = FileStorage(
+                stream=io.BytesIO(f.read()),
+                filename="test_image_512.jpg",
+                name='file',
+                content_type='image/jpg')
+        with self.app.app_context():
+            user = auth.models.User().query.filter_by(
+                username=self.created_user_username).first()
+            status = imager.controllers.save_user_image(
+                user,
+                uploaded_file,
+                {"title": "Public Title"})
+            self.assertTrue(status)
+
+            image_content = imager.models.ImageContent.query.filter_by(
+                title="Public Title").one()
+            self.assertTrue(image_content.thumbnail_published)
 
             thumbnail_path = os.path.join(
+                image_content.content_hash[:2],
+                image_content.file_id + ".jpg")
+            self.assertTrue(os.path.exists(
+                os.path.join(public_path, thumbnail_path)))
+
+            # Pages link to the published thumbnail, unpublished thumbnails
+            # are served by the app.
+            response = self.client.get("/")
+            self.assertIn(
+                f"/media/t/{thumbnail_path}".encode(),
+                response.data)
+            self.assertIn(
+                f"/upload/thumbnail/{self.file_name}".encode(),
+                response.data)
+
+            imager.controllers.delete_image_file(
                 self.upload_path,
                 image_content.user_content.content_location,
-                'thumbnails',
-                image_content.file_id + ".jpg")
-            self.assertTrue(os.path.exists(image_path))
+                image_content.file_id)
+            self.assertFalse(os.path.exists(
+                os.path.join(public_path, thumbnail_path)))
+
+    def test_dhash_near_duplicates(self):
+        image_path = os.path.join(self.upload_path, "dhash.jpg")
+        gradient = Image.linear_gradient("L").resize((800, 600))
+        Image.merge("RGB", (
+            gradient,
+            gradient.transpose(Image.Transpose.ROTATE_90).resize((800, 600)),
+            gradient)).save(image_path, quality=95)
+
+        copy_path = os.path.join(self.upload_path, "dhash_copy.png")
+        with Image.open(image_path) as image:
+            image.resize((400, 300)).save(copy_path)
+
+        different_path = os.path.join(self.upload_path, "dhash_other.jpg")
+        with Image.open(image_path) as image:
+            image.transpose(Image.Transpose.ROTATE_180).save(different_path)
+
+        image_hash = int(imager.similarity.dhash(image_path), 16)
+        self.assertLessEqual(
+            imager.similarity.hamming_distance(
+                image_hash,
+                int(imager.similarity.dhash(copy_path), 16)),
+            imager.similarity.MAX_HASH_DISTANCE)
+        self.assertGreater(
+            imager.similarity.hamming_distance(
+                image_hash,
+                int(imager.similarity.dhash(different_path), 16)),
+            imager.similarity.MAX_HASH_DISTANCE)
+
+    def test_get_supported_formats(self):
+        # Unknown formats are filtered out without checking Pillow features.
+        with mock.patch("PIL.features.check") as mock_check:
+            formats = imager.derivatives.get_supported_formats(
+                ["webp", "avif", "unknown"])
+            mock_check.assert_not_called()
+        self.assertNotIn("unknown", formats)
+        self.assertFalse(imager.derivatives.is_format_supported("unknown"))
+        self.assertEqual(
+            imager.derivatives.get_supported_formats(["webp", "avif"]),
+            formats)
+
+    def test_bk_tree_search(self):
+        hashes = [(index * 0x9E3779B97F4A7C15) % (1 << 64)
+                  for index in range(500)]
+        tree = imager.similarity.BKTree()
+        for index, hash_value in enumerate(hashes):
+            tree.add(hash_value, index)
+        self.assertEqual(tree.size, 500)
+
+        for hash_value in hashes[:20]:
+            expected = sorted(
+                (imager.similarity.hamming_distance(hash_value, other), index)
+                for index, other in enumerate(hashes)
+                if imager.similarity.hamming_distance(
+                    hash_value, other) <= 20)
+            self.assertEqual(tree.search(hash_value, 20), expected)
+
+    def test_similarity_index_refresh(self):
+        with self.app.app_context():
+            user_content = imager.models.UserContent.query.one_or_none()
+            similarity_index = imager.similarity.SimilarityIndex()
+            similarity_index.refresh()
+            self.assertTrue(similarity_index.built)
+
+            for file_id, hash_value in [
+                    ("123", "f0f0f0f0f0f0f0f0"),
+                    ("456", "f0f0f0f0f0f0f0f1")]:
+                db.session.add(imager.models.ImageContent(
+                    user_content_id=user_content.id,
+                    file_id=file_id,
+                    title=file_id,
+                    dhash=hash_value))
+            db.session.commit()
+
+            # Searches skip refreshing while another refresh is running.
+            with similarity_index._refresh_lock:
+                self.assertEqual(
+                    similarity_index.search("f0f0f0f0f0f0f0f0"), [])
+            self.assertEqual(
+                similarity_index.search("f0f0f0f0f0f0f0f0"),
+                [(0, "123"), (1, "456")])
+
+            # Rebuilding drops deleted images.
+            imager.models.ImageContent.query.filter_by(
+                file_id="456").delete()
+            db.session.commit()
+            similarity_index.build()
+            self.assertEqual(
+                similarity_index.search("f0f0f0f0f0f0f0f0"),
+                [(0, "123")])
+
+    def test_hash_unhashed_images(self):
+        with self.app.app_context():
+            self.assertEqual(
+                imager.similarity.hash_unhashed_images(),
+                (1, 0))
+            image_content = imager.models.ImageContent.query.filter_by(
+                file_id=self.file_name).one()
+            self.assertEqual(
+                image_content.dhash,
+                imager.similarity.dhash(self.img_path))
+            self.assertEqual(
+                imager.similarity.hash_unhashed_images(),
+                (0, 0))
+
+    def test_backfill_file_metadata(self):
+        with self.app.app_context():
+            updated, skipped = imager.metadata.backfill_file_metadata()
+            self.assertEqual((updated, skipped), (1, 0))
+
+            image_content = imager.models.ImageContent.query.filter_by(
+                file_id=self.file_name).one()
+            self.assertEqual(image_content.file_extension, "jpg")
+            self.assertEqual(
+                image_content.file_size,
+                os.path.getsize(self.img_path))
+
+            # Stored file extension is used instead of a directory scan.
+            with mock.patch("glob.glob") as mock_glob:
+                response = self.client.get(f"/upload/image/{self.file_name}")
+                self.assertEqual(response.status_code, 200)
+                response.close()
+                mock_glob.assert_not_called()
+
+            self.assertEqual(
+                imager.metadata.backfill_file_metadata(),
+                (0, 0))
+
+    def test_save_user_image_async_thumbnail(self):
+        self.app.config["THUMBNAIL_ASYNC"] = True
+        image_details = {
+            "title": "Async Title",
+            "description": "Some Description."
+        }
+
+        with open(self.img_path, "rb") as f:
+            stream = io.BytesIO(f.read())
+
+        uploaded_file = FileStorage(
+            stream=stream,
+            filename="test_image_512.jpg",
+            name='file',
+            content_type='image/jpg')
+        with self.app.app_context():
+            user = auth.models.User().query.filter_by(
+                username=self.created_user_username
+            ).first()
+
+            status = imager.controllers.save_user_image(
+                user,
+                uploaded_file,
+                image_details)
+            self.assertTrue(status)
+
+            image_content = imager.models.ImageContent.query.filter_by(
+                title=image_details["title"]).one_or_none()
+            thumbnail_path = imager.derivatives.derivative_path(
+                imager.utils.get_blob_path(
+                    self.upload_path,
+                    image_content.content_hash,
+                    "jpg"),
+                "thumbnail")
+            self.assertFalse(os.path.exists(thumbnail_path))
+
+            job = imager.models.DerivativeJob.query.filter_by(
+                image_file_id=image_content.file_id,
+                kind="thumbnail").one_or_none()
+            self.assertEqual(job.kind, "thumbnail")
+            self.assertEqual(
+                job.status,
+                imager.models.JobStatusEnum.PENDING.value)
+
+            # Perceptual hash is computed by the thumbnail job.
+            self.assertIsNone(image_content.dhash)
+            similarity_index = imager.similarity.get_similarity_index()
+            similarity_index.refresh()
+
+            # Original image is served until thumbnail is generated.
+            response = self.client.get(
+                f"/upload/thumbnail/{image_content.file_id}")
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.cache_control.no_cache)
+            pending_etag = response.get_etag()[0]
+            response.close()
+
+            processed = imager.derivatives.process_derivative_jobs()
+            self.assertEqual(
+                processed,
+                1 + len(self.app.config["IMAGE_RENDITIONS"]))
             self.assertTrue(os.path.exists(thumbnail_path))
 
+            # ETag of the original image served in its place doesn't match.
+            response = self.client.get(
+                f"/upload/thumbnail/{image_content.file_id}",
+                headers={"If-None-Match": f'"{pending_etag}"'})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.cache_control.immutable)
+            response.close()
+
+            db.session.refresh(job)
+            self.assertEqual(job.status, imager.models.JobStatusEnum.DONE.value)
+            self.assertEqual(job.attempts, 1)
+            self.assertEqual(imager.derivatives.process_derivative_jobs(), 0)
+
+            db.session.refresh(image_content)
+            self.assertEqual(
+                image_content.dhash,
+                imager.similarity.dhash(self.img_path))
+            self.assertIn(
+                (0, image_content.file_id),
+                similarity_index.search(image_content.dhash))
+
     def test_image_content_pagination(self):
         with self.app.app_context():
             image_contents = imager.models.ImageContent.query
@@ -541,6 +1145,64 @@ class TestImager(unittest.TestCase):
                     image_contents,
                     page=10)
     
+    def test_image_content_keyset_pagination(self):
+        with self.app.app_context():
+            user_content = imager.models.UserContent.query.one_or_none()
+            image_content = imager.models.ImageContent.query.one_or_none()
+            image_content.upload_time = datetime.datetime(2021, 1, 1)
+
+            # Images sharing upload time are ordered by id.
+            for index in range(3):
+                db.session.add(imager.models.ImageContent(
+                    user_content_id=user_content.id,
+                    file_id="keyset_{}".format(index),
+                    title="img_{}".format(index),
+                    upload_time=datetime.datetime(2021, 1, 2)))
+            db.session.commit()
+
+            image_contents = imager.controllers.get_image_contents_by_time(
+                "desc")
+            first_page, next_cursor = imager.controllers.image_content_keyset_pagination(
+                image_contents,
+                "upload_time",
+                "desc",
+                per_page=2)
+            self.assertEqual(
+                [image.title for image in first_page],
+                ["img_2", "img_1"])
+            self.assertIsNotNone(next_cursor)
+
+            second_page, next_cursor = imager.controllers.image_content_keyset_pagination(
+                image_contents,
+                "upload_time",
+                "desc",
+                cursor=next_cursor,
+                per_page=2)
+            self.assertEqual(
+                [image.title for image in second_page],
+                ["img_0", self.img_title])
+            self.assertIsNone(next_cursor)
+
+            # Cursor created for a different sort order is invalid.
+            _, next_cursor = imager.controllers.image_content_keyset_pagination(
+                image_contents,
+                "upload_time",
+                "desc",
+                per_page=1)
+            invalid_page, _ = imager.controllers.image_content_keyset_pagination(
+                imager.controllers.get_image_contents_by_time("asc"),
+                "upload_time",
+                "asc",
+                cursor=next_cursor)
+            self.assertIsNone(invalid_page)
+
+            invalid_page, _ = imager.controllers.image_content_keyset_pagination(
+                image_contents,
+                "upload_time",
+                "desc",
+                cursor="not_a_cursor")
+            self.assertIsNone(invalid_page)
+
     def test_upvote(self):
         with self.app.app_context():
             user = auth.models.User().query.filter_by(
@@ -569,12 +1231,250 @@ class TestImager(unittest.TestCase):
             self.assertIsNotNone(downvote_obj)
             self.assertEqual(downvote_obj.vote, imager.models.VoteEnum.DOWNVOTE.value)
     
+    def test_update_image_score(self):
+        with self.app.app_context():
+            user = auth.models.User().query.filter_by(
+                username=self.created_user_username
+            ).first()
+            image_content = imager.models.ImageContent.query.filter_by(
+                file_id=self.file_name).one_or_none()
+
+            imager.controllers.upvote(user, self.file_name)
+            db.session.refresh(image_content)
+            self.assertEqual(image_content.score, 1)
+            self.assertEqual(image_content.upvotes, 1)
+            self.assertEqual(image_content.downvotes, 0)
+
+            # Switching vote moves it from upvotes to downvotes.
+            imager.controllers.downvote(user, self.file_name)
+            db.session.refresh(image_content)
+            self.assertEqual(image_content.score, -1)
+            self.assertEqual(image_content.upvotes, 0)
+            self.assertEqual(image_content.downvotes, -1)
+
+            # Voting again removes the vote.
+            imager.controllers.downvote(user, self.file_name)
+            db.session.refresh(image_content)
+            self.assertEqual(image_content.score, 0)
+            self.assertEqual(image_content.upvotes, 0)
+            self.assertEqual(image_content.downvotes, 0)
+
+    def test_vote_image(self):
+        with self.app.app_context():
+            user = auth.models.User().query.filter_by(
+                username=self.created_user_username
+            ).first()
+            upvote = imager.models.VoteEnum.UPVOTE.value
+            downvote = imager.models.VoteEnum.DOWNVOTE.value
+
+            metric_data = imager.controllers.vote_image(
+                user, self.file_name, upvote)
+            self.assertEqual(metric_data["total"], 1)
+            self.assertEqual(metric_data["upvotes"], 1)
+
+            metric_data = imager.controllers.vote_image(
+                user, self.file_name, downvote)
+            self.assertEqual(metric_data["total"], -1)
+            self.assertEqual(metric_data["upvotes"], 0)
+            self.assertEqual(metric_data["downvotes"], -1)
+
+            metric_data = imager.controllers.vote_image(
+                user, self.file_name, downvote)
+            self.assertEqual(metric_data["total"], "--")
+
+            # Toggling a vote never leaves more than one vote per user.
+            votes = imager.models.VoteCounter.query.filter_by(
+                user_id=user.id,
+                image_file_id=self.file_name).count()
+            self.assertEqual(votes, 0)
+
+            metric_data = imager.controllers.vote_image(
+                user, "invalid_file_id", upvote)
+            self.assertIsNone(metric_data)
+            votes = imager.models.VoteCounter.query.filter_by(
+                image_file_id="invalid_file_id").count()
+            self.assertEqual(votes, 0)
+
+    def test_vote_image_without_upsert(self):
+        with self.app.app_context():
+            user = auth.models.User().query.filter_by(
+                username=self.created_user_username
+            ).first()
+            upvote = imager.models.VoteEnum.UPVOTE.value
+            downvote = imager.models.VoteEnum.DOWNVOTE.value
+
+            # Databases without ON CONFLICT toggle existing votes too.
+            with mock.patch(
+                    "apps.imager.controllers.get_dialect_insert",
+                    return_value=None):
+                metric_data = imager.controllers.vote_image(
+                    user, self.file_name, upvote)
+                self.assertEqual(metric_data["total"], 1)
+
+                metric_data = imager.controllers.vote_image(
+                    user, self.file_name, downvote)
+                self.assertEqual(metric_data["total"], -1)
+
+                metric_data = imager.controllers.vote_image(
+                    user, self.file_name, downvote)
+                self.assertEqual(metric_data["total"], "--")
+
+    def test_vote_write_behind(self):
+        self.app.config["VOTE_WRITE_BEHIND"] = True
+        self.app.config["VOTE_FLUSH_INTERVAL"] = 0
+        with self.app.app_context():
+            user = auth.models.User().query.filter_by(
+                username=self.created_user_username
+            ).first()
+            upvote = imager.models.VoteEnum.UPVOTE.value
+            vote_buffer = imager.vote_buffer.vote_buffer
+
+            metric_data = imager.controllers.vote_image(
+                user, self.file_name, upvote)
+            self.assertEqual(metric_data["total"], 1)
+
+            # Buffered votes are served before they are flushed.
+            vote = imager.models.VoteCounter.query.filter_by(
+                user_id=user.id,
+                image_file_id=self.file_name).one_or_none()
+            self.assertIsNone(vote)
+            user_votes = imager.controllers.get_user_votes(
+                user, [self.file_name])
+            self.assertEqual(user_votes[self.file_name], upvote)
+
+            self.assertEqual(vote_buffer.flush(), 1)
+            vote = imager.models.VoteCounter.query.filter_by(
+                user_id=user.id,
+                image_file_id=self.file_name).one_or_none()
+            self.assertEqual(vote.vote, upvote)
+            metric_data = imager.controllers.image_metric(self.file_name)
+            self.assertEqual(metric_data["total"], 1)
+
+            # Voting again removes the flushed vote.
+            metric_data = imager.controllers.vote_image(
+                user, self.file_name, upvote)
+            self.assertEqual(metric_data["total"], "--")
+            user_votes = imager.controllers.get_user_votes(
+                user, [self.file_name])
+            self.assertNotIn(self.file_name, user_votes)
+
+            self.assertEqual(vote_buffer.flush(), 1)
+            votes = imager.models.VoteCounter.query.filter_by(
+                user_id=user.id).count()
+            self.assertEqual(votes, 0)
+            image_content = imager.models.ImageContent.query.filter_by(
+                file_id=self.file_name).one_or_none()
+            self.assertEqual(image_content.score, 0)
+            self.assertEqual(image_content.upvotes, 0)
+
+            metric_data = imager.controllers.vote_image(
+                user, "invalid_file_id", upvote)
+            self.assertIsNone(metric_data)
+            self.assertEqual(vote_buffer.flush(), 0)
+
+    def test_vote_write_behind_deleted_image(self):
+        self.app.config["VOTE_WRITE_BEHIND"] = True
+        self.app.config["VOTE_FLUSH_INTERVAL"] = 0
+        with self.app.app_context():
+            user = auth.models.User().query.filter_by(
+                username=self.created_user_username
+            ).first()
+            user_content = imager.models.UserContent.query.one_or_none()
+            upvote = imager.models.VoteEnum.UPVOTE.value
+            vote_buffer = imager.vote_buffer.vote_buffer
+
+            for file_id in ["123", "456"]:
+                db.session.add(imager.models.ImageContent(
+                    user_content_id=user_content.id,
+                    file_id=file_id,
+                    title="img_{}".format(file_id),
+                    description=""))
+            db.session.commit()
+
+            for file_id in [self.file_name, "123", "456"]:
+                imager.controllers.vote_image(user, file_id, upvote)
+
+            # Deleted by another worker, votes are still buffered here.
+            imager.models.ImageContent.query.filter_by(
+                file_id="123").delete()
+            db.session.commit()
+
+            # Deleted by this worker, buffered votes are discarded.
+            status, _, _ = imager.controllers.delete_user_content(user, "456")
+            self.assertTrue(status)
+            user_votes = imager.controllers.get_user_votes(user, ["456"])
+            self.assertNotIn("456", user_votes)
+
+            self.assertEqual(vote_buffer.flush(), 1)
+            votes = imager.models.VoteCounter.query.filter_by(
+                user_id=user.id).all()
+            self.assertEqual(
+                [vote.image_file_id for vote in votes],
+                [self.file_name])
+            self.assertEqual(vote_buffer.flush(), 0)
+
+    def test_vote_write_behind_deleted_user(self):
+        self.app.config["VOTE_WRITE_BEHIND"] = True
+        self.app.config["VOTE_FLUSH_INTERVAL"] = 0
+        with self.app.app_context():
+            user = auth.models.User().query.filter_by(
+                username=self.created_user_username
+            ).first()
+            user_role = auth.models.Role.query.filter_by(
+                name=auth.auth.DEFAULT_GENERAL_USER_ROLE
+            ).one_or_none()
+            other_user = auth.models.User(
+                username="other_voter",
+                first_name="Other",
+                last_name="Voter",
+                email="othervoter@email.com",
+                password_hash="-",
+                email_confirmed=True,
+                user_role=user_role.id)
+            db.session.add(other_user)
+            db.session.commit()
+            upvote = imager.models.VoteEnum.UPVOTE.value
+            vote_buffer = imager.vote_buffer.vote_buffer
+
+            imager.controllers.vote_image(user, self.file_name, upvote)
+            imager.controllers.vote_image(other_user, self.file_name, upvote)
+
+            # Votes of users deleted before the flush don't fail the batch.
+            auth.models.User.query.filter_by(id=other_user.id).delete()
+            db.session.commit()
+
+            self.assertEqual(vote_buffer.flush(), 1)
+            votes = imager.models.VoteCounter.query.all()
+            self.assertEqual(
+                [(vote.user_id, vote.image_file_id) for vote in votes],
+                [(user.id, self.file_name)])
+            image_content = imager.models.ImageContent.query.filter_by(
+                file_id=self.file_name).one()
+            self.assertEqual(image_content.score, 1)
+
     def test_image_metric(self):
         with self.app.app_context():
             metric_data = imager.controllers.image_metric(self.file_name)
             self.assertIsNotNone(metric_data)
             self.assertIsInstance(metric_data, dict)
     
+    def test_image_metrics(self):
+        with self.app.app_context():
+            user = auth.models.User().query.filter_by(
+                username=self.created_user_username
+            ).first()
+            imager.controllers.upvote(user, self.file_name)
+
+            metrics = imager.controllers.image_metrics(
+                [self.file_name, "not_image_id"])
+            self.assertIsInstance(metrics, dict)
+            self.assertNotIn("not_image_id", metrics)
+            self.assertEqual(metrics[self.file_name]["total"], 1)
+            self.assertEqual(metrics[self.file_name]["upvotes"], 1)
+            self.assertEqual(metrics[self.file_name]["downvotes"], 0)
+
+            self.assertEqual(imager.controllers.image_metrics([]), {})
+
     def test_delete_user_content(self):
         with self.app.app_context():
             user_role = auth.models.Role.query.filter_by(
@@ -636,6 +1536,16 @@ class TestImager(unittest.TestCase):
             response = self.client.get('/')
             self.assertEqual(response.status_code, 200)
     
+    def test_load_home_page_cursor(self):
+        with self.app.app_context():
+            response = self.client.get('/score/desc?cursor=')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(re.search(
+                self.img_title, response.get_data(as_text=True)))
+
+            response = self.client.get('/score/desc?cursor=not_a_cursor')
+            self.assertEqual(response.status_code, 404)
+
     def test_load_about_page(self):
         with self.app.app_context():
             response = self.client.get('/about')
@@ -757,18 +1667,72 @@ class TestImager(unittest.TestCase):
                 title="Third Test Title").one_or_none()
             self.assertIsNotNone(uploaded_image_content)
 
-            image_path = os.path.join(
+            image_path = imager.utils.get_blob_path(
                 self.upload_path,
-                uploaded_image_content.user_content.content_location,
-                uploaded_image_content.file_id + ".jpg")
-
-            thumbnail_path = os.path.join(
-                self.upload_path,
-                uploaded_image_content.user_content.content_location,
-                'thumbnails',
-                uploaded_image_content.file_id + ".jpg")
+                uploaded_image_content.content_hash,
+                "jpg")
+            thumbnail_path = imager.derivatives.derivative_path(
+                image_path,
+                "thumbnail")
             self.assertTrue(os.path.exists(image_path))
             self.assertTrue(os.path.exists(thumbnail_path))
+
+            for image_format in imager.derivatives.get_supported_formats(
+                    self.app.config["IMAGE_DERIVATIVE_FORMATS"]):
+                self.assertTrue(os.path.exists(
+                    imager.derivatives.format_path(
+                        thumbnail_path,
+                        image_format)))
+
+            # Hashed while streamed, no temporary files are left behind.
+            self.assertEqual(
+                uploaded_image_content.content_hash,
+                imager.metadata.hash_file(self.img_path))
+            self.assertEqual(
+                os.listdir(os.path.join(
+                    self.upload_path,
+                    imager.ingest.INCOMING_DIRECTORY)),
+                [])
+
+    def test_logged_in_user_upload_invalid_image(self):
+        with self.app.app_context():
+            self.client.post(
+                '/auth/login',
+                data={
+                    "username_email": self.created_user_username,
+                    "password": self.created_user_pwd,
+                    "next": "/upload"},
+                follow_redirects=True)
+
+            response = self.client.post(
+                "/upload",
+                data={
+                    "title": "Invalid Title",
+                    "description": "Not an image.",
+                    "file": (io.BytesIO(b"GIF89a" + bytes(1024)), "fake.jpg")
+                },
+                follow_redirects=True,
+                content_type="multipart/form-data")
+            self.assertIn(b"File uploaded is not valid!", response.data)
+            self.assertIsNone(imager.models.ImageContent.query.filter_by(
+                title="Invalid Title").one_or_none())
+            self.assertEqual(
+                os.listdir(os.path.join(
+                    self.upload_path,
+                    imager.ingest.INCOMING_DIRECTORY)),
+                [])
+
+    def test_validate_image(self):
+        with open(self.img_path, "rb") as f:
+            self.assertEqual(imager.utils.validate_image(f), ".jpeg")
+            self.assertEqual(f.tell(), 0)
+        self.assertEqual(
+            imager.utils.validate_image(io.BytesIO(b"\x89PNG\r\n\x1a\n")),
+            ".png")
+        self.assertEqual(
+            imager.utils.validate_image(io.BytesIO(b"RIFF\0\0\0\0WEBPVP8 ")),
+            ".webp")
+        self.assertIsNone(imager.utils.validate_image(io.BytesIO(b"text")))
     
     def test_load_image_by_id_invalid_page(self):
         with self.app.app_context():
@@ -791,6 +1755,137 @@ class TestImager(unittest.TestCase):
             self.assertEqual(response.status_code, 200)
             response.close()  # Stops ResourceWarning.
 
+    def test_load_image_by_id_cache_headers(self):
+        with self.app.app_context():
+            for url in [
+                    f"/upload/image/{self.file_name}",
+                    f"/upload/thumbnail/{self.file_name}"]:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.cache_control.public)
+                self.assertTrue(response.cache_control.immutable)
+                self.assertEqual(response.cache_control.max_age, 31536000)
+                etag = response.get_etag()[0]
+                response.close()
+
+                # Answered without loading the image.
+                with mock.patch(
+                        "apps.imager.views.get_image_content_by_id") as mock_get:
+                    response = self.client.get(
+                        url,
+                        headers={"If-None-Match": f'"{etag}"'})
+                    self.assertEqual(response.status_code, 304)
+                    self.assertEqual(response.get_etag()[0], etag)
+                    mock_get.assert_not_called()
+
+            response = self.client.get(
+                f"/upload/image/{self.file_name}",
+                headers={"If-Modified-Since": "Wed, 21 Oct 2015 07:28:00 GMT"})
+            self.assertEqual(response.status_code, 200)
+            response.close()
+
+            # ETag of the original image doesn't match the thumbnail.
+            response = self.client.get(
+                f"/upload/thumbnail/{self.file_name}",
+                headers={"If-None-Match": f'"{self.file_name}:original"'})
+            self.assertEqual(response.status_code, 200)
+            response.close()
+
+            # ETags of other images don't match.
+            for url, etag in [
+                    ("/upload/image/missing", f"{self.file_name}:original"),
+                    ("/upload/image/missing", "x:original"),
+                    ("/upload/thumbnail/missing", "x:thumbnail.jpg")]:
+                response = self.client.get(
+                    url,
+                    headers={"If-None-Match": f'"{etag}"'})
+                self.assertEqual(response.status_code, 404)
+
+    def test_load_image_by_id_sendfile(self):
+        with self.app.app_context():
+            image_path = os.path.join(
+                self.user_upload_directory,
+                self.file_name + ".jpg")
+
+            self.app.config["MEDIA_SENDFILE"] = "x-sendfile"
+            response = self.client.get(f"/upload/image/{self.file_name}")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers["X-Sendfile"], image_path)
+            self.assertEqual(response.mimetype, "image/jpeg")
+            self.assertEqual(response.data, b"")
+
+            self.app.config["MEDIA_SENDFILE"] = "x-accel-redirect"
+            response = self.client.get(f"/upload/thumbnail/{self.file_name}")
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn("X-Sendfile", response.headers)
+            self.assertEqual(
+                response.headers["X-Accel-Redirect"],
+                f"/protected-media/{self.directory_name}/thumbnails/"
+                f"{self.file_name}.jpg")
+            self.assertTrue(response.cache_control.immutable)
+            self.assertIn("Accept", response.vary)
+            self.assertEqual(response.data, b"")
+
+            # Proxy isn't asked to send the file for conditional requests.
+            response = self.client.get(
+                f"/upload/thumbnail/{self.file_name}",
+                headers={"If-None-Match": f'"{response.get_etag()[0]}"'})
+            self.assertEqual(response.status_code, 304)
+            self.assertNotIn("X-Accel-Redirect", response.headers)
+
+    def test_load_image_rendition_by_id(self):
+        with self.app.app_context():
+            for size in [240] + self.app.config["IMAGE_RENDITIONS"]:
+                response = self.client.get(
+                    f"/upload/image/{self.file_name}/{size}")
+                self.assertEqual(response.status_code, 200)
+                response.close()
+
+            response = self.client.get(f"/upload/image/{self.file_name}/333")
+            self.assertEqual(response.status_code, 404)
+
+            response = self.client.get(f"/gallery/{self.file_name}")
+            self.assertIn(
+                f"/upload/image/{self.file_name}/1024 1024w".encode(),
+                response.data)
+
+            # Original image is shown without renditions.
+            self.app.config["IMAGE_RENDITIONS"] = []
+            response = self.client.get(f"/gallery/{self.file_name}")
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn(b"srcset", response.data)
+            self.assertIn(
+                f'src="/upload/image/{self.file_name}"'.encode(),
+                response.data)
+
+    def test_load_thumbnail_by_id_accept_format(self):
+        with self.app.app_context():
+            self.app.config["IMAGE_DERIVATIVE_FORMATS"] = ["webp"]
+            imager.derivatives.generate_derivatives(os.path.join(
+                self.user_upload_directory,
+                self.file_name + ".jpg"))
+
+            response = self.client.get(
+                f"/upload/thumbnail/{self.file_name}",
+                headers={"Accept": "image/webp,image/*,*/*;q=0.8"})
+            self.assertEqual(response.mimetype, "image/webp")
+            self.assertIn("Accept", response.vary)
+            response.close()
+
+            # Wildcards don't select a format.
+            response = self.client.get(
+                f"/upload/thumbnail/{self.file_name}",
+                headers={"Accept": "image/*,*/*;q=0.8"})
+            self.assertEqual(response.mimetype, "image/jpeg")
+            self.assertIn("Accept", response.vary)
+            response.close()
+
+            response = self.client.get(
+                f"/upload/thumbnail/{self.file_name}",
+                headers={"Accept": "image/webp;q=0,*/*"})
+            self.assertEqual(response.mimetype, "image/jpeg")
+            response.close()
+
     def test_load_thumbnail_by_id_invalid_page(self):
         with self.app.app_context():
             response = self.client.get('/upload/thumbnail/-69420')
@@ -823,6 +1918,27 @@ class TestImager(unittest.TestCase):
             response = self.client.get(f"/gallery/{image_content.file_id}")
             self.assertEqual(response.status_code, 200)
 
+    def test_load_user_gallery_page(self):
+        with self.app.app_context():
+            response = self.client.get(
+                f"/gallery/user/{self.created_user_username}/score/desc/{self.file_name}")
+            self.assertEqual(response.status_code, 200)
+
+            # Image not in the user's gallery.
+            user_role = auth.models.Role.query.one_or_none()
+            other_user = auth.models.User(
+                username="other_user",
+                first_name="Other",
+                last_name="User",
+                email="other@email.com",
+                password_hash="",
+                user_role=user_role.id)
+            db.session.add(other_user)
+            db.session.commit()
+            response = self.client.get(
+                f"/gallery/user/other_user/{self.file_name}")
+            self.assertEqual(response.status_code, 404)
+
     def test_load_gallery_search(self):
         with self.app.app_context():
             self.client.post(
@@ -1047,5 +2163,22 @@ class TestImager(unittest.TestCase):
             response = self.client.get(f"/metric/does_not_exist")
             self.assertEqual(response.status_code, 400)
 
+    def test_vote_metrics(self):
+        with self.app.app_context():
+            response = self.client.get(
+                f"/metric?image_id={self.file_name}&image_id=does_not_exist")
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(self.file_name, response.json)
+            self.assertNotIn("does_not_exist", response.json)
+
+            response = self.client.get("/metric")
+            self.assertEqual(response.status_code, 400)
+
+            max_per_page = imager.controllers.MAX_PER_PAGE
+            response = self.client.get("/metric?" + "&".join(
+                ["image_id={}".format(index)
+                 for index in range(max_per_page + 1)]))
+            self.assertEqual(response.status_code, 400)
+
 if __name__ == "__main__":
     unittest.main()